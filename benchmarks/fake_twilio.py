@@ -0,0 +1,157 @@
+"""
+Servidor falso de la API REST de Twilio para los benchmarks
+
+Responde las rutas que usa la aplicación con una latencia configurable y
+con errores inyectados, sin gastar créditos ni depender de la red.
+
+Uso:
+    python -m benchmarks.fake_twilio --port 8900 --latency-ms 80 --error-rate 0.01
+
+Y en la aplicación:
+    TWILIO_API_BASE_URL=http://127.0.0.1:8900
+"""
+from aiohttp import web
+import argparse
+import asyncio
+import itertools
+import random
+
+
+class FakeTwilio:
+    """
+    Aplicación aiohttp que imita Messages.json, AvailablePhoneNumbers e IncomingPhoneNumbers
+
+    Parámetros:
+        latency_ms (float): Latencia base de cada respuesta
+        jitter_ms (float): Variación aleatoria que se suma a la latencia (0 a jitter_ms)
+        error_rate (float): Fracción (0 a 1) de peticiones que responden con error
+        error_status (int): Código HTTP de los errores inyectados (429 = límite de tasa)
+    """
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0,
+                 error_rate: float = 0, error_status: int = 429):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._sids = itertools.count(1)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(
+            "/2010-04-01/Accounts/{account}/Messages.json", self.create_message
+        )
+        app.router.add_get(
+            "/2010-04-01/Accounts/{account}/AvailablePhoneNumbers/{country}/Local.json",
+            self.available_numbers,
+        )
+        app.router.add_get(
+            "/2010-04-01/Accounts/{account}/IncomingPhoneNumbers.json",
+            self.incoming_numbers,
+        )
+        return app
+
+    async def _simulate(self):
+        """
+        Espera la latencia configurada y retorna una respuesta de error si toca inyectarla
+        """
+        self.requests += 1
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            code = 20429 if self.error_status == 429 else 20500
+            return web.json_response(
+                {"code": code, "message": "Injected error", "status": self.error_status},
+                status=self.error_status,
+            )
+        return None
+
+    async def create_message(self, request: web.Request):
+        error = await self._simulate()
+        if error is not None:
+            return error
+
+        form = await request.post()
+        sid = f"SM{next(self._sids):032x}"
+        return web.json_response(
+            {
+                "sid": sid,
+                "account_sid": request.match_info["account"],
+                "to": form.get("To"),
+                "from": form.get("From"),
+                "body": form.get("Body"),
+                "status": "queued",
+                "num_segments": "1",
+                "direction": "outbound-api",
+            },
+            status=201,
+        )
+
+    async def available_numbers(self, request: web.Request):
+        error = await self._simulate()
+        if error is not None:
+            return error
+
+        limit = int(request.query.get("PageSize", "10"))
+        area_code = request.query.get("AreaCode", "815")
+        numbers = [
+            {
+                "phone_number": f"+1{area_code}555{index:04d}",
+                "friendly_name": f"({area_code}) 555-{index:04d}",
+                "locality": "Bench",
+                "region": "IL",
+                "iso_country": request.match_info["country"],
+                "capabilities": {"voice": True, "SMS": True, "MMS": True},
+            }
+            for index in range(limit)
+        ]
+        return web.json_response(
+            {"available_phone_numbers": numbers, "next_page_uri": None, "uri": str(request.rel_url)}
+        )
+
+    async def incoming_numbers(self, request: web.Request):
+        error = await self._simulate()
+        if error is not None:
+            return error
+
+        return web.json_response(
+            {"incoming_phone_numbers": [], "next_page_uri": None, "uri": str(request.rel_url)}
+        )
+
+
+async def start_fake_twilio(fake: FakeTwilio, host: str = "127.0.0.1", port: int = 0):
+    """
+    Inicia el servidor falso en segundo plano
+
+    Retorna:
+        tuple: (runner para detenerlo con await runner.cleanup(), URL base)
+    """
+    runner = web.AppRunner(fake.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{bound_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de la API de Twilio")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--error-status", type=int, default=429)
+    args = parser.parse_args()
+
+    fake = FakeTwilio(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status)
+    web.run_app(fake.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
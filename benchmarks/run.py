@@ -0,0 +1,306 @@
+"""
+Benchmark reproducible de los endpoints principales
+
+Levanta la aplicación con uvicorn apuntando a un servidor falso de Twilio
+(benchmarks/fake_twilio.py) y a una base de datos MongoDB local separada, y
+mide cada carga de trabajo con distintos niveles de concurrencia.
+
+Requisitos:
+    - Un MongoDB local (por defecto mongodb://localhost:27017, o MONGODB_URL)
+      ej: docker run --rm -p 27017:27017 mongo:7
+
+Uso:
+    python -m benchmarks.run
+    python -m benchmarks.run --workloads send,webhook --concurrency 1,16,64 \
+        --requests 2000 --twilio-latency-ms 80 --output bench_output.json
+    python -m benchmarks.run --app-env AUTO_REPLY_MODE=twiml --app-env MONGODB_WRITE_BEHIND=true
+
+El resultado es un JSON con el commit actual y, por cada carga y nivel de
+concurrencia, el throughput y los percentiles p50/p95/p99 de latencia, para
+comparar entre commits.
+"""
+from pymongo import MongoClient
+import argparse
+import asyncio
+import httpx
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+BENCH_DATABASE = "sms_bench"
+FAKE_ACCOUNT_SID = "AC" + "0" * 32
+SENDER_NUMBER = "+18150000000"
+
+# Cantidad de destinatarios distintos: los envíos se reparten entre ellos para
+# que el historial de cada número tenga datos que leer
+RECIPIENTS = 100
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def recipient(index: int) -> str:
+    return f"+1555{index % RECIPIENTS:07d}"
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except Exception:
+        return "unknown"
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Percentil por rango más cercano sobre una lista ya ordenada
+    """
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# CARGAS DE TRABAJO
+# Cada una recibe el cliente HTTP y el número de petición, y retorna True si fue exitosa
+
+async def send_workload(client: httpx.AsyncClient, index: int) -> bool:
+    response = await client.post(
+        "/sms/send",
+        json={"to_number": recipient(index), "message_body": f"Benchmark {index}"},
+    )
+    return response.status_code == 200 and response.json().get("success", False)
+
+
+async def webhook_workload(client: httpx.AsyncClient, index: int) -> bool:
+    response = await client.post(
+        "/sms/webhook/incoming",
+        data={
+            "MessageSid": f"SMbench{time.time_ns():x}{index:08d}",
+            "From": recipient(index),
+            "To": SENDER_NUMBER,
+            "Body": f"Benchmark {index}",
+        },
+    )
+    return response.status_code == 200
+
+
+async def history_workload(client: httpx.AsyncClient, index: int) -> bool:
+    response = await client.get(f"/sms/history/sent/{recipient(index)}", params={"limit": 50})
+    return response.status_code == 200
+
+
+async def search_workload(client: httpx.AsyncClient, index: int) -> bool:
+    response = await client.post(
+        "/phone-numbers/search", json={"country_code": "US", "area_code": "815", "limit": 10}
+    )
+    return response.status_code == 200
+
+
+WORKLOADS = {
+    "send": send_workload,
+    "webhook": webhook_workload,
+    "history": history_workload,
+    "search": search_workload,
+}
+
+
+async def run_level(base_url: str, name: str, concurrency: int, total: int) -> dict:
+    """
+    Ejecuta `total` peticiones de una carga con `concurrency` clientes en paralelo
+    """
+    workload = WORKLOADS[name]
+    latencies = []
+    errors = 0
+    counter = iter(range(total))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+
+        async def worker():
+            nonlocal errors
+            for index in counter:
+                started = time.perf_counter()
+                try:
+                    ok = await workload(client, index)
+                except httpx.HTTPError:
+                    ok = False
+                latencies.append((time.perf_counter() - started) * 1000)
+                if not ok:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "workload": name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "max_ms": round(latencies[-1], 3) if latencies else 0.0,
+    }
+
+
+async def wait_until_ready(base_url: str, process: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"Process exited with code {process.returncode}")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{base_url} did not become ready in {timeout}s")
+
+
+async def wait_for_port(port: int, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Port {port} did not open in {timeout}s")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark de la API de SMS")
+    parser.add_argument("--workloads", default="send,webhook,history",
+                        help=f"Cargas separadas por coma ({', '.join(WORKLOADS)})")
+    parser.add_argument("--concurrency", default="1,8,32",
+                        help="Niveles de concurrencia separados por coma")
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="Peticiones por carga y nivel de concurrencia")
+    parser.add_argument("--warmup", type=int, default=50,
+                        help="Peticiones de calentamiento antes de cada carga")
+    parser.add_argument("--twilio-latency-ms", type=float, default=50)
+    parser.add_argument("--twilio-jitter-ms", type=float, default=10)
+    parser.add_argument("--twilio-error-rate", type=float, default=0)
+    parser.add_argument("--twilio-error-status", type=int, default=429)
+    parser.add_argument("--app-env", action="append", default=[],
+                        help="Variable de entorno extra para la app (KEY=VALUE), se puede repetir")
+    parser.add_argument("--mongodb-url", default=os.getenv("MONGODB_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--keep-data", action="store_true",
+                        help=f"No borrar la base de datos {BENCH_DATABASE} al terminar")
+    parser.add_argument("--output", help="Archivo donde guardar el JSON (por defecto stdout)")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+    workloads = [name.strip() for name in args.workloads.split(",") if name.strip()]
+    levels = [int(level) for level in args.concurrency.split(",")]
+
+    unknown = set(workloads) - set(WORKLOADS)
+    if unknown:
+        raise SystemExit(f"Unknown workloads: {', '.join(sorted(unknown))}")
+
+    twilio_port = free_port()
+    app_port = free_port()
+    app_url = f"http://127.0.0.1:{app_port}"
+
+    fake_twilio = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.fake_twilio",
+        "--port", str(twilio_port),
+        "--latency-ms", str(args.twilio_latency_ms),
+        "--jitter-ms", str(args.twilio_jitter_ms),
+        "--error-rate", str(args.twilio_error_rate),
+        "--error-status", str(args.twilio_error_status),
+    ])
+
+    app_env = {
+        **os.environ,
+        "TWILIO_ACCOUNT_SID": FAKE_ACCOUNT_SID,
+        "TWILIO_AUTH_TOKEN": "bench",
+        "TWILIO_PHONE_NUMBER": SENDER_NUMBER,
+        "TWILIO_API_BASE_URL": f"http://127.0.0.1:{twilio_port}",
+        "MONGODB_URL": args.mongodb_url,
+        "MONGODB_DATABASE": BENCH_DATABASE,
+        "LOG_LEVEL": "WARNING",
+    }
+    for item in args.app_env:
+        key, _, value = item.partition("=")
+        app_env[key] = value
+
+    app = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app",
+         "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning"],
+        env=app_env,
+    )
+
+    results = []
+    try:
+        await wait_for_port(twilio_port)
+        await wait_until_ready(app_url, app)
+
+        for name in workloads:
+            if args.warmup:
+                await run_level(app_url, name, min(levels), args.warmup)
+            for level in levels:
+                result = await run_level(app_url, name, level, args.requests)
+                results.append(result)
+                print(
+                    f"{name:>8} c={level:<4} {result['throughput_rps']:>9.1f} req/s  "
+                    f"p50={result['p50_ms']:.1f}ms p95={result['p95_ms']:.1f}ms "
+                    f"p99={result['p99_ms']:.1f}ms errors={result['errors']}",
+                    file=sys.stderr,
+                )
+    finally:
+        app.terminate()
+        fake_twilio.terminate()
+        app.wait(timeout=30)
+        fake_twilio.wait(timeout=10)
+
+        if not args.keep_data:
+            mongo = MongoClient(args.mongodb_url, serverSelectionTimeoutMS=2000)
+            try:
+                mongo.drop_database(BENCH_DATABASE)
+            except Exception:
+                pass
+            mongo.close()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": levels,
+            "twilio_latency_ms": args.twilio_latency_ms,
+            "twilio_jitter_ms": args.twilio_jitter_ms,
+            "twilio_error_rate": args.twilio_error_rate,
+            "app_env": args.app_env,
+        },
+        "results": results,
+    }
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
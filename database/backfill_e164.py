@@ -0,0 +1,32 @@
+"""
+Agrega los campos *_e164 a los mensajes guardados antes de la normalización
+
+Uso:
+    python -m database.backfill_e164
+
+Hay que ejecutarlo una vez después de actualizar: las búsquedas por número
+usan solo los campos *_e164, así que los mensajes sin ellos no aparecen en
+el historial. Después conviene recalcular los resúmenes y contadores
+(database.rebuild_conversations y database.rebuild_rollups).
+"""
+import asyncio
+import sys
+
+from database import mongodb
+
+
+async def main():
+    await mongodb.connect_mongo()
+    try:
+        await mongodb.ensure_indexes()
+        updated = await mongodb.backfill_number_keys()
+    finally:
+        await mongodb.close_mongo()
+
+    for collection_name, count in updated.items():
+        print(f"{collection_name}: {count} documents updated")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,36 @@
+"""
+Verifica que las consultas de la aplicación usen índices
+
+Uso:
+    python -m database.check_query_plans
+
+Crea los índices (si faltan), ejecuta explain() sobre cada consulta de
+QUERY_SHAPES y termina con código 1 si alguna hace un COLLSCAN.
+"""
+import asyncio
+import sys
+
+from database import mongodb
+
+
+async def main():
+    await mongodb.connect_mongo()
+    try:
+        await mongodb.ensure_indexes()
+        offenders = await mongodb.verify_query_plans()
+    finally:
+        await mongodb.close_mongo()
+
+    for name, _, _, _, _ in mongodb.QUERY_SHAPES:
+        status = "COLLSCAN" if name in offenders else "ok"
+        print(f"{name}: {status}")
+
+    if offenders:
+        for name, stages in offenders.items():
+            print(f"  {name} -> {' > '.join(stages)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
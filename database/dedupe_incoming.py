@@ -0,0 +1,32 @@
+"""
+Elimina los SMS recibidos guardados más de una vez (reintentos del webhook de Twilio)
+
+Uso:
+    python -m database.dedupe_incoming
+
+Hay que ejecutarlo una vez en las bases creadas antes de la deduplicación
+por message_sid: mientras haya repetidos no se puede crear el índice único
+message_sid_unique (la aplicación arranca igual y registra el error
+"index_build_failed"). Después conviene recalcular los resúmenes y
+contadores (database.rebuild_conversations y database.rebuild_rollups).
+"""
+import asyncio
+import sys
+
+from database import mongodb
+
+
+async def main():
+    await mongodb.connect_mongo()
+    try:
+        deleted = await mongodb.dedupe_incoming_sms()
+        await mongodb.ensure_indexes()
+    finally:
+        await mongodb.close_mongo()
+
+    print(f"incoming_sms_records: {deleted} duplicate documents deleted")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,40 +1,732 @@
-from pymongo import MongoClient
+from pymongo import (
+    AsyncMongoClient,
+    ASCENDING,
+    DESCENDING,
+    DeleteMany,
+    IndexModel,
+    InsertOne,
+    ReplaceOne,
+    ReturnDocument,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import base64
+import binascii
+import heapq
+import itertools
+import json
 import os
+import time
 from dotenv import load_dotenv
+from services.metrics import registry, CallbackGauge, mongo_latency, timed_mongo
+from services.e164 import e164_key
+from services.logging_setup import get_logger
 
 load_dotenv()
 
+logger = get_logger("mongodb")
+
 
 # os.getenv(): Obtiene el valor de una variable de entorno
 # "MONGODB_URL": Nombre de la variable a buscar en .env
 # Formato de URL MongoDB: mongodb://[usuario:contraseña@]host:puerto[/base_de_datos]
 MONGODB_URL = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
 
-# MongoClient(MONGODB_URL):
-#   - Crea una conexión con el servidor MongoDB
-client = MongoClient(MONGODB_URL)
+# Nombre de la base de datos (los benchmarks usan una distinta para no tocar los datos reales)
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "sms_service_db")
+
+# Configuración del pool de conexiones y de los timeouts
+#   - MONGODB_MAX_POOL_SIZE / MONGODB_MIN_POOL_SIZE: Conexiones máximas/mínimas abiertas por proceso
+#   - MONGODB_SERVER_SELECTION_TIMEOUT_MS: Cuánto esperar a encontrar un servidor disponible
+#   - MONGODB_CONNECT_TIMEOUT_MS: Cuánto esperar al abrir una conexión nueva
+#   - MONGODB_SOCKET_TIMEOUT_MS: Cuánto esperar la respuesta de una operación
+#   - MONGODB_WAIT_QUEUE_TIMEOUT_MS: Cuánto esperar una conexión libre cuando el pool está lleno
+MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", "100"))
+MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", "0"))
+MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(
+    os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", "5000")
+)
+MONGODB_CONNECT_TIMEOUT_MS = int(os.getenv("MONGODB_CONNECT_TIMEOUT_MS", "5000"))
+MONGODB_SOCKET_TIMEOUT_MS = int(os.getenv("MONGODB_SOCKET_TIMEOUT_MS", "10000"))
+MONGODB_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGODB_WAIT_QUEUE_TIMEOUT_MS", "5000"))
 
-# client.sms_service_db:
-#   - Accede o crea si no existe a una base de datos llamada "sms_service_db"
-db = client.sms_service_db
+# Escritura diferida (write-behind) de los registros de SMS
+#   - MONGODB_WRITE_BEHIND: "true" para acumular las escrituras y guardarlas en lotes
+#   - MONGODB_WRITE_BATCH_SIZE: Se guarda el lote al juntar esta cantidad de operaciones...
+#   - MONGODB_WRITE_FLUSH_MS: ...o cuando pasan estos milisegundos desde la primera
+#   - MONGODB_WRITE_MAX_PENDING: Máximo de operaciones en memoria; si se llena, quien
+#     escribe espera a que se vacíe (backpressure)
+#   - MONGODB_WRITE_RETRIES: Reintentos de un lote si MongoDB no responde (caída breve)
+#   - MONGODB_WRITE_RETRY_SECONDS: Espera antes del primer reintento (se duplica en cada uno)
+MONGODB_WRITE_BEHIND = os.getenv("MONGODB_WRITE_BEHIND", "false").lower() == "true"
+MONGODB_WRITE_BATCH_SIZE = int(os.getenv("MONGODB_WRITE_BATCH_SIZE", "500"))
+MONGODB_WRITE_FLUSH_MS = float(os.getenv("MONGODB_WRITE_FLUSH_MS", "50"))
+MONGODB_WRITE_MAX_PENDING = int(os.getenv("MONGODB_WRITE_MAX_PENDING", "10000"))
+MONGODB_WRITE_RETRIES = int(os.getenv("MONGODB_WRITE_RETRIES", "3"))
+MONGODB_WRITE_RETRY_SECONDS = float(os.getenv("MONGODB_WRITE_RETRY_SECONDS", "1"))
 
+# El cliente, la base de datos y las colecciones se crean en connect_mongo(),
+# que se llama desde el lifespan de FastAPI al iniciar la aplicación
+client = None
+db = None
 
 # COLECCIONES (un similar a tablas en SQL)
 
-# db.sms_records:
-#   - Accede o crea una colección llamada "sms_records" dentro de la BD
+# sms_records:
 #   - Esta colección almacenará los SMS ENVIADOS por nuestra aplicación
-#   - Estructura de documentos: {to_number, message_body, sent_at, status, message_sid, error}
-sms_collection = db.sms_records
+#   - Estructura de documentos: {to_number, to_number_e164, message_body, sent_at, status, message_sid, error,
+#                                segments, encoding}
+#   - to_number_e164: El número en E.164, que es la clave con la que se busca
+#     (to_number queda tal como se recibió)
+sms_collection = None
 
-# db.incoming_sms_records:
-#   - Accede o crea una colección llamada "incoming_sms_records"
+# incoming_sms_records:
 #   - Esta colección almacenará los SMS RECIBIDOS en nuestra aplicación
-#   - Estructura: {from_number, to_number, message_body, received_at, message_sid, auto_reply_sent, auto_reply_sid}
-incoming_sms_collection = db.incoming_sms_records
+#   - Estructura: {from_number, from_number_e164, to_number, to_number_e164, message_body,
+#                  received_at, message_sid, auto_reply_sent, auto_reply_sid}
+incoming_sms_collection = None
+
+# phone_numbers:
+#   - Copia local de los números comprados en la cuenta de Twilio
+#   - Estructura: {sid, phone_number, friendly_name, capabilities, status, date_created, synced_at}
+phone_numbers_collection = None
+
+# conversation_summaries:
+#   - Un documento por cada número con el que conversamos, actualizado en cada SMS guardado
+#   - Estructura: {phone_number, last_message, last_direction, last_at,
+#                  sent_count, received_count, unread, last_read_at}
+conversations_collection = None
+
+# sms_rollups:
+#   - Contadores de mensajes por número e intervalo de tiempo (hora y día)
+#   - Estructura: {phone_number, granularity, bucket, sent, sent_errors, received, auto_replies}
+rollups_collection = None
+
+# auto_reply_rules:
+#   - Reglas de respuesta automática por palabra clave para los SMS recibidos
+#   - Estructura: {keyword, reply, to_number, priority, enabled, updated_at}
+auto_reply_rules_collection = None
+
+# opt_outs:
+#   - Números que pidieron no recibir más mensajes (STOP) o que volvieron a aceptarlos (START)
+#   - Estructura: {phone_number, opted_out, keyword, updated_at}
+opt_outs_collection = None
+
+
+async def connect_mongo():
+    """
+    Crea el cliente asíncrono de MongoDB y las referencias a las colecciones
+
+    AsyncMongoClient no bloquea el event loop: cada operación es una corrutina
+    que se debe esperar con await. La conexión real se abre de forma perezosa
+    en la primera operación.
+    """
+    global client, db, sms_collection, incoming_sms_collection, phone_numbers_collection
+    global conversations_collection, rollups_collection, auto_reply_rules_collection, opt_outs_collection
+
+    # AsyncMongoClient(MONGODB_URL, ...):
+    #   - Crea un pool de conexiones asíncronas con el servidor MongoDB
+    client = AsyncMongoClient(
+        MONGODB_URL,
+        maxPoolSize=MONGODB_MAX_POOL_SIZE,
+        minPoolSize=MONGODB_MIN_POOL_SIZE,
+        serverSelectionTimeoutMS=MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        connectTimeoutMS=MONGODB_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGODB_SOCKET_TIMEOUT_MS,
+        waitQueueTimeoutMS=MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    )
+
+    # client[MONGODB_DATABASE]:
+    #   - Accede o crea si no existe a la base de datos (por defecto "sms_service_db")
+    db = client[MONGODB_DATABASE]
+    sms_collection = db.sms_records
+    incoming_sms_collection = db.incoming_sms_records
+    phone_numbers_collection = db.phone_numbers
+    conversations_collection = db.conversation_summaries
+    rollups_collection = db.sms_rollups
+    auto_reply_rules_collection = db.auto_reply_rules
+    opt_outs_collection = db.opt_outs
+
+    if MONGODB_WRITE_BEHIND:
+        write_buffer.start()
+
+
+# ÍNDICES
+# Cada colección declara aquí los índices que necesitan sus consultas.
+#   - IndexModel([...]): Define las claves del índice y su orden (1 = ascendente, -1 = descendente)
+#   - name: Nombre explícito para que ensure_indexes() sea idempotente
+#   - unique: No permite dos documentos con el mismo valor
+#   - partialFilterExpression: Solo indexa los documentos que cumplen el filtro
+#     (los SMS con error no tienen message_sid, y varios None romperían el índice único)
+SMS_INDEXES = [
+    IndexModel(
+        [("to_number_e164", ASCENDING), ("sent_at", DESCENDING), ("_id", DESCENDING)],
+        name="to_number_e164_sent_at_id",
+    ),
+    IndexModel(
+        [("message_sid", ASCENDING)],
+        name="message_sid_unique",
+        unique=True,
+        partialFilterExpression={"message_sid": {"$type": "string"}},
+    ),
+    # Cola de envío: los workers buscan mensajes "queued" cuyo turno ya llegó
+    IndexModel(
+        [("status", ASCENDING), ("next_attempt_at", ASCENDING)],
+        name="status_next_attempt_at",
+    ),
+    # Exportación por rango de fechas de todos los números
+    IndexModel([("sent_at", ASCENDING)], name="sent_at"),
+]
+
+INCOMING_SMS_INDEXES = [
+    IndexModel(
+        [("from_number_e164", ASCENDING), ("received_at", DESCENDING), ("_id", DESCENDING)],
+        name="from_number_e164_received_at_id",
+    ),
+    IndexModel([("received_at", ASCENDING)], name="received_at"),
+    IndexModel(
+        [("message_sid", ASCENDING)],
+        name="message_sid_unique",
+        unique=True,
+    ),
+]
+
+PHONE_NUMBER_INDEXES = [
+    IndexModel([("sid", ASCENDING)], name="sid_unique", unique=True),
+]
+
+CONVERSATION_INDEXES = [
+    IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True),
+    # Listado de conversaciones de la más reciente a la más antigua
+    IndexModel([("last_at", DESCENDING), ("_id", DESCENDING)], name="last_at_id"),
+]
+
+ROLLUP_INDEXES = [
+    IndexModel(
+        [("phone_number", ASCENDING), ("granularity", ASCENDING), ("bucket", ASCENDING)],
+        name="phone_number_granularity_bucket_unique",
+        unique=True,
+    ),
+]
+
+AUTO_REPLY_RULE_INDEXES = [
+    # La recarga en caliente compara la fecha del último cambio
+    IndexModel([("updated_at", DESCENDING)], name="updated_at"),
+]
+
+OPT_OUT_INDEXES = [
+    IndexModel([("phone_number", ASCENDING)], name="phone_number_unique", unique=True),
+    # Sincronización incremental: cambios posteriores a la última revisión
+    IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+]
+
+# Índices que se reemplazaron por otros y se eliminan al iniciar
+#   {colección: [nombre_del_índice, ...]}
+RETIRED_INDEXES = {
+    "sms_records": ["to_number_sent_at", "to_number_sent_at_id"],
+    "incoming_sms_records": ["from_number_received_at", "from_number_received_at_id"],
+}
+
+
+async def _create_indexes(collection, indexes: list):
+    """
+    Crea los índices de una colección sin detener el arranque si alguno falla
+
+    Un índice único no se puede crear si ya hay documentos repetidos (ej:
+    bases con webhooks de Twilio guardados dos veces antes de la
+    deduplicación por message_sid). En ese caso se crean los demás índices
+    uno por uno y se registra el error: hay que limpiar los datos
+    (python -m database.dedupe_incoming) y reiniciar.
+    """
+    try:
+        await collection.create_indexes(indexes)
+        return
+    except OperationFailure:
+        # createIndexes es todo o nada: se reintenta cada índice por separado
+        pass
+
+    for index in indexes:
+        try:
+            await collection.create_indexes([index])
+        except OperationFailure as e:
+            logger.error(
+                "index_build_failed",
+                extra={"fields": {
+                    "collection": collection.name,
+                    "index": index.document["name"],
+                    "error": str(e),
+                }},
+            )
+
+
+async def ensure_indexes():
+    """
+    Crea los índices de todas las colecciones si todavía no existen
+
+    Se llama al iniciar la aplicación. create_indexes() no hace nada si el
+    índice ya existe con la misma definición, así que es seguro llamarla
+    en cada arranque.
+    """
+    await _create_indexes(sms_collection, SMS_INDEXES)
+    await _create_indexes(incoming_sms_collection, INCOMING_SMS_INDEXES)
+    await _create_indexes(phone_numbers_collection, PHONE_NUMBER_INDEXES)
+    await _create_indexes(conversations_collection, CONVERSATION_INDEXES)
+    await _create_indexes(rollups_collection, ROLLUP_INDEXES)
+    await _create_indexes(auto_reply_rules_collection, AUTO_REPLY_RULE_INDEXES)
+    await _create_indexes(opt_outs_collection, OPT_OUT_INDEXES)
+
+    for collection_name, index_names in RETIRED_INDEXES.items():
+        for index_name in index_names:
+            try:
+                await db[collection_name].drop_index(index_name)
+            except OperationFailure:
+                # El índice ya no existe
+                pass
+
+
+async def close_mongo():
+    """
+    Guarda las escrituras pendientes y cierra el pool de conexiones al apagar
+    la aplicación
+    """
+    global client
+
+    await write_buffer.stop()
+
+    if client is not None:
+        await client.close()
+        client = None
+
+
+# ESCRITURA DIFERIDA (write-behind)
+class WriteBehindBuffer:
+    """
+    Acumula operaciones de escritura y las guarda en lotes con bulk_write
+
+    En vez de un insert_one por cada SMS (un viaje de ida y vuelta a MongoDB
+    en cada petición), las operaciones se encolan en memoria y una tarea de
+    fondo las envía juntas cada `batch_size` operaciones o cada `flush_ms`
+    milisegundos, lo que ocurra primero.
+
+    - Las operaciones se agrupan por colección y se envían con ordered=False.
+      pymongo ejecuta primero todas las inserciones del lote y luego las
+      actualizaciones, así un UpdateOne nunca llega antes que su InsertOne.
+    - La cola tiene un tamaño máximo: cuando se llena, add() espera.
+    - Si MongoDB no responde, el lote se reintenta hasta `retries` veces con
+      espera exponencial. Mientras tanto no se envían otros lotes (se
+      mantiene el orden) y la cola se llena hasta frenar a quien escribe.
+      Un lote que agota los reintentos se descarta y se registra en el log.
+    - stop() guarda todo lo pendiente antes de terminar.
+    """
+
+    def __init__(self, batch_size: int, flush_ms: float, max_pending: int,
+                 retries: int = MONGODB_WRITE_RETRIES, retry_seconds: float = MONGODB_WRITE_RETRY_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_ms / 1000
+        self.max_pending = max_pending
+        self.retries = retries
+        self.retry_seconds = retry_seconds
+        self._queue = None
+        self._task = None
+
+        # Contadores expuestos en stats()
+        self.enqueued = 0
+        self.written = 0
+        self.errors = 0
+        self.retried = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+
+        # None avisa a la tarea de fondo que guarde lo pendiente y termine
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def add(self, collection_name: str, operation):
+        """
+        Encola una operación (InsertOne, UpdateOne, ...) sobre una colección
+        """
+        await self._queue.put((collection_name, operation))
+        self.enqueued += 1
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            stopping = False
+
+            # Juntar operaciones hasta llenar el lote o vencer el plazo
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+            if stopping:
+                return
+
+    async def _flush(self, batch: list):
+        started = time.perf_counter()
+
+        by_collection = {}
+        for collection_name, operation in batch:
+            by_collection.setdefault(collection_name, []).append(operation)
 
+        for collection_name, operations in by_collection.items():
+            await self._write(collection_name, operations)
 
-def insert_sms_record(sms_record: dict):
+        elapsed = time.perf_counter() - started
+        mongo_latency.observe(elapsed, ("write_buffer_flush",))
+
+        elapsed_ms = elapsed * 1000
+        self.flushes += 1
+        self.last_flush_ms = elapsed_ms
+        self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+        self.total_flush_ms += elapsed_ms
+
+    async def _write(self, collection_name: str, operations: list):
+        """
+        Guarda las operaciones de una colección, reintentando si MongoDB no responde
+        """
+        attempt = 0
+        while True:
+            try:
+                result = await db[collection_name].bulk_write(operations, ordered=False)
+                self.written += result.inserted_count + result.modified_count + result.upserted_count
+                return
+            except BulkWriteError as e:
+                # Con ordered=False las operaciones válidas se guardan igual;
+                # las rechazadas (ej: clave duplicada) no cambian al reintentar
+                details = e.details
+                write_errors = details.get("writeErrors", [])
+                self.written += details.get("nInserted", 0) + details.get("nModified", 0) + details.get("nUpserted", 0)
+                self.errors += len(write_errors)
+                logger.warning(
+                    "write_buffer_write_errors",
+                    extra={"fields": {
+                        "collection": collection_name,
+                        "operations": len(operations),
+                        "errors": len(write_errors),
+                        "first_error": write_errors[0].get("errmsg") if write_errors else None,
+                    }},
+                )
+                return
+            except Exception as e:
+                fields = {"collection": collection_name, "operations": len(operations), "attempt": attempt + 1}
+                if attempt >= self.retries:
+                    self.errors += len(operations)
+                    logger.exception("write_buffer_batch_dropped", extra={"fields": fields})
+                    return
+                logger.warning("write_buffer_batch_retry", extra={"fields": {**fields, "error": str(e)}})
+                self.retried += 1
+                await asyncio.sleep(self.retry_seconds * 2 ** attempt)
+                attempt += 1
+
+    def stats(self) -> dict:
+        """
+        Retorna los contadores del buffer (profundidad, escrituras y latencia de los lotes)
+        """
+        return {
+            "enabled": self.enabled,
+            "depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_pending": self.max_pending,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "errors": self.errors,
+            "retried": self.retried,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+# Buffer compartido (solo se inicia si MONGODB_WRITE_BEHIND=true)
+write_buffer = WriteBehindBuffer(
+    MONGODB_WRITE_BATCH_SIZE, MONGODB_WRITE_FLUSH_MS, MONGODB_WRITE_MAX_PENDING
+)
+
+registry.register(CallbackGauge(
+    "write_buffer_depth",
+    "Operaciones esperando en el buffer de escritura diferida",
+    lambda: write_buffer.stats()["depth"],
+))
+
+
+# NÚMEROS NORMALIZADOS
+# Campos de número de cada colección que se guardan también en E.164 (campo_e164)
+SMS_NUMBER_FIELDS = ("to_number", "from_number")
+INCOMING_SMS_NUMBER_FIELDS = ("from_number", "to_number")
+
+
+def _add_number_keys(sms_record: dict, fields: tuple) -> dict:
+    """
+    Agrega al registro los campos *_e164 que todavía no tenga
+
+    Así "+56 9 4837 2612" y "+56948372612" quedan con la misma clave y las
+    búsquedas por número son una sola coincidencia exacta en el índice.
+    """
+    for field in fields:
+        value = sms_record.get(field)
+        if value is not None:
+            sms_record.setdefault(f"{field}_e164", e164_key(value))
+    return sms_record
+
+
+@timed_mongo("backfill_number_keys")
+async def backfill_number_keys(batch_size: int = 1000) -> dict:
+    """
+    Agrega los campos *_e164 a los documentos guardados antes de que existieran
+
+    Se ejecuta una sola vez (python -m database.backfill_e164). Es idempotente:
+    solo toca los documentos a los que todavía les falta algún campo.
+
+    Retorna:
+        dict: {colección: documentos actualizados}
+    """
+    updated = {}
+    for collection, fields in (
+        (sms_collection, SMS_NUMBER_FIELDS),
+        (incoming_sms_collection, INCOMING_SMS_NUMBER_FIELDS),
+    ):
+        query = {"$or": [
+            {field: {"$type": "string"}, f"{field}_e164": {"$exists": False}} for field in fields
+        ]}
+        projection = {field: 1 for field in fields}
+
+        count = 0
+        operations = []
+        async for document in collection.find(query, projection, batch_size=batch_size):
+            keys = {
+                f"{field}_e164": e164_key(document[field])
+                for field in fields if isinstance(document.get(field), str)
+            }
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": keys}))
+            if len(operations) >= batch_size:
+                await collection.bulk_write(operations, ordered=False)
+                count += len(operations)
+                operations = []
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+            count += len(operations)
+
+        updated[collection.name] = count
+
+    return updated
+
+
+@timed_mongo("dedupe_incoming_sms")
+async def dedupe_incoming_sms(batch_size: int = 1000) -> int:
+    """
+    Elimina los SMS recibidos repetidos (mismo message_sid) y deja uno por mensaje
+
+    Antes de la deduplicación del webhook cada reintento de Twilio se guardaba
+    como un documento nuevo, y con esos repetidos no se puede crear el índice
+    único message_sid_unique. Se conserva el que registra la respuesta
+    automática enviada o, si ninguno, el primero que se guardó.
+
+    Se ejecuta una sola vez (python -m database.dedupe_incoming). Es idempotente.
+
+    Retorna:
+        int: Cantidad de documentos eliminados
+    """
+    cursor = await incoming_sms_collection.aggregate(
+        [
+            {"$match": {"message_sid": {"$type": "string"}}},
+            {"$sort": {"message_sid": ASCENDING, "auto_reply_sent": DESCENDING, "_id": ASCENDING}},
+            {"$group": {"_id": "$message_sid", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}},
+        ],
+        allowDiskUse=True,
+    )
+
+    deleted = 0
+    duplicate_ids = []
+    async for group in cursor:
+        duplicate_ids.extend(group["ids"][1:])
+        if len(duplicate_ids) >= batch_size:
+            result = await incoming_sms_collection.delete_many({"_id": {"$in": duplicate_ids}})
+            deleted += result.deleted_count
+            duplicate_ids = []
+    if duplicate_ids:
+        result = await incoming_sms_collection.delete_many({"_id": {"$in": duplicate_ids}})
+        deleted += result.deleted_count
+
+    return deleted
+
+
+# PAGINACIÓN DEL HISTORIAL
+# Campos que retornan los endpoints de historial (1 = incluir).
+# El _id se lee solo para construir el cursor y no se entrega al cliente.
+SMS_HISTORY_PROJECTION = {
+    "_id": 1,
+    "to_number": 1,
+    "message_body": 1,
+    "sent_at": 1,
+    "status": 1,
+    "message_sid": 1,
+    "error": 1,
+    "segments": 1,
+    "encoding": 1,
+}
+
+INCOMING_SMS_HISTORY_PROJECTION = {
+    "_id": 1,
+    "from_number": 1,
+    "to_number": 1,
+    "message_body": 1,
+    "received_at": 1,
+    "message_sid": 1,
+    "auto_reply_sent": 1,
+    "auto_reply_sid": 1,
+}
+
+
+def encode_cursor(time_value, document_id) -> str:
+    """
+    Convierte la posición (fecha, _id) del último documento de una página en
+    un texto opaco que el cliente devuelve para pedir la página siguiente
+    """
+    if isinstance(time_value, datetime):
+        time_value = time_value.isoformat()
+    raw = json.dumps([time_value, str(document_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str, time_as_string: bool = False):
+    """
+    Operación inversa de encode_cursor()
+
+    Retorna:
+        tuple: (fecha, ObjectId)
+
+    Lanza ValueError si el cursor no es válido.
+    """
+    try:
+        time_value, document_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not time_as_string:
+            time_value = datetime.fromisoformat(time_value)
+        return time_value, ObjectId(document_id)
+    except (binascii.Error, InvalidId, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+async def _find_documents(
+    collection,
+    query: dict,
+    time_field: str,
+    projection: dict,
+    limit: int,
+    after: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    time_as_string: bool = False,
+):
+    """
+    Lee hasta limit + 1 documentos ordenados por (fecha, _id) descendente
+
+    Usa paginación por clave (keyset): en vez de saltar documentos con skip(),
+    filtra los que están "después" del último documento de la página anterior.
+    Así cada página recorre solo `limit` entradas del índice
+    (filtro, fecha, _id), sin importar cuántos documentos haya antes.
+
+    El documento extra sirve para saber si existe una página siguiente.
+    """
+    query = dict(query)
+
+    # Rango de fechas opcional
+    time_range = {}
+    if since is not None:
+        time_range["$gte"] = since.isoformat() if time_as_string else since
+    if until is not None:
+        time_range["$lt"] = until.isoformat() if time_as_string else until
+
+    if after is not None:
+        after_time, after_id = decode_cursor(after, time_as_string)
+        # Documentos más antiguos que el cursor, o con la misma fecha y un _id menor
+        time_range["$lte"] = after_time
+        query["$or"] = [
+            {time_field: {"$lt": after_time}},
+            {"_id": {"$lt": after_id}},
+        ]
+
+    if time_range:
+        query[time_field] = time_range
+
+    return await collection.find(query, projection).sort(
+        [(time_field, DESCENDING), ("_id", DESCENDING)]
+    ).limit(limit + 1).to_list()
+
+
+async def _find_page(
+    collection,
+    number_field: str,
+    time_field: str,
+    phone_number: str,
+    projection: dict,
+    limit: int,
+    after: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    time_as_string: bool = False,
+):
+    """
+    Lee una página de documentos de un número ordenados por (fecha, _id) descendente
+
+    Retorna:
+        tuple: (documentos sin _id, cursor de la página siguiente o None)
+    """
+    documents = await _find_documents(
+        collection, {number_field: phone_number}, time_field, projection,
+        limit, after, since, until, time_as_string,
+    )
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last[time_field], last["_id"])
+
+    for document in documents:
+        del document["_id"]
+
+    return documents, next_cursor
+
+
+@timed_mongo("insert_sms_record")
+async def insert_sms_record(sms_record: dict):
     """
     Inserta un nuevo registro de SMS ENVIADO en la base de datos
 
@@ -47,6 +739,7 @@ def insert_sms_record(sms_record: dict):
         Objeto con información de la inserción
                     - inserted_id: El _id del documento insertado
                     - acknowledged: True si la operación fue confirmada
+        None si la escritura diferida está activa (se guardará en el próximo lote)
 
     Ej:
         sms_record = {
@@ -57,42 +750,382 @@ def insert_sms_record(sms_record: dict):
             "message_sid": "SM123...",
             "error": None
         }
-        result = insert_sms_record(sms_record)
+        result = await insert_sms_record(sms_record)
     """
+    _add_number_keys(sms_record, SMS_NUMBER_FIELDS)
+
+    if write_buffer.enabled:
+        await write_buffer.add("sms_records", InsertOne(sms_record))
+        await _write_derived(_sent_derived_updates([sms_record]))
+        return None
+
     # sms_collection.insert_one():
     #   - Inserta el diccionario a la colección
-    return sms_collection.insert_one(sms_record)
+    result = await sms_collection.insert_one(sms_record)
+    await _write_derived(_sent_derived_updates([sms_record]))
+    return result
 
 
-def find_sms_by_number(phone_number: str):
+@timed_mongo("insert_sms_records")
+async def insert_sms_records(sms_records: list):
     """
-    Busca todos los SMS ENVIADOS a un número de teléfono específico
+    Inserta varios registros de SMS ENVIADOS con una sola operación
+    (o los encola en el buffer si la escritura diferida está activa)
+
+    Parámetros:
+        sms_records (list): Lista de diccionarios con el mismo formato que
+                            insert_sms_record()
+
+    Retorna:
+        InsertManyResult: Objeto con los _id insertados (None si la lista está vacía)
+    """
+    if not sms_records:
+        return None
+
+    for sms_record in sms_records:
+        _add_number_keys(sms_record, SMS_NUMBER_FIELDS)
+
+    if write_buffer.enabled:
+        for sms_record in sms_records:
+            await write_buffer.add("sms_records", InsertOne(sms_record))
+        await _write_derived(_sent_derived_updates(sms_records))
+        return None
+
+    # insert_many(ordered=False):
+    #   - Envía todos los documentos al servidor en un solo lote
+    #   - ordered=False: si un documento falla, los demás se insertan igual
+    result = await sms_collection.insert_many(sms_records, ordered=False)
+    await _write_derived(_sent_derived_updates(sms_records))
+    return result
+
+
+# COLA DE ENVÍO
+# Cuando SMS_SEND_MODE=queue, /sms/send guarda el mensaje con status "queued"
+# y un worker lo envía después. Campos extra de estos documentos:
+#   - from_number: Número remitente
+#   - attempts: Cuántas veces se intentó enviar
+#   - next_attempt_at: Cuándo puede intentarse el próximo envío
+#   - locked_until: Hasta cuándo el worker que lo tomó tiene la exclusividad
+
+
+@timed_mongo("enqueue_sms_records")
+async def enqueue_sms_records(sms_records: list) -> list:
+    """
+    Guarda uno o varios SMS en la cola de envío con un solo insert_many
+
+    Parámetros:
+        sms_records (list): Registros con el formato de insert_sms_record() más from_number
+
+    Retorna:
+        list: _id de cada documento, en el mismo orden
+    """
+    if not sms_records:
+        return []
+
+    now = datetime.now()
+    sms_records = [
+        _add_number_keys({
+            **sms_record,
+            "status": "queued",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "locked_until": None,
+        }, SMS_NUMBER_FIELDS)
+        for sms_record in sms_records
+    ]
+    result = await sms_collection.insert_many(sms_records)
+    await _write_derived(_sent_derived_updates(sms_records))
+    return result.inserted_ids
+
+
+# MENSAJES PROGRAMADOS
+# Un SMS con scheduled_at se guarda con status "scheduled", sent_at = hora
+# programada y next_attempt_at = hora programada (el índice
+# status_next_attempt_at sirve también para buscarlos por vencimiento).
+# Al llegar su hora, services/scheduler.py los pasa a "queued" y los workers
+# de la cola los envían como cualquier otro mensaje encolado.
+
+# Estados de los mensajes que todavía no salen (o nunca saldrán): no cuentan
+# en los resúmenes de conversación ni en los contadores de tráfico
+UNSENT_STATUSES = ["scheduled", "canceled"]
+
+
+@timed_mongo("schedule_sms")
+async def schedule_sms(sms_records: list) -> list:
+    """
+    Guarda uno o varios SMS programados con un solo insert_many
+
+    Los resúmenes de conversación y los contadores se actualizan al pasar
+    el mensaje a la cola (promote_scheduled_sms()), no al programarlo.
+
+    Retorna:
+        list: _id de cada documento, en el mismo orden
+    """
+    if not sms_records:
+        return []
+
+    sms_records = [
+        _add_number_keys({
+            **sms_record,
+            "status": "scheduled",
+            "attempts": 0,
+            "next_attempt_at": sms_record["sent_at"],
+            "locked_until": None,
+        }, SMS_NUMBER_FIELDS)
+        for sms_record in sms_records
+    ]
+    result = await sms_collection.insert_many(sms_records)
+    return result.inserted_ids
+
+
+@timed_mongo("find_scheduled_sms")
+async def find_scheduled_sms(until: datetime, limit: int) -> list:
+    """
+    Lista los SMS programados que vencen antes de `until`, del más próximo al más lejano
+
+    Solo lee la parte del índice status_next_attempt_at que cae en la
+    ventana (más los atrasados), no todos los mensajes programados.
+
+    Retorna:
+        list: [{_id, next_attempt_at}]
+    """
+    return await sms_collection.find(
+        {"status": "scheduled", "next_attempt_at": {"$lt": until}},
+        {"_id": 1, "next_attempt_at": 1},
+    ).sort("next_attempt_at", ASCENDING).limit(limit).to_list()
+
+
+@timed_mongo("promote_scheduled_sms")
+async def promote_scheduled_sms(record_ids: list) -> int:
+    """
+    Pasa a la cola de envío los SMS programados cuya hora ya llegó
+
+    update_many() solo cambia los que siguen en "scheduled", así que si
+    varios procesos intentan pasar el mismo mensaje solo uno lo consigue.
+    Cada llamada marca sus documentos con un promotion_token propio para
+    saber cuáles pasó ella (un worker puede tomar el mensaje y cambiar su
+    claim_token antes de la lectura siguiente).
+
+    Retorna:
+        int: Cantidad de mensajes que pasaron a la cola
+    """
+    promotion_token = ObjectId()
+    result = await sms_collection.update_many(
+        {"_id": {"$in": record_ids}, "status": "scheduled"},
+        {"$set": {"status": "queued", "promotion_token": promotion_token}},
+    )
+    if not result.modified_count:
+        return 0
+
+    sms_records = await sms_collection.find(
+        {"_id": {"$in": record_ids}, "promotion_token": promotion_token},
+        {"to_number_e164": 1, "message_body": 1, "sent_at": 1},
+    ).to_list()
+    await _write_derived(_sent_derived_updates(sms_records))
+    return len(sms_records)
+
+
+@timed_mongo("cancel_scheduled_sms")
+async def cancel_scheduled_sms(record_id: ObjectId) -> bool:
+    """
+    Cancela un SMS programado que todavía no pasó a la cola
+
+    Retorna:
+        bool: False si no existe o ya se envió
+    """
+    result = await sms_collection.update_one(
+        {"_id": record_id, "status": "scheduled"},
+        {"$set": {"status": "canceled", "next_attempt_at": None}},
+    )
+    return result.modified_count > 0
+
+
+@timed_mongo("claim_queued_sms")
+async def claim_queued_sms(lock_seconds: float):
+    """
+    Toma el siguiente SMS de la cola cuyo turno ya llegó
+
+    find_one_and_update() busca y marca el documento como "sending" en una sola
+    operación atómica, así dos workers nunca toman el mismo mensaje.
+
+    Cada toma guarda un claim_token nuevo. Si el lock vence y otro worker
+    vuelve a tomar el mensaje, el token cambia y las actualizaciones del
+    worker anterior (renew/complete/retry/fail) ya no coinciden.
+
+    Retorna:
+        dict: El documento tomado, con su claim_token (None si la cola está vacía)
+    """
+    now = datetime.now()
+    return await sms_collection.find_one_and_update(
+        {"status": "queued", "next_attempt_at": {"$lte": now}},
+        {
+            "$set": {
+                "status": "sending",
+                "locked_until": now + timedelta(seconds=lock_seconds),
+                "claim_token": ObjectId(),
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("next_attempt_at", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def _claimed(record_id, claim_token) -> dict:
+    # Filtro de las actualizaciones del worker que tomó el mensaje
+    return {"_id": record_id, "status": "sending", "claim_token": claim_token}
+
+
+@timed_mongo("renew_queued_sms")
+async def renew_queued_sms(record_id, claim_token, lock_seconds: float) -> bool:
+    """
+    Extiende el lock de un SMS tomado justo antes de enviarlo a Twilio
+
+    La espera del límite de tasa puede durar más que el lock original; si
+    mientras tanto release_stale_sms() lo devolvió a la cola, no se debe enviar.
+
+    Retorna:
+        bool: False si el worker ya no tiene el mensaje
+    """
+    result = await sms_collection.update_one(
+        _claimed(record_id, claim_token),
+        {"$set": {"locked_until": datetime.now() + timedelta(seconds=lock_seconds)}},
+    )
+    return result.matched_count > 0
+
+
+@timed_mongo("release_stale_sms")
+async def release_stale_sms():
+    """
+    Devuelve a la cola los mensajes "sending" cuyo worker dejó de responder
+    (por ejemplo, porque el proceso se reinició a mitad de un envío)
+    """
+    now = datetime.now()
+    return await sms_collection.update_many(
+        {"status": "sending", "locked_until": {"$lt": now}},
+        {"$set": {"status": "queued", "next_attempt_at": now, "locked_until": None, "claim_token": None}},
+    )
+
+
+# complete/retry/fail solo cambian el documento si el worker todavía lo tiene
+# tomado (status "sending" y el mismo claim_token): un worker cuyo lock venció
+# no pisa el resultado del worker que volvió a tomar el mensaje.
+
+
+@timed_mongo("complete_queued_sms")
+async def complete_queued_sms(record_id, claim_token, message_sid: str, from_number: Optional[str] = None) -> bool:
+    """
+    Marca un SMS de la cola como enviado
+
+    Parámetros:
+        from_number (str): Número desde el que salió (si lo eligió el pool de remitentes)
+
+    Retorna:
+        bool: False si el worker ya no tenía el mensaje
+    """
+    update = {"status": "sent", "message_sid": message_sid, "error": None, "locked_until": None}
+    if from_number is not None:
+        update["from_number"] = from_number
+        update["from_number_e164"] = e164_key(from_number)
+
+    result = await sms_collection.update_one(_claimed(record_id, claim_token), {"$set": update})
+    return result.matched_count > 0
+
+
+@timed_mongo("retry_queued_sms")
+async def retry_queued_sms(record_id, claim_token, error: str, next_attempt_at: datetime,
+                           count_attempt: bool = True) -> bool:
+    """
+    Devuelve un SMS a la cola para reintentarlo más tarde
+
+    Parámetros:
+        count_attempt (bool): False si el envío no llegó a hacerse (ej: circuito
+                              de Twilio abierto) y no debe contar como intento
+
+    Retorna:
+        bool: False si el worker ya no tenía el mensaje
+    """
+    update = {"$set": {"status": "queued", "error": error, "next_attempt_at": next_attempt_at,
+                       "locked_until": None, "claim_token": None}}
+    if not count_attempt:
+        update["$inc"] = {"attempts": -1}
+    result = await sms_collection.update_one(_claimed(record_id, claim_token), update)
+    return result.matched_count > 0
+
+
+@timed_mongo("fail_queued_sms")
+async def fail_queued_sms(record_id, claim_token, error: str):
+    """
+    Marca un SMS de la cola como fallido (no se volverá a intentar)
+
+    Retorna:
+        dict: El documento actualizado (None si no existe o el worker ya no lo tenía)
+    """
+    sms_record = await sms_collection.find_one_and_update(
+        _claimed(record_id, claim_token),
+        {"$set": {"status": "error", "error": error, "locked_until": None}},
+        projection={"to_number": 1, "to_number_e164": 1, "sent_at": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if sms_record is not None:
+        # Al encolarlo se contó como enviado; ahora se suma a los errores
+        _add_number_keys(sms_record, ("to_number",))
+        await _write_derived([
+            ("sms_rollups", operation)
+            for operation in _rollup_updates([
+                (sms_record["to_number_e164"], sms_record["sent_at"], {"sent_errors": 1})
+            ])
+        ])
+    return sms_record
+
+
+@timed_mongo("find_sms_by_number")
+async def find_sms_by_number(
+    phone_number: str,
+    limit: int = 50,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Busca una página de SMS ENVIADOS a un número de teléfono específico
+
+    Los mensajes se ordenan del más reciente al más antiguo. Para pedir la
+    página siguiente se pasa en "after" el cursor retornado por la anterior.
 
     Parámetros:
         phone_number (str): Número de teléfono a buscar (ej +56942341243)
+        limit (int): Cantidad máxima de mensajes por página
+        after (str): Cursor opaco de la página anterior (None para la primera)
+        since (datetime): Solo mensajes enviados desde esta fecha (inclusive)
+        until (datetime): Solo mensajes enviados antes de esta fecha (exclusivo)
 
     Retorna:
-        list: Lista de diccionarios con los SMS encontrados
+        tuple: (lista de mensajes, cursor de la página siguiente o None)
 
     Ej:
-        mensajes = find_sms_by_number("+56948372612")
-        # Retorna: [
-        #   {"to_number": "+56948372612", "message_body": "Hola", ...},
-        #   {"to_number": "+56948372612", "message_body": "Adiós", ...}
+        mensajes, cursor = await find_sms_by_number("+56948372612", limit=2)
+        # mensajes: [
+        #   {"to_number": "+56948372612", "message_body": "Adiós", ...},
+        #   {"to_number": "+56948372612", "message_body": "Hola", ...}
         # ]
+        # cursor: "WyIyMDI1LTExLTAxVDEyOjAwOjAwIiwgIjY1NDMyMSJd" (None si no hay más)
     """
-    # sms_collection.find():
-    #   - Busca documentos que cumplan con el criterio
-    #   - Primer parámetro: Filtro de búsqueda
-    #     {"to_number": phone_number} Busca donde el campo "to_number" sea igual al número dado
-    #   - Segundo parámetro: Qué campos incluir/excluir
-    #     {"_id": 0} → Excluye el campo "_id" de los resultados (0 = excluir, 1 = incluir)
-    # list():
-    #   - Convierte el resultado una lista
-    return list(sms_collection.find({"to_number": phone_number}, {"_id": 0}))
+    return await _find_page(
+        sms_collection,
+        number_field="to_number_e164",
+        time_field="sent_at",
+        phone_number=e164_key(phone_number),
+        projection=SMS_HISTORY_PROJECTION,
+        limit=limit,
+        after=after,
+        since=since,
+        until=until,
+    )
 
 
-def insert_incoming_sms(sms_record: dict):
+@timed_mongo("insert_incoming_sms")
+async def insert_incoming_sms(sms_record: dict):
     """
     Inserta un nuevo registro de SMS RECIBIDO en la base de datos
 
@@ -104,6 +1137,7 @@ def insert_incoming_sms(sms_record: dict):
 
     Retorna:
         InsertOneResult: Objeto con información de la inserción
+        (None si la escritura diferida está activa)
 
     Ejemplo de uso:
         incoming = {
@@ -115,29 +1149,1029 @@ def insert_incoming_sms(sms_record: dict):
             "auto_reply_sent": True,
             "auto_reply_sid": "SM789..."
         }
-        result = insert_incoming_sms(incoming)
+        result = await insert_incoming_sms(incoming)
     """
+    _add_number_keys(sms_record, INCOMING_SMS_NUMBER_FIELDS)
+
+    if write_buffer.enabled:
+        await write_buffer.add("incoming_sms_records", InsertOne(sms_record))
+        await _write_derived(_received_derived_updates(sms_record))
+        return None
+
     # incoming_sms_collection.insert_one():
     #   - Inserta un documento en la colección incoming_sms_records
-    return incoming_sms_collection.insert_one(sms_record)
+    result = await incoming_sms_collection.insert_one(sms_record)
+    await _write_derived(_received_derived_updates(sms_record))
+    return result
+
+
+@timed_mongo("claim_incoming_sms")
+async def claim_incoming_sms(sms_record: dict) -> bool:
+    """
+    Guarda un SMS RECIBIDO solo si su message_sid no existe todavía
+
+    Usa un upsert con $setOnInsert sobre el índice único de message_sid:
+    si el documento ya existe no se modifica nada. Sirve para ignorar los
+    reintentos de Twilio del mismo webhook.
+
+    Parámetros:
+        sms_record (dict): Igual que en insert_incoming_sms()
+
+    El upsert se ejecuta siempre al momento, aunque la escritura diferida
+    esté activa: su resultado decide si se envía la respuesta automática y
+    se suman los contadores, así que no puede esperar al próximo lote (los
+    reintentos que llegan a otro proceso no están en su caché en memoria).
+    Solo los datos derivados pasan por el buffer.
+
+    Retorna:
+        bool: True si el mensaje es nuevo, False si ya estaba guardado
+    """
+    _add_number_keys(sms_record, INCOMING_SMS_NUMBER_FIELDS)
+    query = {"message_sid": sms_record["message_sid"]}
+    update = {"$setOnInsert": sms_record}
+
+    try:
+        result = await incoming_sms_collection.update_one(query, update, upsert=True)
+    except DuplicateKeyError:
+        # Otro proceso insertó el mismo message_sid al mismo tiempo
+        return False
 
+    if result.upserted_id is None:
+        return False
 
-def find_incoming_sms_by_number(phone_number: str):
+    # Los resúmenes y contadores solo se actualizan para los mensajes nuevos
+    # (no para los reintentos)
+    await _write_derived(_received_derived_updates(sms_record))
+    return True
+
+
+@timed_mongo("find_incoming_sms_by_number")
+async def find_incoming_sms_by_number(
+    phone_number: str,
+    limit: int = 50,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
     """
-    Busca todos los SMS RECIBIDOS desde un número de teléfono específico
+    Busca una página de SMS RECIBIDOS desde un número de teléfono específico
 
     Parámetros:
         phone_number (str): Número desde el cual se recibieron los SMS
+        limit, after, since, until: Igual que en find_sms_by_number()
 
     Retorna:
-        list: Lista de diccionarios con los SMS recibidos de ese número
+        tuple: (lista de mensajes recibidos, cursor de la página siguiente o None)
 
     Ejemplo de uso:
-        mensajes = find_incoming_sms_by_number("+56948372612")
-        # Retorna todos los mensajes que ese número nos envió
-    """
-    # incoming_sms_collection.find():
-    #   - Busca en la colección de SMS recibidos
-    #   - {"from_number": phone_number} Filtra por el remitente del mensaje
-    #   - {"_id": 0} → Excluye el _id de MongoDB de los resultados
-    return list(incoming_sms_collection.find({"from_number": phone_number}, {"_id": 0}))
+        mensajes, cursor = await find_incoming_sms_by_number("+56948372612")
+        # Retorna los 50 mensajes más recientes que ese número nos envió
+    """
+    # received_at se guarda como texto ISO 8601, por eso time_as_string=True
+    return await _find_page(
+        incoming_sms_collection,
+        number_field="from_number_e164",
+        time_field="received_at",
+        phone_number=e164_key(phone_number),
+        projection=INCOMING_SMS_HISTORY_PROJECTION,
+        limit=limit,
+        after=after,
+        since=since,
+        until=until,
+        time_as_string=True,
+    )
+
+
+@timed_mongo("mark_auto_reply_sent")
+async def mark_auto_reply_sent(message_sid: str, auto_reply_sid: str, sms_record: Optional[dict] = None):
+    """
+    Marca un SMS RECIBIDO como respondido automáticamente
+
+    Parámetros:
+        message_sid (str): SID del mensaje recibido
+        auto_reply_sid (str): SID del mensaje de respuesta enviado
+        sms_record (dict): Registro del mensaje recibido, para sumar la
+                           respuesta a los contadores de tráfico (opcional)
+
+    Retorna:
+        UpdateResult: Objeto con información de la actualización
+        (None si la escritura diferida está activa)
+    """
+    query = {"message_sid": message_sid}
+    update = {"$set": {"auto_reply_sent": True, "auto_reply_sid": auto_reply_sid}}
+
+    rollup = []
+    if sms_record is not None:
+        rollup = [
+            ("sms_rollups", operation)
+            for operation in _rollup_updates([(
+                _add_number_keys(sms_record, INCOMING_SMS_NUMBER_FIELDS)["from_number_e164"],
+                datetime.fromisoformat(sms_record["received_at"]),
+                {"auto_replies": 1},
+            )])
+        ]
+
+    if write_buffer.enabled:
+        await write_buffer.add("incoming_sms_records", UpdateOne(query, update))
+        await _write_derived(rollup)
+        return None
+
+    result = await incoming_sms_collection.update_one(query, update)
+    await _write_derived(rollup)
+    return result
+
+
+# EXPORTACIÓN
+# Campos que se exportan de cada colección (sin _id)
+SMS_EXPORT_PROJECTION = {
+    "_id": 0,
+    "from_number": 1,
+    "to_number": 1,
+    "message_body": 1,
+    "sent_at": 1,
+    "status": 1,
+    "message_sid": 1,
+    "error": 1,
+    "segments": 1,
+    "encoding": 1,
+}
+
+INCOMING_SMS_EXPORT_PROJECTION = {
+    "_id": 0,
+    "from_number": 1,
+    "to_number": 1,
+    "message_body": 1,
+    "received_at": 1,
+    "message_sid": 1,
+    "auto_reply_sent": 1,
+    "auto_reply_sid": 1,
+}
+
+
+async def _iter_range(
+    collection,
+    number_field: str,
+    time_field: str,
+    projection: dict,
+    since: Optional[datetime],
+    until: Optional[datetime],
+    phone_numbers: Optional[list],
+    batch_size: int,
+    time_as_string: bool = False,
+    filters: Optional[dict] = None,
+):
+    """
+    Recorre todos los documentos de un rango de fechas, del más antiguo al más reciente
+
+    Es un generador asíncrono: los documentos llegan del servidor de a
+    `batch_size` por viaje (getMore), así que la memoria usada no depende de
+    cuántos documentos haya en el rango. `filters` agrega condiciones fijas
+    a la consulta.
+    """
+    query = dict(filters or {})
+    time_range = {}
+    if since is not None:
+        time_range["$gte"] = since.isoformat() if time_as_string else since
+    if until is not None:
+        time_range["$lt"] = until.isoformat() if time_as_string else until
+    if time_range:
+        query[time_field] = time_range
+    if phone_numbers:
+        query[number_field] = {"$in": [e164_key(phone_number) for phone_number in phone_numbers]}
+
+    cursor = collection.find(query, projection, batch_size=batch_size).sort(time_field, ASCENDING)
+    try:
+        async for document in cursor:
+            yield document
+    finally:
+        # Si el cliente corta la descarga, se libera el cursor en el servidor
+        await cursor.close()
+
+
+def iter_sms_records(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    phone_numbers: Optional[list] = None,
+    batch_size: int = 1000,
+):
+    """
+    Recorre los SMS ENVIADOS de un rango de fechas (opcionalmente solo a algunos números)
+
+    Los mensajes programados que aún no salen o que se cancelaron no se
+    incluyen (su sent_at es la hora programada, no la de envío).
+
+    Ej:
+        async for sms_record in iter_sms_records(since=datetime(2025, 11, 1)):
+            ...
+    """
+    return _iter_range(
+        sms_collection, "to_number_e164", "sent_at", SMS_EXPORT_PROJECTION,
+        since, until, phone_numbers, batch_size,
+        filters={"status": {"$nin": UNSENT_STATUSES}},
+    )
+
+
+def iter_incoming_sms_records(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    phone_numbers: Optional[list] = None,
+    batch_size: int = 1000,
+):
+    """
+    Recorre los SMS RECIBIDOS de un rango de fechas (opcionalmente solo desde algunos números)
+    """
+    return _iter_range(
+        incoming_sms_collection, "from_number_e164", "received_at", INCOMING_SMS_EXPORT_PROJECTION,
+        since, until, phone_numbers, batch_size, time_as_string=True,
+    )
+
+
+# CONVERSACIONES
+# Cada SMS guardado actualiza el resumen de la conversación con ese número en
+# la misma petición (un upsert atómico sobre un solo documento), así el listado
+# de conversaciones es una sola lectura por índice en vez de recorrer las dos
+# colecciones de mensajes.
+CONVERSATION_PROJECTION = {
+    "_id": 1,
+    "phone_number": 1,
+    "last_message": 1,
+    "last_direction": 1,
+    "last_at": 1,
+    "sent_count": 1,
+    "received_count": 1,
+    "unread": 1,
+    "last_read_at": 1,
+}
+
+
+def _conversation_update(phone_number: str, direction: str, message_body: str, at: datetime):
+    """
+    Crea el UpdateOne que suma un mensaje al resumen de la conversación
+
+    Usa un pipeline de actualización para que el último mensaje solo se
+    reemplace si el nuevo es más reciente (los lotes y la cola pueden guardar
+    mensajes fuera de orden). Todas las expresiones de un mismo $set leen los
+    valores anteriores del documento.
+    """
+    counter, other = ("sent_count", "received_count") if direction == "sent" else ("received_count", "sent_count")
+    newer = {"$gte": [at, {"$ifNull": ["$last_at", datetime(1970, 1, 1)]}]}
+
+    def latest(value, field):
+        # $literal evita que un texto que empieza con "$" se lea como un campo
+        return {"$cond": [newer, {"$literal": value}, f"${field}"]}
+
+    pipeline = [{"$set": {
+        counter: {"$add": [{"$ifNull": [f"${counter}", 0]}, 1]},
+        other: {"$ifNull": [f"${other}", 0]},
+        "unread": {"$add": [{"$ifNull": ["$unread", 0]}, 1 if direction == "received" else 0]},
+        "last_message": latest(message_body, "last_message"),
+        "last_direction": latest(direction, "last_direction"),
+        "last_at": latest(at, "last_at"),
+    }}]
+    return UpdateOne({"phone_number": phone_number}, pipeline, upsert=True)
+
+
+# DATOS DERIVADOS
+# Al guardar un mensaje también se actualizan los resúmenes de conversación y
+# los contadores de tráfico. Cada función retorna una lista de
+# (colección, operación) que _write_derived() guarda con un bulk_write por
+# colección (o encola en el buffer si la escritura diferida está activa).
+
+def _sent_derived_updates(sms_records: list) -> list:
+    updates = [
+        ("conversation_summaries", _conversation_update(
+            sms_record["to_number_e164"], "sent", sms_record["message_body"], sms_record["sent_at"]
+        ))
+        for sms_record in sms_records
+    ]
+    events = [
+        (
+            sms_record["to_number_e164"],
+            sms_record["sent_at"],
+            {"sent": 1, "sent_errors": 1} if sms_record.get("status") == "error" else {"sent": 1},
+        )
+        for sms_record in sms_records
+    ]
+    updates.extend(("sms_rollups", operation) for operation in _rollup_updates(events))
+    return updates
+
+
+def _received_derived_updates(sms_record: dict) -> list:
+    # received_at se guarda como texto ISO 8601
+    received_at = datetime.fromisoformat(sms_record["received_at"])
+    counters = {"received": 1}
+    if sms_record.get("auto_reply_sent"):
+        counters["auto_replies"] = 1
+
+    updates = [("conversation_summaries", _conversation_update(
+        sms_record["from_number_e164"], "received", sms_record["message_body"], received_at
+    ))]
+    updates.extend(
+        ("sms_rollups", operation)
+        for operation in _rollup_updates([(sms_record["from_number_e164"], received_at, counters)])
+    )
+    return updates
+
+
+async def _write_derived(updates: list):
+    """
+    Guarda las operaciones de datos derivados, un bulk_write por colección en paralelo
+    """
+    if not updates:
+        return
+
+    if write_buffer.enabled:
+        for collection_name, operation in updates:
+            await write_buffer.add(collection_name, operation)
+        return
+
+    by_collection = {}
+    for collection_name, operation in updates:
+        by_collection.setdefault(collection_name, []).append(operation)
+
+    await asyncio.gather(*(
+        db[collection_name].bulk_write(operations, ordered=False)
+        for collection_name, operations in by_collection.items()
+    ))
+
+
+@timed_mongo("find_conversation_messages")
+async def find_conversation_messages(
+    phone_number: str,
+    limit: int = 50,
+    after: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+):
+    """
+    Busca una página de la conversación con un número: los SMS ENVIADOS y
+    RECIBIDOS mezclados del más reciente al más antiguo
+
+    Lee en paralelo una página de cada colección (con sus índices por número
+    y fecha) y las mezcla por (fecha, _id). El cursor es el mismo para las dos
+    colecciones: cada una continúa desde el último mensaje entregado.
+
+    Parámetros:
+        Igual que en find_sms_by_number()
+
+    Retorna:
+        tuple: (lista de mensajes con "direction": "sent" o "received",
+                cursor de la página siguiente o None)
+    """
+    phone_number = e164_key(phone_number)
+    sent, received = await asyncio.gather(
+        _find_documents(
+            sms_collection, {"to_number_e164": phone_number}, "sent_at",
+            SMS_HISTORY_PROJECTION, limit, after, since, until,
+        ),
+        _find_documents(
+            incoming_sms_collection, {"from_number_e164": phone_number}, "received_at",
+            INCOMING_SMS_HISTORY_PROJECTION, limit, after, since, until, time_as_string=True,
+        ),
+    )
+
+    for document in sent:
+        document["direction"] = "sent"
+        document["_at"] = document["sent_at"]
+    for document in received:
+        document["direction"] = "received"
+        document["_at"] = datetime.fromisoformat(document["received_at"])
+
+    # Las dos listas ya vienen ordenadas: heapq.merge las mezcla en O(n)
+    merged = heapq.merge(sent, received, key=lambda document: (document["_at"], document["_id"]), reverse=True)
+    documents = list(itertools.islice(merged, limit))
+
+    next_cursor = None
+    if len(sent) + len(received) > limit:
+        last = documents[-1]
+        next_cursor = encode_cursor(last["_at"], last["_id"])
+
+    for document in documents:
+        del document["_id"]
+        del document["_at"]
+
+    return documents, next_cursor
+
+
+@timed_mongo("find_conversations")
+async def find_conversations(limit: int = 50, after: Optional[str] = None):
+    """
+    Busca una página de resúmenes de conversación, de la más reciente a la más antigua
+
+    Parámetros:
+        limit (int): Cantidad máxima de conversaciones por página
+        after (str): Cursor opaco de la página anterior (None para la primera)
+
+    Retorna:
+        tuple: (lista de resúmenes, cursor de la página siguiente o None)
+
+    Ej:
+        conversaciones, cursor = await find_conversations(limit=1)
+        # conversaciones: [{"phone_number": "+56948372612", "last_message": "Hola",
+        #                   "last_direction": "received", "sent_count": 3,
+        #                   "received_count": 2, "unread": 1, ...}]
+    """
+    documents = await _find_documents(
+        conversations_collection, {}, "last_at", CONVERSATION_PROJECTION,
+        limit, after, since=None, until=None,
+    )
+
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        last = documents[-1]
+        next_cursor = encode_cursor(last["last_at"], last["_id"])
+
+    for document in documents:
+        del document["_id"]
+
+    return documents, next_cursor
+
+
+@timed_mongo("mark_conversation_read")
+async def mark_conversation_read(phone_number: str) -> bool:
+    """
+    Deja en 0 los mensajes sin leer de una conversación
+
+    Retorna:
+        bool: False si no existe una conversación con ese número
+    """
+    result = await conversations_collection.update_one(
+        {"phone_number": e164_key(phone_number)},
+        {"$set": {"unread": 0, "last_read_at": datetime.now()}},
+    )
+    return result.matched_count > 0
+
+
+@timed_mongo("rebuild_conversation_summaries")
+async def rebuild_conversation_summaries(batch_size: int = 1000) -> int:
+    """
+    Recalcula los resúmenes de conversación a partir de los mensajes guardados
+
+    Sirve para crear los resúmenes de los mensajes anteriores a esta
+    colección. Se conserva el contador de no leídos de las conversaciones
+    que ya existen.
+
+    Retorna:
+        int: Cantidad de conversaciones recalculadas
+    """
+    summaries = {}
+
+    async def collect(collection, number_field, time_field, direction, match):
+        cursor = await collection.aggregate(
+            [
+                {"$match": match},
+                {"$sort": {time_field: ASCENDING}},
+                {"$group": {
+                    # Los documentos anteriores a backfill_number_keys() no tienen la clave E.164
+                    "_id": {"$ifNull": [f"${number_field}_e164", f"${number_field}"]},
+                    "count": {"$sum": 1},
+                    "last_at": {"$last": f"${time_field}"},
+                    "last_message": {"$last": "$message_body"},
+                }},
+            ],
+            allowDiskUse=True,
+        )
+        async for group in cursor:
+            last_at = group["last_at"]
+            if isinstance(last_at, str):
+                last_at = datetime.fromisoformat(last_at)
+
+            summary = summaries.setdefault(group["_id"], {"sent_count": 0, "received_count": 0})
+            summary[f"{direction}_count"] = group["count"]
+            if "last_at" not in summary or last_at >= summary["last_at"]:
+                summary.update(
+                    last_at=last_at, last_message=group["last_message"], last_direction=direction
+                )
+
+    await collect(sms_collection, "to_number", "sent_at", "sent", {"status": {"$nin": UNSENT_STATUSES}})
+    await collect(incoming_sms_collection, "from_number", "received_at", "received", {})
+
+    operations = [
+        UpdateOne(
+            {"phone_number": phone_number},
+            {"$set": summary, "$setOnInsert": {"unread": 0}},
+            upsert=True,
+        )
+        for phone_number, summary in summaries.items()
+    ]
+    for start in range(0, len(operations), batch_size):
+        await conversations_collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+    return len(operations)
+
+
+# CONTADORES DE TRÁFICO (rollups)
+# Documentos {phone_number, granularity, bucket, sent, sent_errors, received,
+# auto_replies} con los totales de cada número por hora y por día. Se
+# actualizan con $inc al guardar cada mensaje, así un reporte lee un
+# documento por intervalo en vez de agregar todos los mensajes.
+#   - phone_number: El número del cliente, o ROLLUP_ALL_NUMBERS para el total de la cuenta
+#   - granularity: "hour" o "day"
+#   - bucket: Inicio del intervalo
+ROLLUP_GRANULARITIES = ("hour", "day")
+ROLLUP_ALL_NUMBERS = "*"
+ROLLUP_COUNTERS = ("sent", "sent_errors", "received", "auto_replies")
+
+
+def rollup_bucket(at: datetime, granularity: str) -> datetime:
+    """
+    Retorna el inicio de la hora o del día de una fecha
+    """
+    if granularity == "day":
+        return at.replace(hour=0, minute=0, second=0, microsecond=0)
+    return at.replace(minute=0, second=0, microsecond=0)
+
+
+def _rollup_updates(events: list) -> list:
+    """
+    Crea los UpdateOne de los contadores de tráfico
+
+    Parámetros:
+        events (list): Lista de (phone_number, fecha, {contador: incremento})
+
+    Los eventos que caen en el mismo documento se suman antes, así un lote
+    de 1000 SMS de la misma hora genera pocas operaciones.
+    """
+    increments = {}
+    for phone_number, at, counters in events:
+        for granularity in ROLLUP_GRANULARITIES:
+            bucket = rollup_bucket(at, granularity)
+            for number in (phone_number, ROLLUP_ALL_NUMBERS):
+                totals = increments.setdefault((number, granularity, bucket), {})
+                for counter, value in counters.items():
+                    totals[counter] = totals.get(counter, 0) + value
+
+    return [
+        UpdateOne(
+            {"phone_number": number, "granularity": granularity, "bucket": bucket},
+            {"$inc": totals},
+            upsert=True,
+        )
+        for (number, granularity, bucket), totals in increments.items()
+    ]
+
+
+@timed_mongo("find_rollups")
+async def find_rollups(
+    granularity: str,
+    since: datetime,
+    until: datetime,
+    phone_number: Optional[str] = None,
+):
+    """
+    Lee los contadores de tráfico de un rango de fechas
+
+    Parámetros:
+        granularity (str): "hour" o "day"
+        since (datetime): Desde este intervalo (inclusive)
+        until (datetime): Hasta esta fecha (exclusivo)
+        phone_number (str): Número del cliente (None para el total de la cuenta)
+
+    Retorna:
+        list: Un documento por intervalo con tráfico, ordenados por fecha
+              (los intervalos sin mensajes no existen)
+    """
+    return await rollups_collection.find(
+        {
+            "phone_number": e164_key(phone_number) if phone_number else ROLLUP_ALL_NUMBERS,
+            "granularity": granularity,
+            "bucket": {"$gte": rollup_bucket(since, granularity), "$lt": until},
+        },
+        {"_id": 0, "bucket": 1, **{counter: 1 for counter in ROLLUP_COUNTERS}},
+    ).sort("bucket", ASCENDING).to_list()
+
+
+@timed_mongo("rebuild_rollups")
+async def rebuild_rollups(batch_size: int = 1000) -> int:
+    """
+    Recalcula todos los contadores de tráfico a partir de los mensajes guardados
+
+    Recorre una vez cada colección de mensajes (solo los campos necesarios)
+    y reemplaza los documentos de sms_rollups. Los mensajes que lleguen
+    mientras se ejecuta pueden quedar sin contar: conviene correrlo con poco
+    tráfico.
+
+    Retorna:
+        int: Cantidad de documentos de contadores escritos
+    """
+    totals = {}
+
+    def count(phone_number, at, counters):
+        for granularity in ROLLUP_GRANULARITIES:
+            bucket = rollup_bucket(at, granularity)
+            for number in (phone_number, ROLLUP_ALL_NUMBERS):
+                document = totals.setdefault(
+                    (number, granularity, bucket), dict.fromkeys(ROLLUP_COUNTERS, 0)
+                )
+                for counter, value in counters.items():
+                    document[counter] += value
+
+    async for sms_record in sms_collection.find(
+        {"status": {"$nin": UNSENT_STATUSES}},
+        {"_id": 0, "to_number": 1, "to_number_e164": 1, "sent_at": 1, "status": 1},
+        batch_size=batch_size,
+    ):
+        failed = sms_record.get("status") == "error"
+        _add_number_keys(sms_record, ("to_number",))
+        count(sms_record["to_number_e164"], sms_record["sent_at"], {"sent": 1, "sent_errors": int(failed)})
+
+    async for sms_record in incoming_sms_collection.find(
+        {}, {"_id": 0, "from_number": 1, "from_number_e164": 1, "received_at": 1, "auto_reply_sent": 1},
+        batch_size=batch_size,
+    ):
+        _add_number_keys(sms_record, ("from_number",))
+        count(
+            sms_record["from_number_e164"],
+            datetime.fromisoformat(sms_record["received_at"]),
+            {"received": 1, "auto_replies": int(bool(sms_record.get("auto_reply_sent")))},
+        )
+
+    operations = [
+        ReplaceOne(
+            {"phone_number": number, "granularity": granularity, "bucket": bucket},
+            {"phone_number": number, "granularity": granularity, "bucket": bucket, **counters},
+            upsert=True,
+        )
+        for (number, granularity, bucket), counters in totals.items()
+    ]
+    for start in range(0, len(operations), batch_size):
+        await rollups_collection.bulk_write(operations[start:start + batch_size], ordered=False)
+
+    return len(operations)
+
+
+# ESTADOS DE ENTREGA
+# Orden de los estados de un SMS enviado. Un callback solo puede avanzar el
+# estado guardado, nunca retrocederlo (Twilio no garantiza el orden de llegada).
+#   - queued/accepted/scheduled/sending: Twilio todavía no lo entrega al operador
+#   - sent: Nuestro estado al ser aceptado por la API, y el de Twilio al pasarlo al operador
+#   - delivered/undelivered/failed/canceled: Estados finales
+#   - read: Confirmación de lectura (solo algunos canales)
+MESSAGE_STATUS_RANK = {
+    "accepted": 0,
+    "scheduled": 0,
+    "queued": 0,
+    "sending": 1,
+    "sent": 2,
+    "delivered": 3,
+    "undelivered": 3,
+    "failed": 3,
+    "canceled": 3,
+    "read": 4,
+}
+
+
+@timed_mongo("apply_status_updates")
+async def apply_status_updates(updates: list):
+    """
+    Aplica varios cambios de estado de entrega con un solo bulk_write
+
+    Parámetros:
+        updates (list): Lista de (message_sid, status, error_code)
+
+    Cada UpdateOne solo modifica el documento si su estado actual es menos
+    avanzado que el nuevo, así los callbacks desordenados se ignoran.
+
+    Retorna:
+        list: message_sid que todavía no están en sms_records (el callback
+              llegó antes de que se guardara el envío); el llamador puede
+              reintentarlos más tarde
+    """
+    if not updates:
+        return []
+
+    now = datetime.now()
+    operations = []
+    for message_sid, status, error_code in updates:
+        rank = MESSAGE_STATUS_RANK[status]
+        older = [name for name, other in MESSAGE_STATUS_RANK.items() if other < rank]
+        operations.append(UpdateOne(
+            # $type: "string" hace que la consulta use el índice parcial de message_sid
+            {"message_sid": {"$eq": message_sid, "$type": "string"}, "status": {"$in": older}},
+            {"$set": {"status": status, "error_code": error_code, "status_updated_at": now}},
+        ))
+
+    result = await sms_collection.bulk_write(operations, ordered=False)
+    if result.matched_count == len(operations):
+        return []
+
+    # Los que no coincidieron pueden ser callbacks atrasados (el documento
+    # ya tiene un estado más avanzado) o de mensajes que aún no se guardan
+    message_sids = [message_sid for message_sid, _, _ in updates]
+    found = await sms_collection.find(
+        {"message_sid": {"$in": message_sids, "$type": "string"}},
+        {"_id": 0, "message_sid": 1},
+    ).to_list()
+    found = {document["message_sid"] for document in found}
+    return [message_sid for message_sid in message_sids if message_sid not in found]
+
+
+# RESPUESTAS AUTOMÁTICAS
+@timed_mongo("find_auto_reply_rules")
+async def find_auto_reply_rules():
+    """
+    Lista todas las reglas de respuesta automática
+    """
+    return await auto_reply_rules_collection.find({}).sort(
+        [("priority", DESCENDING), ("_id", ASCENDING)]
+    ).to_list()
+
+
+@timed_mongo("auto_reply_rules_version")
+async def auto_reply_rules_version():
+    """
+    Retorna una firma que cambia cada vez que se crea, modifica o elimina una regla
+
+    Retorna:
+        tuple: (cantidad de reglas, fecha del último cambio)
+    """
+    count = await auto_reply_rules_collection.estimated_document_count()
+    latest = await auto_reply_rules_collection.find_one(
+        {}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", DESCENDING)]
+    )
+    return count, latest["updated_at"] if latest else None
+
+
+@timed_mongo("insert_auto_reply_rule")
+async def insert_auto_reply_rule(rule: dict):
+    """
+    Guarda una regla nueva
+
+    Retorna:
+        ObjectId: _id de la regla
+    """
+    result = await auto_reply_rules_collection.insert_one({**rule, "updated_at": datetime.now()})
+    return result.inserted_id
+
+
+@timed_mongo("update_auto_reply_rule")
+async def update_auto_reply_rule(rule_id: ObjectId, rule: dict) -> bool:
+    """
+    Reemplaza una regla existente
+
+    Retorna:
+        bool: False si la regla no existe
+    """
+    result = await auto_reply_rules_collection.replace_one(
+        {"_id": rule_id}, {**rule, "updated_at": datetime.now()}
+    )
+    return result.matched_count > 0
+
+
+@timed_mongo("delete_auto_reply_rule")
+async def delete_auto_reply_rule(rule_id: ObjectId) -> bool:
+    """
+    Elimina una regla
+
+    Retorna:
+        bool: False si la regla no existe
+    """
+    result = await auto_reply_rules_collection.delete_one({"_id": rule_id})
+    return result.deleted_count > 0
+
+
+# LISTA DE SUPRESIÓN (STOP / START)
+@timed_mongo("set_opt_out")
+async def set_opt_out(phone_number: str, opted_out: bool, keyword: str):
+    """
+    Guarda si un número pidió dejar de recibir mensajes (STOP) o volvió a aceptarlos (START)
+
+    Los START no borran el documento: quedan con opted_out=False para que
+    los demás procesos vean el cambio en su sincronización incremental.
+
+    Parámetros:
+        phone_number (str): Número en E.164
+        opted_out (bool): True = no enviarle más mensajes
+        keyword (str): Palabra que envió el cliente (ej: "STOP")
+
+    Retorna:
+        datetime: Fecha del cambio
+    """
+    now = datetime.now()
+    await opt_outs_collection.update_one(
+        {"phone_number": phone_number},
+        {"$set": {"opted_out": opted_out, "keyword": keyword, "updated_at": now}},
+        upsert=True,
+    )
+    return now
+
+
+@timed_mongo("find_opt_out_changes")
+async def find_opt_out_changes(since: Optional[datetime] = None):
+    """
+    Lista los cambios de la lista de supresión desde una fecha
+
+    Sin fecha retorna solo los números suprimidos (carga inicial).
+
+    Retorna:
+        list: [{phone_number, opted_out, updated_at}] de más antiguo a más reciente
+    """
+    query = {"updated_at": {"$gte": since}} if since is not None else {"opted_out": True}
+    return await opt_outs_collection.find(
+        query, {"_id": 0, "phone_number": 1, "opted_out": 1, "updated_at": 1}
+    ).sort("updated_at", ASCENDING).to_list()
+
+
+# INVENTARIO DE NÚMEROS
+@timed_mongo("upsert_owned_number")
+async def upsert_owned_number(phone_number: dict):
+    """
+    Guarda o actualiza un número comprado en la copia local
+
+    Parámetros:
+        phone_number (dict): {sid, phone_number, friendly_name, capabilities, status, date_created}
+    """
+    return await phone_numbers_collection.replace_one(
+        {"sid": phone_number["sid"]},
+        {**phone_number, "synced_at": datetime.now()},
+        upsert=True,
+    )
+
+
+@timed_mongo("delete_owned_number")
+async def delete_owned_number(sid: str):
+    """
+    Elimina un número liberado de la copia local
+    """
+    return await phone_numbers_collection.delete_one({"sid": sid})
+
+
+@timed_mongo("find_owned_numbers")
+async def find_owned_numbers(capability: Optional[str] = None):
+    """
+    Lista los números de la copia local
+
+    Parámetros:
+        capability (str): Filtra por capacidad ("voice", "sms" o "mms"). None = todos
+
+    Retorna:
+        list: Números con el mismo formato que guarda upsert_owned_number()
+    """
+    query = {}
+    if capability:
+        query[f"capabilities.{capability}"] = True
+
+    return await phone_numbers_collection.find(
+        query, {"_id": 0, "synced_at": 0}
+    ).sort("phone_number", ASCENDING).to_list()
+
+
+@timed_mongo("sync_owned_numbers")
+async def sync_owned_numbers(phone_numbers: list):
+    """
+    Sincroniza la copia local con la lista completa de números de Twilio
+
+    Solo escribe lo que cambió: reemplaza los números nuevos o modificados y
+    elimina los que ya no están en la cuenta, todo en un solo bulk_write.
+
+    Parámetros:
+        phone_numbers (list): Lista completa leída de Twilio
+
+    Retorna:
+        int: Cantidad de operaciones de escritura realizadas
+    """
+    current = {
+        number["sid"]: number
+        for number in await phone_numbers_collection.find(
+            {}, {"_id": 0, "synced_at": 0}
+        ).to_list()
+    }
+    now = datetime.now()
+
+    operations = [
+        ReplaceOne({"sid": number["sid"]}, {**number, "synced_at": now}, upsert=True)
+        for number in phone_numbers
+        if current.get(number["sid"]) != number
+    ]
+
+    live_sids = {number["sid"] for number in phone_numbers}
+    removed = [sid for sid in current if sid not in live_sids]
+    if removed:
+        operations.append(DeleteMany({"sid": {"$in": removed}}))
+
+    if operations:
+        await phone_numbers_collection.bulk_write(operations, ordered=False)
+
+    return len(operations)
+
+
+# PLANES DE CONSULTA
+# Una entrada por cada consulta que hacen las funciones de acceso a datos:
+#   (nombre de la función, colección, tipo de operación, filtro, orden)
+# verify_query_plans() usa esta lista para comprobar que ninguna hace un COLLSCAN
+QUERY_SHAPES = [
+    ("find_sms_by_number", "sms_records", "find",
+     {"to_number_e164": "+10000000000"}, [("sent_at", DESCENDING), ("_id", DESCENDING)]),
+    ("find_incoming_sms_by_number", "incoming_sms_records", "find",
+     {"from_number_e164": "+10000000000"}, [("received_at", DESCENDING), ("_id", DESCENDING)]),
+    ("claim_queued_sms", "sms_records", "find",
+     {"status": "queued", "next_attempt_at": {"$lte": datetime(2000, 1, 1)}},
+     [("next_attempt_at", ASCENDING)]),
+    ("find_scheduled_sms", "sms_records", "find",
+     {"status": "scheduled", "next_attempt_at": {"$lt": datetime(2000, 1, 1)}},
+     [("next_attempt_at", ASCENDING)]),
+    ("renew_queued_sms", "sms_records", "update",
+     {"_id": ObjectId("000000000000000000000000"), "status": "sending",
+      "claim_token": ObjectId("000000000000000000000000")}, None),
+    ("release_stale_sms", "sms_records", "update",
+     {"status": "sending", "locked_until": {"$lt": datetime(2000, 1, 1)}}, None),
+    ("claim_incoming_sms", "incoming_sms_records", "update",
+     {"message_sid": "SM00000000000000000000000000000000"}, None),
+    ("apply_status_updates", "sms_records", "update",
+     {"message_sid": {"$eq": "SM00000000000000000000000000000000", "$type": "string"},
+      "status": {"$in": ["queued", "sending", "sent"]}}, None),
+    ("apply_status_updates_missing", "sms_records", "find",
+     {"message_sid": {"$in": ["SM00000000000000000000000000000000"], "$type": "string"}}, None),
+    ("find_conversations", "conversation_summaries", "find",
+     {}, [("last_at", DESCENDING), ("_id", DESCENDING)]),
+    ("mark_conversation_read", "conversation_summaries", "update",
+     {"phone_number": "+10000000000"}, None),
+    ("iter_sms_records", "sms_records", "find",
+     {"status": {"$nin": UNSENT_STATUSES},
+      "sent_at": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 1, 2)}},
+     [("sent_at", ASCENDING)]),
+    ("iter_incoming_sms_records", "incoming_sms_records", "find",
+     {"received_at": {"$gte": "2000-01-01T00:00:00", "$lt": "2000-01-02T00:00:00"}},
+     [("received_at", ASCENDING)]),
+    ("find_rollups", "sms_rollups", "find",
+     {"phone_number": "*", "granularity": "hour",
+      "bucket": {"$gte": datetime(2000, 1, 1), "$lt": datetime(2000, 1, 2)}},
+     [("bucket", ASCENDING)]),
+    ("upsert_owned_number", "phone_numbers", "update",
+     {"sid": "PN00000000000000000000000000000000"}, None),
+    ("mark_auto_reply_sent", "incoming_sms_records", "update",
+     {"message_sid": "SM00000000000000000000000000000000"}, None),
+    ("auto_reply_rules_version", "auto_reply_rules", "find",
+     {}, [("updated_at", DESCENDING)]),
+    ("find_opt_out_changes", "opt_outs", "find",
+     {"updated_at": {"$gte": datetime(2000, 1, 1)}}, [("updated_at", ASCENDING)]),
+    ("set_opt_out", "opt_outs", "update",
+     {"phone_number": "+10000000000"}, None),
+]
+
+
+def _find_stages(plan: dict):
+    """
+    Recorre recursivamente un plan de ejecución y retorna todas sus etapas
+    """
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_find_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_find_stages(item))
+    return stages
+
+
+async def explain_query(collection_name: str, operation: str, query: dict, sort=None):
+    """
+    Ejecuta explain() sobre una consulta y retorna las etapas del plan ganador
+
+    Parámetros:
+        collection_name (str): Nombre de la colección
+        operation (str): "find" o "update"
+        query (dict): Filtro de la consulta
+        sort (list): Orden opcional [(campo, dirección), ...]
+
+    Retorna:
+        list: Etapas del plan (ej: ["FETCH", "IXSCAN"])
+    """
+    collection = db[collection_name]
+
+    if operation == "update":
+        # Las actualizaciones se explican con el comando "explain" (no se ejecutan)
+        result = await db.command(
+            "explain",
+            {
+                "update": collection_name,
+                "updates": [{"q": query, "u": {"$set": {"_explain": True}}}],
+            },
+            verbosity="queryPlanner",
+        )
+    else:
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        result = await cursor.explain()
+
+    return _find_stages(result["queryPlanner"]["winningPlan"])
+
+
+async def verify_query_plans():
+    """
+    Comprueba que ninguna consulta de QUERY_SHAPES recorra la colección completa
+
+    Retorna:
+        dict: {nombre_función: [etapas]} de las consultas que hacen COLLSCAN
+              (vacío si todas usan un índice)
+    """
+    offenders = {}
+    for name, collection_name, operation, query, sort in QUERY_SHAPES:
+        stages = await explain_query(collection_name, operation, query, sort)
+        if "COLLSCAN" in stages:
+            offenders[name] = stages
+    return offenders
@@ -0,0 +1,29 @@
+"""
+Recalcula los resúmenes de conversación desde los mensajes guardados
+
+Uso:
+    python -m database.rebuild_conversations
+
+Se usa una vez para crear los resúmenes de los mensajes anteriores a la
+colección conversation_summaries (los nuevos se actualizan solos).
+"""
+import asyncio
+import sys
+
+from database import mongodb
+
+
+async def main():
+    await mongodb.connect_mongo()
+    try:
+        await mongodb.ensure_indexes()
+        rebuilt = await mongodb.rebuild_conversation_summaries()
+    finally:
+        await mongodb.close_mongo()
+
+    print(f"conversations rebuilt: {rebuilt}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,29 @@
+"""
+Recalcula los contadores de tráfico (sms_rollups) desde los mensajes guardados
+
+Uso:
+    python -m database.rebuild_rollups
+
+Se usa una vez para contar los mensajes anteriores a la colección
+sms_rollups, o para corregir los contadores si se borraron mensajes.
+"""
+import asyncio
+import sys
+
+from database import mongodb
+
+
+async def main():
+    await mongodb.connect_mongo()
+    try:
+        await mongodb.ensure_indexes()
+        written = await mongodb.rebuild_rollups()
+    finally:
+        await mongodb.close_mongo()
+
+    print(f"rollup documents written: {written}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,11 +1,74 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routes import sms, phone_numbers
+from fastapi.responses import PlainTextResponse
+from routes import sms, phone_numbers, auto_replies
 from fastapi.middleware.cors import CORSMiddleware
+from services.twilio_client import init_twilio_client, close_twilio_client, twilio_breakers
+from database.mongodb import connect_mongo, close_mongo, ensure_indexes, write_buffer
+from services.sms_queue import SMS_SEND_MODE, sms_queue
+from services.dedupe import webhook_dedupe
+from services.inventory_sync import inventory_sync
+from services.status_updates import status_coalescer
+from services.sender_pool import SMS_SENDER_POOL, sender_pool
+from services.auto_reply import auto_reply_engine
+from services.opt_out import opt_out_list
+from services.scheduler import SMS_SCHEDULER, scheduler
+from services.metrics import registry
+from services.logging_setup import start_logging, stop_logging
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Al iniciar: activar los logs y crear una sola vez los clientes de MongoDB y Twilio compartidos
+    start_logging()
+    await connect_mongo()
+    await ensure_indexes()
+    twilio_client = await init_twilio_client()
+    status_coalescer.start()
+
+    # Lista de supresión (STOP): se carga completa antes de aceptar envíos
+    await opt_out_list.sync()
+    opt_out_list.start()
+
+    # Reglas de respuesta automática (se cargan al iniciar y se recargan al cambiar)
+    auto_reply_engine.start()
+
+    # Pool de números remitentes (lee los números con SMS de la copia local)
+    if SMS_SENDER_POOL:
+        sender_pool.start()
+
+    # Workers de la cola de envío (si /sms/send encola los mensajes o si este
+    # proceso pasa a la cola los mensajes programados)
+    if (SMS_SEND_MODE == "queue" or SMS_SCHEDULER) and twilio_client is not None:
+        sms_queue.start(twilio_client)
+
+    # Mensajes programados
+    if SMS_SCHEDULER and twilio_client is not None:
+        scheduler.start()
+
+    # Sincronización periódica de la copia local de números comprados
+    if twilio_client is not None:
+        inventory_sync.start(twilio_client)
+
+    yield
+    # Al apagar: detener las tareas de fondo y cerrar las conexiones abiertas
+    await inventory_sync.stop()
+    await scheduler.stop()
+    await sms_queue.stop()
+    await sender_pool.stop()
+    await auto_reply_engine.stop()
+    await opt_out_list.stop()
+    await status_coalescer.stop()
+    await close_twilio_client()
+    await close_mongo()
+    stop_logging()
+
 
 app = FastAPI(
     title="SMS Sender API",
     description="API para enviar mensajes SMS vía Twilio y almacenarlos en MongoDB",
     version="0.4.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -18,6 +81,7 @@ app.add_middleware(
 
 app.include_router(sms.router)
 app.include_router(phone_numbers.router)
+app.include_router(auto_replies.router)
 
 
 @app.get("/")
@@ -27,12 +91,51 @@ async def root():
         "documentation": "/docs",
         "endpoints": {
             "send_sms": "/sms/send",
+            "cancel_scheduled_sms": "/sms/scheduled/{record_id}",
+            "estimate_segments": "/sms/estimate",
             "receive_sms_webhook": "/sms/webhook/incoming",
+            "status_callback_webhook": "/sms/webhook/status",
             "sent_history": "/sms/history/sent/{phone_number}",
             "received_history": "/sms/history/received/{phone_number}",
+            "conversations": "/sms/conversations",
+            "conversation": "/sms/conversations/{phone_number}",
+            "stats": "/sms/stats",
+            "export": "/sms/export",
             "search_numbers": "/phone-numbers/search",
             "purchase_number": "/phone-numbers/purchase",
             "my_numbers": "/phone-numbers/my-numbers",
             "release_number": "/phone-numbers/{phone_number_sid}",
+            "auto_replies": "/auto-replies",
+            "health": "/health",
+            "metrics": "/metrics",
         },
     }
+
+
+@app.get("/health")
+async def health():
+    """
+    Estado de la aplicación, contadores del buffer de escritura diferida,
+    tasa de webhooks duplicados y estado de los circuitos hacia Twilio
+    """
+    return {
+        "status": "ok",
+        "write_buffer": write_buffer.stats(),
+        "webhook_dedupe": webhook_dedupe.stats(),
+        "status_updates": status_coalescer.stats(),
+        "sender_pool": sender_pool.stats(),
+        "auto_replies": auto_reply_engine.stats(),
+        "opt_outs": opt_out_list.stats(),
+        "scheduler": scheduler.stats(),
+        "twilio_circuits": twilio_breakers.stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Métricas en formato de texto de Prometheus
+    """
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4"
+    )
@@ -0,0 +1,57 @@
+from pydantic import BaseModel, Field, field_validator
+from typing import Optional
+from services.e164 import e164_key
+
+
+# MODELO DE UNA REGLA DE RESPUESTA AUTOMÁTICA
+class AutoReplyRule(BaseModel):
+    """
+    Regla que define qué se responde cuando un SMS recibido contiene una palabra clave
+
+    La respuesta es una plantilla que admite variables:
+        $body: Texto del mensaje recibido
+        $from_number: Número que nos escribió
+        $to_number: Nuestro número que recibió el mensaje
+        $keyword: Palabra clave que coincidió
+
+    Ejemplo:
+        {
+            "keyword": "HORARIO",
+            "reply": "Atendemos de lunes a viernes de 9 a 18 hrs.",
+            "to_number": "+18153965488",
+            "priority": 0,
+            "enabled": true
+        }
+    """
+
+    keyword: str = Field(
+        ...,
+        min_length=1,
+        description="Palabra o frase que activa la regla (sin distinguir mayúsculas ni acentos)",
+        examples=["HORARIO", "PRECIO"],
+    )
+
+    # Una respuesta vacía hace que el mensaje no se responda
+    reply: str = Field(
+        ...,
+        description="Plantilla de la respuesta (vacía para no responder)",
+        examples=["Nuestro horario es de 9 a 18 hrs. Escribiste: $body"],
+    )
+
+    to_number: Optional[str] = Field(
+        default=None,
+        description="Número receptor al que aplica la regla (null = todos nuestros números)",
+        examples=["+18153965488", None],
+    )
+
+    priority: int = Field(
+        default=0,
+        description="Si coinciden varias reglas, gana la de mayor prioridad",
+    )
+
+    enabled: bool = Field(default=True, description="Si la regla está activa")
+
+    @field_validator("to_number")
+    @classmethod
+    def normalize_to_number(cls, value: Optional[str]) -> Optional[str]:
+        return e164_key(value) if value else None
@@ -1,9 +1,33 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
+from datetime import datetime
+from typing import List, Optional
 
 
 class SMSMessage(BaseModel):
     to_number: str = Field(
         ...,
-        description="Phone number to send the message to (example: +1234567890)",
+        description="Phone number to send the message to (example: +1234567890). "
+                    "Normalized to E.164 before sending; an invalid number only rejects its own message",
     )
     message_body: str = Field(..., description="The content of the SMS message")
+    scheduled_at: Optional[datetime] = Field(
+        default=None,
+        description="When to send the message (ISO 8601). Omitted or in the past = send now",
+    )
+
+    @field_validator("scheduled_at")
+    @classmethod
+    def to_local_time(cls, value: Optional[datetime]) -> Optional[datetime]:
+        # Stored dates are naive local time, like datetime.now() everywhere else
+        if value is not None and value.tzinfo is not None:
+            return value.astimezone().replace(tzinfo=None)
+        return value
+
+
+class SMSBatch(BaseModel):
+    messages: List[SMSMessage] = Field(
+        ...,
+        min_length=1,
+        max_length=1000,
+        description="Messages to send, each with its own recipient and body",
+    )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, List
 
 
 class SMSResponse(BaseModel):
@@ -48,6 +48,21 @@ class SMSResponse(BaseModel):
         examples=["SM1234567890abcdef1234567890abcdef", None],
     )
 
+    # Campo status: Estado del mensaje cuando se encola en vez de enviarse
+    # (SMS_SEND_MODE=queue) o se programa con scheduled_at. record_id permite
+    # seguirlo en el historial.
+    status: Optional[str] = Field(
+        default=None,
+        description="Estado del mensaje (queued si se encoló, scheduled si se programó para más tarde)",
+        examples=["queued", "scheduled", None],
+    )
+
+    record_id: Optional[str] = Field(
+        default=None,
+        description="ID del registro en MongoDB del mensaje encolado o programado",
+        examples=["6543210fedcba9876543210f", None],
+    )
+
     # Campo error: Mensaje descriptivo del error ocurrido
     # Optional[str]: Puede ser un string (descripción del error) o None (si todo fue bien)
     # Solo tiene valor cuando success=False
@@ -61,3 +76,58 @@ class SMSResponse(BaseModel):
             None,
         ],
     )
+
+
+class HistoryPage(BaseModel):
+    """
+    Página de resultados de los endpoints de historial
+
+    Para leer la página siguiente se vuelve a llamar al endpoint con
+    ?after=<next_cursor>. Cuando next_cursor es null no hay más mensajes.
+
+    Ejemplo:
+        {
+            "items": [{"to_number": "+56948372612", "message_body": "Hola", ...}],
+            "next_cursor": "WyIyMDI1LTExLTAxVDEyOjAwOjAwIiwgIjY1NDMyMSJd"
+        }
+    """
+
+    items: List[dict] = Field(
+        ...,
+        description="Mensajes de la página, del más reciente al más antiguo",
+    )
+
+    next_cursor: Optional[str] = Field(
+        default=None,
+        description="Cursor para pedir la página siguiente (null si no hay más)",
+    )
+
+
+class ConversationPage(BaseModel):
+    """
+    Página del listado de conversaciones (una por número)
+
+    Ejemplo:
+        {
+            "items": [{
+                "phone_number": "+56948372612",
+                "last_message": "Hola, necesito ayuda",
+                "last_direction": "received",
+                "last_at": "2025-11-01T12:00:00",
+                "sent_count": 3,
+                "received_count": 2,
+                "unread": 1
+            }],
+            "next_cursor": null
+        }
+    """
+
+    items: List[dict] = Field(
+        ...,
+        description="Resúmenes de conversación, de la más reciente a la más antigua",
+    )
+
+    next_cursor: Optional[str] = Field(
+        default=None,
+        description="Cursor para pedir la página siguiente (null si no hay más)",
+    )
@@ -0,0 +1,83 @@
+from fastapi import APIRouter, HTTPException
+from bson import ObjectId
+from bson.errors import InvalidId
+from models.auto_reply import AutoReplyRule
+from database.mongodb import (
+    find_auto_reply_rules,
+    insert_auto_reply_rule,
+    update_auto_reply_rule,
+    delete_auto_reply_rule,
+)
+from services.auto_reply import auto_reply_engine
+
+router = APIRouter(
+    prefix="/auto-replies",
+    tags=["Auto Replies"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+def _rule_id(rule_id: str) -> ObjectId:
+    try:
+        return ObjectId(rule_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail=f"Invalid rule id: {rule_id}")
+
+
+def _rule_to_dict(document: dict) -> dict:
+    return {**document, "id": str(document.pop("_id"))}
+
+
+@router.get("/")
+async def list_rules():
+    """
+    Lista las reglas de respuesta automática, de mayor a menor prioridad
+    """
+    return {"rules": [_rule_to_dict(document) for document in await find_auto_reply_rules()]}
+
+
+@router.post("/")
+async def create_rule(rule: AutoReplyRule):
+    """
+    Crea una regla de respuesta automática
+
+    La regla se aplica de inmediato en este proceso; los demás procesos la
+    cargan en la próxima revisión (AUTO_REPLY_RELOAD_SECONDS).
+
+    Ejemplo:
+    POST /auto-replies/
+    {"keyword": "HORARIO", "reply": "Atendemos de 9 a 18 hrs."}
+    """
+    rule_id = await insert_auto_reply_rule(rule.model_dump())
+    await auto_reply_engine.reload()
+    return {"success": True, "id": str(rule_id)}
+
+
+@router.put("/{rule_id}")
+async def replace_rule(rule_id: str, rule: AutoReplyRule):
+    """
+    Reemplaza una regla de respuesta automática
+    """
+    if not await update_auto_reply_rule(_rule_id(rule_id), rule.model_dump()):
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await auto_reply_engine.reload()
+    return {"success": True, "id": rule_id}
+
+
+@router.delete("/{rule_id}")
+async def remove_rule(rule_id: str):
+    """
+    Elimina una regla de respuesta automática
+    """
+    if not await delete_auto_reply_rule(_rule_id(rule_id)):
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await auto_reply_engine.reload()
+    return {"success": True, "id": rule_id}
+
+
+@router.get("/preview")
+async def preview_reply(from_number: str, to_number: str, body: str):
+    """
+    Muestra qué respondería el motor a un mensaje, sin enviar nada
+    """
+    return {"reply": auto_reply_engine.reply(from_number, to_number, body)}
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 from models.phone_number import (
@@ -7,7 +7,12 @@ from models.phone_number import (
     PhoneNumberResponse,
     AvailablePhoneNumber,
 )
-from typing import List
+from database.mongodb import upsert_owned_number, delete_owned_number, find_owned_numbers
+from services.twilio_client import get_twilio_client, get_optional_twilio_client, twilio_call, TwilioUnavailable
+from services.cache import TTLCache, SingleFlight
+from services.inventory_sync import phone_number_to_dict, refresh_inventory
+from typing import List, Optional
+import math
 import os
 from dotenv import load_dotenv
 
@@ -19,18 +24,36 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+# Caché de las búsquedas de números disponibles
+#   - PHONE_SEARCH_CACHE_TTL: Segundos que se reutiliza el resultado de una búsqueda
+#   - PHONE_SEARCH_CACHE_SIZE: Cantidad máxima de búsquedas distintas guardadas
+PHONE_SEARCH_CACHE_TTL = float(os.getenv("PHONE_SEARCH_CACHE_TTL", "300"))
+PHONE_SEARCH_CACHE_SIZE = int(os.getenv("PHONE_SEARCH_CACHE_SIZE", "256"))
 
-def get_twilio_client():
+search_cache = TTLCache(PHONE_SEARCH_CACHE_SIZE, PHONE_SEARCH_CACHE_TTL)
+search_flight = SingleFlight()
+
+
+def _search_key(search: PhoneNumberSearch):
+    return (search.country_code.upper(), search.area_code, search.limit)
+
+
+def _invalidate_search_cache(phone_number: str):
     """
-    Función para obtener el cliente de Twilio
+    Elimina de la caché las búsquedas que ofrecían un número que ya se compró
     """
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+    for key in search_cache.keys():
+        numbers = search_cache.get(key)
+        if numbers and any(number.phone_number == phone_number for number in numbers):
+            search_cache.pop(key)
 
-    if not account_sid or not auth_token:
-        raise HTTPException(status_code=500, detail="Twilio credentials not configured")
 
-    return Client(account_sid, auth_token)
+def _unavailable(error: TwilioUnavailable) -> HTTPException:
+    """
+    503 con Retry-After cuando Twilio no responde o su circuito está abierto
+    """
+    headers = {"Retry-After": str(math.ceil(error.retry_after))} if error.retry_after else None
+    return HTTPException(status_code=503, detail=str(error), headers=headers)
 
 
 @router.post("/search", response_model=List[AvailablePhoneNumber])
@@ -49,15 +72,29 @@ async def search_available_numbers(
         "area_code": "815",
         "limit": 5
     }
+
+    Los resultados se guardan en caché por PHONE_SEARCH_CACHE_TTL segundos, y
+    las búsquedas iguales que llegan al mismo tiempo comparten una sola
+    llamada a Twilio.
     """
-    try:
+    key = _search_key(search)
+
+    cached = search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    async def fetch():
         search_params = {}
         if search.area_code:
             search_params["area_code"] = search.area_code
 
-        available_numbers = client.available_phone_numbers(
-            search.country_code
-        ).local.list(limit=search.limit, **search_params)
+        available_numbers = await twilio_call(
+            "available_phone_numbers.list",
+            lambda: client.available_phone_numbers(
+                search.country_code
+            ).local.list_async(limit=search.limit, **search_params),
+            idempotent=True,
+        )
 
         result = []
         for number in available_numbers:
@@ -75,10 +112,16 @@ async def search_available_numbers(
                 )
             )
 
+        search_cache.set(key, result)
         return result
 
+    try:
+        return await search_flight.do(key, fetch)
+
     except TwilioRestException as e:
         raise HTTPException(status_code=400, detail=f"Twilio error: {e.msg}")
+    except TwilioUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -103,11 +146,23 @@ async def purchase_phone_number(
     }
     """
     try:
-        incoming_phone_number = client.incoming_phone_numbers.create(
-            phone_number=purchase.phone_number,
-            friendly_name=purchase.friendly_name or purchase.phone_number,
+        incoming_phone_number = await twilio_call(
+            "incoming_phone_numbers.create",
+            lambda: client.incoming_phone_numbers.create_async(
+                phone_number=purchase.phone_number,
+                friendly_name=purchase.friendly_name or purchase.phone_number,
+            ),
         )
 
+        # El número ya no está disponible para otras búsquedas
+        _invalidate_search_cache(incoming_phone_number.phone_number)
+
+        try:
+            await upsert_owned_number(phone_number_to_dict(incoming_phone_number))
+        except Exception:
+            # La sincronización de fondo lo agregará a la copia local
+            pass
+
         return PhoneNumberResponse(
             success=True,
             phone_number=incoming_phone_number.phone_number,
@@ -117,37 +172,52 @@ async def purchase_phone_number(
 
     except TwilioRestException as e:
         return PhoneNumberResponse(success=False, error=f"Twilio error: {e.msg}")
+    except TwilioUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         return PhoneNumberResponse(success=False, error=f"Error: {str(e)}")
 
 
 @router.get("/my-numbers", response_model=List[dict])
-async def list_my_phone_numbers(client: Client = Depends(get_twilio_client)):
+async def list_my_phone_numbers(
+    capability: Optional[str] = Query(
+        None, pattern="^(voice|sms|mms)$", description="Filtrar por capacidad"
+    ),
+    refresh: bool = Query(False, description="Leer directo de Twilio en vez de la copia local"),
+    client: Optional[Client] = Depends(get_optional_twilio_client),
+):
+    """
+    LISTAR MIS NÚMEROS
 
+    Se responde desde la copia local en MongoDB, que se actualiza al comprar o
+    liberar números y se reconcilia con Twilio en segundo plano.
+    Con ?refresh=true se lee la lista directo de Twilio (y se actualiza la copia).
+
+    Ejemplo:
+    GET /phone-numbers/my-numbers?capability=sms
+    """
     try:
-        phone_numbers = client.incoming_phone_numbers.list()
+        if not refresh:
+            return await find_owned_numbers(capability)
 
-        result = []
-        for number in phone_numbers:
-            result.append(
-                {
-                    "phone_number": number.phone_number,
-                    "friendly_name": number.friendly_name,
-                    "sid": number.sid,
-                    "capabilities": {
-                        "voice": number.capabilities.get("voice", False),
-                        "sms": number.capabilities.get("sms", False),
-                        "mms": number.capabilities.get("mms", False),
-                    },
-                    "status": number.status,
-                    "date_created": str(number.date_created),
-                }
-            )
+        if client is None:
+            raise HTTPException(status_code=500, detail="Twilio credentials not configured")
 
-        return result
+        phone_numbers = await refresh_inventory(client)
+
+        if capability:
+            phone_numbers = [
+                number for number in phone_numbers if number["capabilities"][capability]
+            ]
 
+        return phone_numbers
+
+    except HTTPException:
+        raise
     except TwilioRestException as e:
         raise HTTPException(status_code=400, detail=f"Twilio error: {e.msg}")
+    except TwilioUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error: {str(e)}")
 
@@ -164,7 +234,17 @@ async def release_phone_number(
     DELETE /phone-numbers/PN1234567890abcdef1234567890abcdef
     """
     try:
-        client.incoming_phone_numbers(phone_number_sid).delete()
+        await twilio_call(
+            "incoming_phone_numbers.delete",
+            lambda: client.incoming_phone_numbers(phone_number_sid).delete_async(),
+            idempotent=True,
+        )
+
+        try:
+            await delete_owned_number(phone_number_sid)
+        except Exception:
+            # La sincronización de fondo lo eliminará de la copia local
+            pass
 
         return PhoneNumberResponse(
             success=True, sid=phone_number_sid, phone_number=None
@@ -172,5 +252,7 @@ async def release_phone_number(
 
     except TwilioRestException as e:
         return PhoneNumberResponse(success=False, error=f"Twilio error: {e.msg}")
+    except TwilioUnavailable as e:
+        raise _unavailable(e)
     except Exception as e:
         return PhoneNumberResponse(success=False, error=f"Error: {str(e)}")
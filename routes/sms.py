@@ -1,25 +1,66 @@
-from fastapi import APIRouter, Depends, HTTPException, Form, Request
+from fastapi import APIRouter, Depends, HTTPException, Form, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 from twilio.twiml.messaging_response import MessagingResponse
-from models.device import SMSMessage
-from models.message import SMSResponse
+from bson import ObjectId
+from bson.errors import InvalidId
+from models.device import SMSMessage, SMSBatch
+from models.message import SMSResponse, HistoryPage, ConversationPage
 from models.mongo_models import SMSRecord
 from models.incoming_sms import IncomingSMS, IncomingSMSRecord
 from database.mongodb import (
     insert_sms_record,
+    insert_sms_records,
+    enqueue_sms_records,
+    schedule_sms,
+    cancel_scheduled_sms,
     find_sms_by_number,
-    insert_incoming_sms,
+    claim_incoming_sms,
     find_incoming_sms_by_number,
-    incoming_sms_collection,
+    mark_auto_reply_sent,
+    find_conversation_messages,
+    find_conversations,
+    mark_conversation_read,
+    find_rollups,
+    ROLLUP_COUNTERS,
 )
+from services.twilio_client import get_twilio_client, get_optional_twilio_client, twilio_call
+from services.sms_queue import SMS_SEND_MODE, sms_queue
+from services.dedupe import webhook_dedupe
+from services.metrics import serialization_latency, timed_webhook
+from services.logging_setup import get_logger
+from services.status_updates import STATUS_CALLBACK, status_coalescer
+from services.e164 import e164_key
+from services.sender_pool import sender_pool
+from services.preflight import preflight, preflight_batch, PreflightResult, OPT_OUT_ERROR, SMS_MAX_SEGMENTS, SMS_TRUNCATE
+from services.export import export_rows, ndjson_chunks, csv_chunks, gzip_chunks
+from services.auto_reply import auto_reply_engine
+from services.scheduler import scheduler, SMS_SCHEDULING_ENABLED, SCHEDULING_DISABLED_ERROR
+from services.opt_out import opt_out_list, opt_out_keyword, opt_out_suppressed, TWILIO_OPT_OUT_ERROR
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
-from datetime import datetime
-from typing import List
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
 
 load_dotenv()
 
+# Cantidad máxima de SMS que /send/batch envía a Twilio al mismo tiempo
+SMS_BATCH_CONCURRENCY = int(os.getenv("SMS_BATCH_CONCURRENCY", "20"))
+
+# Cómo se envía la respuesta automática a los SMS entrantes
+#   - "rest": Se envía con una llamada aparte a la API de Twilio (messages.create)
+#   - "twiml": Se devuelve dentro del TwiML de la respuesta del webhook (sin llamada extra)
+AUTO_REPLY_MODE = os.getenv("AUTO_REPLY_MODE", "rest")
+
+# Segundos máximos para enviar la respuesta automática en modo "rest"
+# (Twilio espera la respuesta del webhook como máximo 15 segundos)
+AUTO_REPLY_DEADLINE = float(os.getenv("AUTO_REPLY_DEADLINE", "5"))
+
+logger = get_logger("webhook")
+
 router = APIRouter(
     prefix="/sms",
     tags=["SMS"],
@@ -27,80 +68,365 @@ router = APIRouter(
 )
 
 
-def get_twilio_client():
-    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
-    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+def _build_sms_record(sms: SMSMessage, status: str, message_sid=None, error=None, from_number=None,
+                      check: Optional[PreflightResult] = None):
+    """
+    Crea el registro de un SMS ENVIADO que se guarda en MongoDB
+    """
+    return {
+        "from_number": from_number,
+        "to_number": sms.to_number,
+        # Después de _preflight() to_number ya está en E.164
+        "to_number_e164": e164_key(sms.to_number),
+        "message_body": sms.message_body,
+        "sent_at": datetime.now(),
+        "status": status,
+        "message_sid": message_sid,
+        "error": error,
+        "segments": check.segments if check else None,
+        "encoding": check.encoding if check else None,
+    }
+
+
+def _preflight(sms: SMSMessage):
+    """
+    Valida un SMS antes de enviarlo (sin llamadas por la red)
+
+    Retorna:
+        tuple: (SMSMessage con to_number en E.164 y el cuerpo recortado si
+                SMS_TRUNCATE=true, PreflightResult)
+    """
+    return _apply_check(sms, preflight(sms.to_number, sms.message_body))
+
+
+def _preflight_batch(messages: list) -> list:
+    """
+    Igual que _preflight() para un lote (los cuerpos se analizan una sola vez)
+    """
+    checks = preflight_batch([(sms.to_number, sms.message_body) for sms in messages])
+    return [_apply_check(sms, check) for sms, check in zip(messages, checks)]
 
-    if not account_sid or not auth_token:
-        raise HTTPException(status_code=500, detail="Twilio credentials not configured")
 
-    return Client(account_sid, auth_token)
+def _apply_check(sms: SMSMessage, check: PreflightResult):
+    if check.error == OPT_OUT_ERROR:
+        opt_out_suppressed.inc()
+    if check.ok:
+        # "+56 9 4837 2612" y "+56948372612" son el mismo destinatario
+        sms = sms.model_copy(update={"to_number": check.to_number, "message_body": check.body})
+    return sms, check
 
 
-@router.post("/send", response_model=SMSResponse)
-async def send_sms(sms: SMSMessage, client: Client = Depends(get_twilio_client)):
+def _pick_sender(to_number: str) -> Optional[str]:
     """
-    Envía un SMS a un número específico
+    Número desde el cual se envía un SMS: el menos cargado del pool de
+    remitentes (SMS_SENDER_POOL=true) o TWILIO_PHONE_NUMBER
     """
+    if sender_pool.enabled:
+        return sender_pool.pick(to_number) or os.getenv("TWILIO_PHONE_NUMBER")
+    return os.getenv("TWILIO_PHONE_NUMBER")
+
+
+async def _deliver_sms(client: Client, sms: SMSMessage, check: Optional[PreflightResult] = None):
+    """
+    Envía un SMS por Twilio sin guardarlo
+
+    Retorna:
+        tuple: (registro para MongoDB, SMSResponse para el cliente)
+    """
+    from_number = None
     try:
-        from_number = os.getenv("TWILIO_PHONE_NUMBER")
+        from_number = _pick_sender(sms.to_number)
 
         if not from_number:
             raise HTTPException(
                 status_code=500, detail="Twilio phone number not configured"
             )
 
-        message = client.messages.create(
-            body=sms.message_body, from_=from_number, to=sms.to_number
+        message = await twilio_call(
+            "messages.create",
+            lambda: client.messages.create_async(
+                body=sms.message_body,
+                from_=from_number,
+                to=sms.to_number,
+                status_callback=STATUS_CALLBACK,
+            ),
         )
 
-        # Crear un registro para MongoDB
-        sms_record = {
-            "to_number": sms.to_number,
-            "message_body": sms.message_body,
-            "sent_at": datetime.now(),
-            "status": "sent",
-            "message_sid": message.sid,
-            "error": None,
-        }
-
-        # Guardar en MongoDB
-        insert_sms_record(sms_record)
-
-        return SMSResponse(success=True, message_sid=message.sid)
+        return (
+            _build_sms_record(sms, "sent", message_sid=message.sid, from_number=from_number, check=check),
+            SMSResponse(success=True, message_sid=message.sid),
+        )
 
     except TwilioRestException as e:
-        sms_record = {
-            "to_number": sms.to_number,
-            "message_body": sms.message_body,
-            "sent_at": datetime.now(),
-            "status": "error",
-            "message_sid": None,
-            "error": f"Twilio error: {e.msg}",
-        }
-        insert_sms_record(sms_record)
-        return SMSResponse(success=False, error=f"Twilio error: {e.msg}")
+        error = f"Twilio error: {e.msg}"
+        if e.code == TWILIO_OPT_OUT_ERROR:
+            # STOP que no pasó por nuestro webhook: los próximos envíos se rechazan antes
+            await opt_out_list.record_twilio_error(sms.to_number)
     except Exception as e:
-        sms_record = {
-            "to_number": sms.to_number,
-            "message_body": sms.message_body,
-            "sent_at": datetime.now(),
-            "status": "error",
-            "message_sid": None,
-            "error": f"Error: {str(e)}",
-        }
-        insert_sms_record(sms_record)
-        return SMSResponse(success=False, error=f"Error: {str(e)}")
+        error = f"Error: {str(e)}"
+
+    return (
+        _build_sms_record(sms, "error", error=error, from_number=from_number, check=check),
+        SMSResponse(success=False, error=error),
+    )
+
+
+async def _enqueue_sms(items: list) -> list:
+    """
+    Guarda SMS en la cola de envío con un solo insert_many y despierta a los workers
+
+    Parámetros:
+        items (list): [(SMSMessage, PreflightResult)]
+
+    Retorna:
+        list: Un SMSResponse por mensaje, en el mismo orden
+    """
+    if not items:
+        return []
+
+    # Con el pool de remitentes el worker elige el número al momento de enviar
+    from_number = os.getenv("TWILIO_PHONE_NUMBER")
+
+    if not from_number and not sender_pool.senders:
+        error = "Error: Twilio phone number not configured"
+        await insert_sms_records([_build_sms_record(sms, "error", error=error, check=check) for sms, check in items])
+        return [SMSResponse(success=False, error=error) for _ in items]
+
+    record_ids = await enqueue_sms_records([
+        _build_sms_record(sms, "queued", from_number=from_number, check=check) for sms, check in items
+    ])
+    sms_queue.notify()
+
+    return [SMSResponse(success=True, status="queued", record_id=str(record_id)) for record_id in record_ids]
+
+
+def _is_scheduled(sms: SMSMessage) -> bool:
+    return sms.scheduled_at is not None and sms.scheduled_at > datetime.now()
+
+
+async def _schedule_sms(items: list) -> list:
+    """
+    Guarda SMS programados con un solo insert_many y los avisa al planificador
+
+    Parámetros:
+        items (list): [(SMSMessage con scheduled_at, PreflightResult)]
+
+    Retorna:
+        list: Un SMSResponse por mensaje, en el mismo orden
+    """
+    if not items:
+        return []
+
+    # Sin planificador en el despliegue el mensaje nunca saldría: se rechaza
+    if not SMS_SCHEDULING_ENABLED:
+        return [SMSResponse(success=False, error=f"Error: {SCHEDULING_DISABLED_ERROR}") for _ in items]
+
+    # Igual que en la cola, con el pool de remitentes el worker elige el número al enviar
+    from_number = os.getenv("TWILIO_PHONE_NUMBER")
+
+    # Sin remitente el mensaje fallaría recién al llegar su hora: se rechaza ahora
+    if not from_number and not sender_pool.senders:
+        error = "Error: Twilio phone number not configured"
+        await insert_sms_records([_build_sms_record(sms, "error", error=error, check=check) for sms, check in items])
+        return [SMSResponse(success=False, error=error) for _ in items]
+
+    sms_records = []
+    for sms, check in items:
+        sms_record = _build_sms_record(sms, "scheduled", from_number=from_number, check=check)
+        sms_record["sent_at"] = sms.scheduled_at
+        sms_records.append(sms_record)
+
+    record_ids = await schedule_sms(sms_records)
+    for record_id, (sms, _) in zip(record_ids, items):
+        scheduler.add(record_id, sms.scheduled_at)
+
+    return [SMSResponse(success=True, status="scheduled", record_id=str(record_id)) for record_id in record_ids]
+
+
+@router.post("/send", response_model=SMSResponse)
+async def send_sms(sms: SMSMessage, client: Client = Depends(get_twilio_client)):
+    """
+    Envía un SMS a un número específico
+
+    Con SMS_SEND_MODE=queue el mensaje solo se guarda como "queued" y la
+    respuesta es inmediata; los workers de services/sms_queue.py lo envían.
+
+    Antes de cualquier llamada a Twilio se valida el mensaje (ver
+    services/preflight.py); si no se puede enviar se responde 422 y no se
+    guarda nada.
+
+    Con scheduled_at en el futuro el mensaje se guarda como "scheduled" y
+    services/scheduler.py lo pasa a la cola de envío cuando llega su hora.
+    Si ningún proceso tiene el planificador (SMS_SCHEDULING_ENABLED=false)
+    se responde 422.
+
+    Ejemplo:
+    POST /sms/send
+    {"to_number": "+56948372612", "message_body": "Recordatorio: su hora es mañana",
+     "scheduled_at": "2025-03-01T09:00:00-03:00"}
+    """
+    sms, check = _preflight(sms)
+    if not check.ok:
+        raise HTTPException(status_code=422, detail=f"Preflight: {check.error}")
+
+    if _is_scheduled(sms):
+        if not SMS_SCHEDULING_ENABLED:
+            raise HTTPException(status_code=422, detail=SCHEDULING_DISABLED_ERROR)
+        return (await _schedule_sms([(sms, check)]))[0]
+
+    if SMS_SEND_MODE == "queue":
+        return (await _enqueue_sms([(sms, check)]))[0]
+
+    sms_record, response = await _deliver_sms(client, sms, check)
+
+    # Guardar en MongoDB
+    await insert_sms_record(sms_record)
+
+    return response
+
+
+@router.post("/send/batch", response_model=List[SMSResponse])
+async def send_sms_batch(batch: SMSBatch, client: Client = Depends(get_twilio_client)):
+    """
+    Envía varios SMS en paralelo
+
+    Se envían como máximo SMS_BATCH_CONCURRENCY mensajes a la vez y todos los
+    registros se guardan en MongoDB con un solo insert_many.
+    Retorna un SMSResponse por cada mensaje, en el mismo orden de la petición.
+    Los mensajes que no pasan la validación previa no se envían ni se guardan.
+    Los que traen scheduled_at en el futuro se programan (ver /send).
+    Con SMS_SEND_MODE=queue los demás se encolan todos juntos (como en /send)
+    y los workers los envían con el límite de tasa y los reintentos de la cola.
+
+    Ejemplo:
+    POST /sms/send/batch
+    {
+        "messages": [
+            {"to_number": "+56948372612", "message_body": "Hola"},
+            {"to_number": "+56912345678", "message_body": "Hola"}
+        ]
+    }
+    """
+    semaphore = asyncio.Semaphore(SMS_BATCH_CONCURRENCY)
+    prepared = _preflight_batch(batch.messages)
+
+    # Los programados se guardan todos juntos y no pasan por Twilio ahora
+    scheduled = [index for index, (sms, check) in enumerate(prepared) if check.ok and _is_scheduled(sms)]
+    scheduled_responses = dict(zip(scheduled, await _schedule_sms([prepared[index] for index in scheduled])))
+
+    # En modo cola los demás se guardan como "queued" con un solo insert_many
+    queued_responses = {}
+    if SMS_SEND_MODE == "queue":
+        queued = [
+            index for index, (_, check) in enumerate(prepared)
+            if check.ok and index not in scheduled_responses
+        ]
+        queued_responses = dict(zip(queued, await _enqueue_sms([prepared[index] for index in queued])))
+
+    async def deliver(index: int, sms: SMSMessage, check: PreflightResult):
+        if not check.ok:
+            return None, SMSResponse(success=False, error=f"Preflight: {check.error}")
+        if index in scheduled_responses:
+            return None, scheduled_responses[index]
+        if index in queued_responses:
+            return None, queued_responses[index]
+        async with semaphore:
+            return await _deliver_sms(client, sms, check)
+
+    results = await asyncio.gather(*(deliver(index, sms, check) for index, (sms, check) in enumerate(prepared)))
+
+    await insert_sms_records([sms_record for sms_record, _ in results if sms_record is not None])
+
+    return [response for _, response in results]
+
+
+@router.delete("/scheduled/{record_id}")
+async def cancel_scheduled(record_id: str):
+    """
+    Cancela un SMS programado que todavía no se envía
+
+    El registro queda en el historial con status "canceled".
+    """
+    try:
+        object_id = ObjectId(record_id)
+    except (InvalidId, TypeError):
+        raise HTTPException(status_code=400, detail=f"Invalid record id: {record_id}")
+
+    if not await cancel_scheduled_sms(object_id):
+        raise HTTPException(status_code=404, detail="Scheduled message not found or already sent")
+
+    return {"success": True, "record_id": record_id, "status": "canceled"}
+
+
+@router.post("/estimate")
+async def estimate_sms_batch(batch: SMSBatch):
+    """
+    Calcula sin enviar nada la codificación y los segmentos de cada mensaje de
+    un lote, y el total de segmentos que cobraría Twilio
+
+    Los cuerpos se analizan de una vez para todo el lote (ver
+    preflight_batch()); los números inválidos cuentan como rechazados.
+
+    Ejemplo:
+    POST /sms/estimate
+    {"messages": [{"to_number": "+56948372612", "message_body": "Hola"}]}
+
+    Respuesta:
+    {"messages": 1, "accepted": 1, "rejected": 0, "total_segments": 1,
+     "segments_by_encoding": {"GSM-7": 1, "UCS-2": 0}, "items": [...]}
+    """
+    items = []
+    total_segments = 0
+    segments_by_encoding = {"GSM-7": 0, "UCS-2": 0}
+    rejected = 0
+
+    checks = preflight_batch([(sms.to_number, sms.message_body) for sms in batch.messages])
+    for sms, check in zip(batch.messages, checks):
+        items.append({
+            "to_number": check.to_number or sms.to_number,
+            "ok": check.ok,
+            "encoding": check.encoding,
+            "segments": check.segments,
+            "truncated": check.ok and check.body != sms.message_body,
+            "error": check.error,
+        })
+        if check.ok:
+            total_segments += check.segments
+            segments_by_encoding[check.encoding] += check.segments
+        else:
+            rejected += 1
+
+    return {
+        "messages": len(items),
+        "accepted": len(items) - rejected,
+        "rejected": rejected,
+        "total_segments": total_segments,
+        "segments_by_encoding": segments_by_encoding,
+        "max_segments": SMS_MAX_SEGMENTS,
+        "truncate": SMS_TRUNCATE,
+        "items": items,
+    }
+
+
+def _twiml_response(resp: MessagingResponse) -> Response:
+    """
+    Devuelve el TwiML como XML (Twilio no interpreta un string JSON)
+    """
+    started = time.perf_counter()
+    content = str(resp)
+    serialization_latency.observe(time.perf_counter() - started, ("twiml",))
+    return Response(content=content, media_type="application/xml")
 
 
 @router.post("/webhook/incoming")
+@timed_webhook("incoming")
 async def receive_sms(
     MessageSid: str = Form(...),
     From: str = Form(...),
     To: str = Form(...),
     Body: str = Form(...),
     NumMedia: str = Form(default="0"),
-    client: Client = Depends(get_twilio_client),
+    client: Optional[Client] = Depends(get_optional_twilio_client),
 ):
     """
     WEBHOOK para recibir SMS entrantes desde Twilio
@@ -108,16 +434,51 @@ async def receive_sms(
     Cuando alguien envía un SMS:
     1. Twilio llama a esta ruta automáticamente
     2. Guardamos el mensaje en MongoDB
-    3. Enviamos una respuesta automática
+    3. Enviamos una respuesta automática (salvo a STOP / START, que
+       actualizan la lista de supresión)
     4. Devolvemos TwiML (formato XML que Twilio entiende)
+
+    Con AUTO_REPLY_MODE=twiml la respuesta automática va dentro del TwiML
+    (paso 4) y el registro se guarda una sola vez, ya con su estado final.
     """
+    # Reintento de Twilio de un mensaje que ya se procesó en este proceso
+    cached_reply = webhook_dedupe.check(MessageSid)
+    if cached_reply is not None:
+        logger.info("sms_duplicate", extra={"fields": {"message_sid": MessageSid, "source": "cache"}})
+        resp = MessagingResponse()
+        if cached_reply:
+            resp.message(cached_reply)
+        return _twiml_response(resp)
+
     try:
-        print(f"SMS recibido de {From}: {Body}")
+        logger.info(
+            "sms_received",
+            extra={
+                "fields": {"message_sid": MessageSid, "from_number": From, "to_number": To, "message_body": Body},
+                "sampled": True,
+            },
+        )
+
+        # STOP / START: se actualiza la lista de supresión y no se responde
+        # (Twilio envía su propia confirmación)
+        opted_out = opt_out_keyword(Body)
+        if opted_out is not None:
+            await opt_out_list.record(From, opted_out, Body.strip().upper())
+            auto_reply_text = ""
+        elif opt_out_list.is_suppressed(From):
+            # Twilio rechazaría la respuesta con el error 21610 (en ambos modos)
+            opt_out_suppressed.inc()
+            auto_reply_text = ""
+        else:
+            # Elegir la respuesta automática según las reglas (vacía = no responder)
+            auto_reply_text = auto_reply_engine.reply(From, To, Body)
 
         # Guardar el mensaje recibido en MongoDB
         incoming_record = {
             "from_number": From,
+            "from_number_e164": e164_key(From),
             "to_number": To,
+            "to_number_e164": e164_key(To),
             "message_body": Body,
             "received_at": datetime.now().isoformat(),
             "message_sid": MessageSid,
@@ -125,68 +486,291 @@ async def receive_sms(
             "auto_reply_sid": None,
         }
 
-        insert_incoming_sms(incoming_record)
-        print(f"Mensaje guardado en MongoDB")
-
-        # Crear respuesta automática personalizada
-        auto_reply_text = f"¡Hola! Recibimos tu mensaje: '{Body}'. Gracias por contactarnos, te responderemos pronto."
+        # Los próximos envíos a este cliente salen desde el número al que escribió
+        sender_pool.assign(incoming_record["from_number_e164"], To)
+
+        if AUTO_REPLY_MODE == "twiml":
+            # Twilio envía el <Message> del TwiML; no hay SID de respuesta que guardar
+            incoming_record["auto_reply_sent"] = bool(auto_reply_text)
+            if await claim_incoming_sms(incoming_record):
+                webhook_dedupe.miss()
+                logger.debug("sms_stored", extra={"fields": {"message_sid": MessageSid}, "sampled": True})
+            else:
+                # Twilio descarta la respuesta de un intento que tardó demasiado,
+                # así que el reintento debe devolver el mismo <Message>
+                webhook_dedupe.store_hit()
+                logger.info("sms_duplicate", extra={"fields": {"message_sid": MessageSid, "source": "store"}})
+
+            webhook_dedupe.remember(MessageSid, auto_reply_text)
+            resp = MessagingResponse()
+            if auto_reply_text:
+                resp.message(auto_reply_text)
+            return _twiml_response(resp)
+
+        if not await claim_incoming_sms(incoming_record):
+            webhook_dedupe.store_hit()
+            logger.info("sms_duplicate", extra={"fields": {"message_sid": MessageSid, "source": "store"}})
+            return _twiml_response(MessagingResponse())
+
+        webhook_dedupe.miss()
+        logger.debug("sms_stored", extra={"fields": {"message_sid": MessageSid}, "sampled": True})
+
+        if not auto_reply_text:
+            return _twiml_response(MessagingResponse())
 
         # Enviar respuesta automática usando el cliente de Twilio
         try:
-            print(f"Intentando enviar respuesta automática a {From}")
-
-            reply_message = client.messages.create(
-                body=auto_reply_text,
-                from_=To,
-                to=From,
+            if client is None:
+                raise RuntimeError("Twilio credentials not configured")
+
+            reply_message = await twilio_call(
+                "messages.create",
+                lambda: client.messages.create_async(
+                    body=auto_reply_text,
+                    from_=To,
+                    to=From,
+                ),
+                deadline=AUTO_REPLY_DEADLINE,
             )
 
-            print(f"Respuesta enviada con SID: {reply_message.sid}")
-
             # Actualizar el registro en MongoDB
-            incoming_sms_collection.update_one(
-                {"message_sid": MessageSid},
-                {
-                    "$set": {
-                        "auto_reply_sent": True,
-                        "auto_reply_sid": reply_message.sid,
-                    }
+            await mark_auto_reply_sent(MessageSid, reply_message.sid, incoming_record)
+
+            logger.info(
+                "auto_reply_sent",
+                extra={
+                    "fields": {"message_sid": MessageSid, "auto_reply_sid": reply_message.sid, "to_number": From},
+                    "sampled": True,
                 },
             )
 
-            print(f"Registro actualizado en MongoDB")
-
         except TwilioRestException as reply_error:
-            print(f"Error de Twilio al enviar respuesta: {reply_error.msg}")
-            print(f"   Código de error: {reply_error.code}")
+            logger.warning(
+                "auto_reply_failed",
+                extra={"fields": {"message_sid": MessageSid, "error": reply_error.msg, "code": reply_error.code}},
+            )
         except Exception as reply_error:
-            print(f"Error general al enviar respuesta: {str(reply_error)}")
+            logger.warning(
+                "auto_reply_failed",
+                extra={"fields": {"message_sid": MessageSid, "error": str(reply_error)}},
+            )
 
         resp = MessagingResponse()
-        return str(resp)
+        return _twiml_response(resp)
 
     except Exception as e:
-        print(f"Error procesando SMS entrante: {str(e)}")
-        import traceback
+        # Permitir que el reintento de Twilio vuelva a procesar el mensaje
+        webhook_dedupe.forget(MessageSid)
 
-        traceback.print_exc()
+        logger.exception("sms_processing_failed", extra={"fields": {"message_sid": MessageSid, "error": str(e)}})
 
         resp = MessagingResponse()
         resp.message("Error procesando tu mensaje. Por favor intenta más tarde.")
-        return str(resp)
+        return _twiml_response(resp)
+
+
+def _history_page(items: list, next_cursor: Optional[str]) -> HistoryPage:
+    started = time.perf_counter()
+    page = HistoryPage(items=items, next_cursor=next_cursor)
+    serialization_latency.observe(time.perf_counter() - started, ("history",))
+    return page
+
+
+@router.post("/webhook/status", status_code=204)
+@timed_webhook("status")
+async def receive_status_callback(
+    MessageSid: str = Form(...),
+    MessageStatus: str = Form(...),
+    ErrorCode: Optional[str] = Form(default=None),
+):
+    """
+    WEBHOOK para los cambios de estado de los SMS enviados (StatusCallback de Twilio)
+
+    Se registra en cada messages.create cuando TWILIO_STATUS_CALLBACK_URL está
+    definida. Los estados se acumulan en memoria y se guardan en lotes.
+    """
+    status_coalescer.add(MessageSid, MessageStatus, ErrorCode)
+    return Response(status_code=204)
+
 
+@router.get("/history/sent/{phone_number}", response_model=HistoryPage)
+async def get_sms_history_by_number(
+    phone_number: str,
+    limit: int = Query(50, ge=1, le=500, description="Mensajes por página"),
+    after: Optional[str] = Query(None, description="Cursor de la página anterior"),
+    since: Optional[datetime] = Query(None, description="Desde esta fecha (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Hasta esta fecha (exclusivo)"),
+):
+    """
+    Obtiene el historial de mensajes SMS ENVIADOS a un número específico,
+    paginado del más reciente al más antiguo
+    """
+    try:
+        items, next_cursor = await find_sms_by_number(
+            phone_number, limit=limit, after=after, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-@router.get("/history/sent/{phone_number}", response_model=List[dict])
-async def get_sms_history_by_number(phone_number: str):
+    return _history_page(items, next_cursor)
+
+
+@router.get("/history/received/{phone_number}", response_model=HistoryPage)
+async def get_incoming_sms_by_number(
+    phone_number: str,
+    limit: int = Query(50, ge=1, le=500, description="Mensajes por página"),
+    after: Optional[str] = Query(None, description="Cursor de la página anterior"),
+    since: Optional[datetime] = Query(None, description="Desde esta fecha (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Hasta esta fecha (exclusivo)"),
+):
     """
-    Obtiene el historial de mensajes SMS ENVIADOS a un número específico
+    Obtiene el historial de mensajes SMS RECIBIDOS desde un número específico,
+    paginado del más reciente al más antiguo
     """
-    return find_sms_by_number(phone_number)
+    try:
+        items, next_cursor = await find_incoming_sms_by_number(
+            phone_number, limit=limit, after=after, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
+    return _history_page(items, next_cursor)
 
-@router.get("/history/received/{phone_number}", response_model=List[dict])
-async def get_incoming_sms_by_number(phone_number: str):
+
+@router.get("/conversations", response_model=ConversationPage)
+async def list_conversations(
+    limit: int = Query(50, ge=1, le=500, description="Conversaciones por página"),
+    after: Optional[str] = Query(None, description="Cursor de la página anterior"),
+):
+    """
+    Lista las conversaciones con su último mensaje, contadores y mensajes sin
+    leer, de la más reciente a la más antigua
+    """
+    try:
+        items, next_cursor = await find_conversations(limit=limit, after=after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    started = time.perf_counter()
+    page = ConversationPage(items=items, next_cursor=next_cursor)
+    serialization_latency.observe(time.perf_counter() - started, ("conversations",))
+    return page
+
+
+@router.get("/conversations/{phone_number}", response_model=HistoryPage)
+async def get_conversation(
+    phone_number: str,
+    limit: int = Query(50, ge=1, le=500, description="Mensajes por página"),
+    after: Optional[str] = Query(None, description="Cursor de la página anterior"),
+    since: Optional[datetime] = Query(None, description="Desde esta fecha (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Hasta esta fecha (exclusivo)"),
+):
+    """
+    Obtiene la conversación con un número: los SMS ENVIADOS y RECIBIDOS en
+    una sola lista, paginada del más reciente al más antiguo
+
+    Cada mensaje incluye "direction": "sent" o "received".
     """
-    Obtiene el historial de mensajes SMS RECIBIDOS desde un número específico
+    try:
+        items, next_cursor = await find_conversation_messages(
+            phone_number, limit=limit, after=after, since=since, until=until
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return _history_page(items, next_cursor)
+
+
+@router.post("/conversations/{phone_number}/read")
+async def read_conversation(phone_number: str):
+    """
+    Marca como leídos los mensajes recibidos de una conversación
+    """
+    if not await mark_conversation_read(phone_number):
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    return {"success": True, "phone_number": phone_number}
+
+
+def _with_rates(counters: dict) -> dict:
+    """
+    Agrega a los contadores la tasa de error de los envíos y la de respuestas automáticas
+    """
+    sent, received = counters.get("sent", 0), counters.get("received", 0)
+    return {
+        **counters,
+        "error_rate": round(counters.get("sent_errors", 0) / sent, 4) if sent else 0.0,
+        "auto_reply_rate": round(counters.get("auto_replies", 0) / received, 4) if received else 0.0,
+    }
+
+
+@router.get("/stats")
+async def get_sms_stats(
+    granularity: Literal["hour", "day"] = Query("hour", description="Tamaño de cada intervalo"),
+    phone_number: Optional[str] = Query(None, description="Número del cliente (vacío para toda la cuenta)"),
+    since: Optional[datetime] = Query(None, description="Desde esta fecha (por defecto, hace 24 horas o 30 días)"),
+    until: Optional[datetime] = Query(None, description="Hasta esta fecha (exclusivo, por defecto ahora)"),
+):
+    """
+    Volumen de SMS enviados y recibidos, tasa de error y tasa de respuestas
+    automáticas, por hora o por día
+
+    Se calcula con los contadores de sms_rollups (un documento por intervalo),
+    sin recorrer los mensajes.
+
+    Ejemplo:
+    GET /sms/stats?granularity=day&phone_number=%2B56948372612&since=2025-11-01
+    """
+    until = until or datetime.now()
+    since = since or until - (timedelta(days=1) if granularity == "hour" else timedelta(days=30))
+
+    buckets = await find_rollups(granularity, since, until, phone_number)
+
+    totals = dict.fromkeys(ROLLUP_COUNTERS, 0)
+    for bucket in buckets:
+        for counter in ROLLUP_COUNTERS:
+            totals[counter] += bucket.get(counter, 0)
+
+    return {
+        "granularity": granularity,
+        "phone_number": phone_number,
+        "since": since,
+        "until": until,
+        "totals": _with_rates(totals),
+        "buckets": [_with_rates(bucket) for bucket in buckets],
+    }
+
+
+@router.get("/export")
+async def export_sms(
+    format: Literal["ndjson", "csv"] = Query("ndjson", description="Formato del archivo"),
+    direction: Literal["sent", "received", "all"] = Query("all", description="Mensajes a exportar"),
+    since: Optional[datetime] = Query(None, description="Desde esta fecha (inclusive)"),
+    until: Optional[datetime] = Query(None, description="Hasta esta fecha (exclusivo)"),
+    phone_number: Optional[List[str]] = Query(None, description="Solo estos números (se puede repetir)"),
+    gzip: bool = Query(False, description="Comprimir el archivo con gzip"),
+):
+    """
+    Exporta el historial de mensajes de un rango de fechas como NDJSON o CSV
+
+    La respuesta se genera a medida que se lee el cursor de MongoDB, así la
+    memoria usada es la misma para mil o para decenas de millones de filas.
+
+    Ejemplo:
+    GET /sms/export?format=csv&since=2025-11-01&until=2025-12-01&gzip=true
     """
-    return find_incoming_sms_by_number(phone_number)
+    chunks = export_rows(direction, since, until, phone_number)
+    chunks = ndjson_chunks(chunks) if format == "ndjson" else csv_chunks(chunks)
+    filename = f"sms_export.{format}"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+
+    if gzip:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
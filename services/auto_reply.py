@@ -0,0 +1,237 @@
+from database.mongodb import find_auto_reply_rules, auto_reply_rules_version
+from services.e164 import e164_key
+from services.logging_setup import get_logger
+from collections import deque
+from string import Template
+from typing import Optional
+import asyncio
+import os
+import unicodedata
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración del motor de respuestas automáticas
+#   - AUTO_REPLY_RELOAD_SECONDS: Cada cuánto se revisa si cambiaron las reglas en MongoDB
+#   - AUTO_REPLY_DEFAULT: Respuesta cuando ninguna regla coincide (admite las mismas
+#     variables que las reglas: $body, $from_number, $to_number, $keyword)
+AUTO_REPLY_RELOAD_SECONDS = float(os.getenv("AUTO_REPLY_RELOAD_SECONDS", "10"))
+AUTO_REPLY_DEFAULT = os.getenv(
+    "AUTO_REPLY_DEFAULT",
+    "¡Hola! Recibimos tu mensaje: '$body'. Gracias por contactarnos, te responderemos pronto.",
+)
+
+logger = get_logger("auto_reply")
+
+
+def normalize_text(text: str) -> str:
+    """
+    Pasa el texto a minúsculas y le quita los acentos ("Precio", "PRECIÓ" y
+    "precio" coinciden con la misma palabra clave)
+    """
+    return "".join(
+        unicodedata.normalize("NFKD", character)[0] if not character.isascii() else character
+        for character in text.lower()
+    )
+
+
+class KeywordMatcher:
+    """
+    Busca muchas palabras clave a la vez con el algoritmo Aho-Corasick
+
+    Las palabras se compilan en un autómata (un trie con enlaces de falla).
+    search() recorre el texto una sola vez: el tiempo depende del largo del
+    mensaje y no de la cantidad de palabras clave.
+
+    Ejemplo:
+        matcher = KeywordMatcher(["precio", "horario"])
+        list(matcher.search("cual es el horario?"))  # [(11, 1)] -> (inicio, índice de la palabra)
+    """
+
+    def __init__(self, keywords: list):
+        self.keywords = keywords
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for index, keyword in enumerate(keywords):
+            state = 0
+            for character in keyword:
+                next_state = self._goto[state].get(character)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][character] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = next_state
+            self._output[state].append(index)
+
+        # Enlaces de falla por recorrido en anchura: cada estado apunta al
+        # sufijo más largo que también es prefijo de alguna palabra
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and character not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(character, 0)
+                if self._fail[next_state] == next_state:
+                    self._fail[next_state] = 0
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def search(self, text: str):
+        """
+        Retorna (posición de inicio, índice de la palabra) por cada coincidencia
+        """
+        goto, fail, output, keywords = self._goto, self._fail, self._output, self.keywords
+        state = 0
+        for position, character in enumerate(text):
+            while state and character not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(character, 0)
+            for index in output[state]:
+                yield position - len(keywords[index]) + 1, index
+
+
+class CompiledRules:
+    """
+    Reglas de un número receptor compiladas: un KeywordMatcher y una plantilla por regla
+    """
+
+    def __init__(self, rules: list):
+        self.rules = rules
+        self.matcher = KeywordMatcher([rule["keyword"] for rule in rules])
+
+    def match(self, text: str) -> Optional[dict]:
+        """
+        Retorna la regla que coincide con el texto (ya normalizado)
+
+        Las palabras clave solo coinciden como palabras completas. Si coinciden
+        varias, gana la de mayor prioridad y, a igual prioridad, la que
+        aparece primero en el mensaje.
+        """
+        best = None
+        best_key = None
+        for start, index in self.matcher.search(text):
+            rule = self.rules[index]
+            end = start + len(rule["keyword"])
+            if start > 0 and text[start - 1].isalnum():
+                continue
+            if end < len(text) and text[end].isalnum():
+                continue
+            key = (-rule["priority"], start)
+            if best_key is None or key < best_key:
+                best, best_key = rule, key
+        return best
+
+
+class AutoReplyEngine:
+    """
+    Elige la respuesta automática de cada SMS recibido según las reglas guardadas en MongoDB
+
+    Cada regla tiene una palabra clave, una plantilla de respuesta
+    (string.Template, ej: "Hola, nuestro horario es de 9 a 18. Escribiste: $body")
+    y opcionalmente el número receptor al que aplica (sin número = todos).
+
+    Las reglas se compilan en memoria al cargarlas; una tarea de fondo
+    revisa cada AUTO_REPLY_RELOAD_SECONDS si cambiaron y las vuelve a compilar.
+    """
+
+    def __init__(self, reload_seconds: float, default_reply: str):
+        self.reload_seconds = reload_seconds
+        self.default_template = Template(default_reply)
+        self._by_number = {}
+        self._global = CompiledRules([])
+        self._version = None
+        self._task = None
+        self.rule_count = 0
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                version = await auto_reply_rules_version()
+                if version != self._version:
+                    await self.reload(version)
+            except Exception:
+                logger.exception("auto_reply_reload_failed")
+            await asyncio.sleep(self.reload_seconds)
+
+    async def reload(self, version=None):
+        """
+        Lee todas las reglas de MongoDB y reemplaza las compiladas
+        """
+        if version is None:
+            version = await auto_reply_rules_version()
+        documents = await find_auto_reply_rules()
+        self.compile(documents)
+        self._version = version
+        logger.info("auto_reply_rules_loaded", extra={"fields": {"rules": self.rule_count}})
+
+    def compile(self, documents: list):
+        """
+        Compila las reglas activas: un autómata por número receptor (sus reglas
+        más las globales) y una plantilla por regla
+        """
+        rules = []
+        for document in documents:
+            if not document.get("enabled", True):
+                continue
+            keyword = normalize_text(document["keyword"].strip())
+            if not keyword:
+                continue
+            rules.append({
+                "keyword": keyword,
+                "template": Template(document["reply"]),
+                "to_number": document.get("to_number"),
+                "priority": document.get("priority", 0),
+            })
+
+        global_rules = [rule for rule in rules if not rule["to_number"]]
+        numbers = {rule["to_number"] for rule in rules if rule["to_number"]}
+
+        # Se arma todo antes de reemplazar, así reply() nunca ve un estado a medias
+        by_number = {
+            number: CompiledRules([rule for rule in rules if rule["to_number"] == number] + global_rules)
+            for number in numbers
+        }
+        self._global = CompiledRules(global_rules)
+        self._by_number = by_number
+        self.rule_count = len(rules)
+
+    def reply(self, from_number: str, to_number: str, body: str) -> str:
+        """
+        Retorna el texto de la respuesta automática de un SMS recibido
+
+        Si ninguna regla coincide se usa AUTO_REPLY_DEFAULT. Una regla con
+        respuesta vacía hace que no se responda nada.
+        """
+        compiled = self._by_number.get(e164_key(to_number), self._global)
+        rule = compiled.match(normalize_text(body))
+
+        template = rule["template"] if rule else self.default_template
+        return template.safe_substitute(
+            body=body,
+            from_number=from_number,
+            to_number=to_number,
+            keyword=rule["keyword"] if rule else "",
+        )
+
+    def stats(self) -> dict:
+        return {"rules": self.rule_count, "numbers": len(self._by_number)}
+
+
+# Motor compartido por el webhook de SMS entrantes
+auto_reply_engine = AutoReplyEngine(AUTO_REPLY_RELOAD_SECONDS, AUTO_REPLY_DEFAULT)
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+import asyncio
+import time
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Caché en memoria con tamaño máximo (LRU) y tiempo de vida (TTL)
+
+    - Cada entrada vence `ttl` segundos después de guardarse
+    - Si se supera `maxsize`, se elimina la entrada usada hace más tiempo
+
+    Ejemplo:
+        cache = TTLCache(maxsize=1000, ttl=60)
+        cache.set("clave", "valor")
+        cache.get("clave")  # "valor" (None después de 60 segundos)
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def keys(self):
+        return list(self._data.keys())
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Agrupa las llamadas concurrentes con la misma clave en una sola
+
+    Si llega una llamada mientras otra con la misma clave está en curso,
+    espera el resultado de la primera en vez de repetir el trabajo.
+
+    El trabajo corre en su propia tarea y todas las llamadas (también la
+    primera) la esperan con asyncio.shield(): si una petición se cancela
+    (ej: el cliente se desconecta), las demás siguen esperando el resultado.
+
+    Ejemplo:
+        flight = SingleFlight()
+        result = await flight.do(("US", "815"), lambda: buscar_numeros("US", "815"))
+    """
+
+    def __init__(self):
+        self._inflight = {}
+
+    async def do(self, key, factory):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Marca la excepción como leída aunque nadie más esté esperando
+        if not task.cancelled():
+            task.exception()
@@ -0,0 +1,117 @@
+from typing import Optional
+import time
+
+
+class CircuitBreaker:
+    """
+    Corta las llamadas a un servicio caído en vez de esperar su timeout una y otra vez
+
+    Estados:
+        - "closed": Las llamadas pasan. Se cuentan los fallos seguidos.
+        - "open": Tras `failure_threshold` fallos seguidos las llamadas se
+          rechazan al instante durante `reset_seconds`.
+        - "half_open": Pasado ese tiempo se deja pasar UNA llamada de prueba;
+          si funciona el circuito se cierra, si falla se vuelve a abrir.
+
+    Ejemplo:
+        breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+        wait = breaker.allow()
+        if wait is not None:
+            ...  # rechazar: el circuito está abierto por `wait` segundos más
+        try:
+            result = await llamada()
+        except Exception:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._probing = False
+
+    def _retry_in(self, now: float) -> float:
+        return max(0.0, self.opened_at + self.reset_seconds - now)
+
+    def allow(self) -> Optional[float]:
+        """
+        Pide permiso para hacer una llamada
+
+        Retorna:
+            None si la llamada puede hacerse, o los segundos que faltan para
+            volver a intentar si el circuito está abierto
+        """
+        if self.state == "open":
+            retry_in = self._retry_in(time.monotonic())
+            if retry_in > 0:
+                return retry_in
+            self.state = "half_open"
+
+        if self.state == "half_open":
+            # Mientras la llamada de prueba no termina, las demás se rechazan
+            if self._probing:
+                return self.reset_seconds
+            self._probing = True
+
+        return None
+
+    def available(self) -> bool:
+        """
+        Indica si allow() dejaría pasar una llamada (sin reservar la prueba)
+        """
+        if self.state == "open":
+            return self._retry_in(time.monotonic()) == 0
+        return not (self.state == "half_open" and self._probing)
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opens += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def release(self):
+        """
+        Libera la llamada de prueba sin resultado (ej: la petición se canceló)
+        """
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "opens": self.opens,
+            "retry_in": round(self._retry_in(time.monotonic()), 3) if self.state == "open" else None,
+        }
+
+
+class CircuitBreakers:
+    """
+    Un CircuitBreaker por clave (por ejemplo, por endpoint de una API)
+    """
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._breakers = {}
+
+    def get(self, key: str) -> CircuitBreaker:
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            breaker = self._breakers[key] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+        return breaker
+
+    def stats(self) -> dict:
+        return {key: breaker.stats() for key, breaker in self._breakers.items()}
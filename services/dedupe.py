@@ -0,0 +1,99 @@
+from services.cache import TTLCache
+from services.metrics import registry, CallbackGauge
+from typing import Optional
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de la deduplicación de webhooks
+#   - WEBHOOK_DEDUPE_CACHE_SIZE: Cantidad de MessageSid recientes que se recuerdan en memoria
+#   - WEBHOOK_DEDUPE_TTL_SECONDS: Por cuánto tiempo se recuerda cada MessageSid
+WEBHOOK_DEDUPE_CACHE_SIZE = int(os.getenv("WEBHOOK_DEDUPE_CACHE_SIZE", "10000"))
+WEBHOOK_DEDUPE_TTL_SECONDS = float(os.getenv("WEBHOOK_DEDUPE_TTL_SECONDS", "600"))
+
+
+class WebhookDeduplicator:
+    """
+    Detecta reintentos de Twilio del mismo mensaje entrante (mismo MessageSid)
+
+    Tiene dos niveles:
+        1. Caché en memoria de los SID vistos hace poco (camino rápido, sin red)
+        2. El índice único de message_sid en MongoDB, que detecta los reintentos
+           que llegan a otro proceso (ver claim_incoming_sms)
+
+    Cuenta los aciertos de cada nivel para calcular la tasa de duplicados.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._seen = TTLCache(maxsize, ttl)
+        self.cache_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    def check(self, message_sid: str) -> Optional[str]:
+        """
+        Busca un SID en la caché
+
+        Retorna:
+            None si el SID es nuevo (y lo registra), o el texto de respuesta
+            guardado con remember() si ya se procesó ("" si no hay respuesta)
+        """
+        reply = self._seen.get(message_sid)
+        if reply is not None:
+            self.cache_hits += 1
+            return reply
+
+        self._seen.set(message_sid, "")
+        return None
+
+    def remember(self, message_sid: str, reply: str):
+        """
+        Guarda el texto de la respuesta TwiML de un SID, para repetirla en los reintentos
+        """
+        self._seen.set(message_sid, reply)
+
+    def store_hit(self):
+        """
+        Registra un duplicado detectado por MongoDB (no estaba en la caché)
+        """
+        self.store_hits += 1
+
+    def miss(self):
+        """
+        Registra un mensaje nuevo
+        """
+        self.misses += 1
+
+    def forget(self, message_sid: str):
+        """
+        Olvida un SID cuyo procesamiento falló, para que el reintento de Twilio se procese
+        """
+        self._seen.pop(message_sid)
+
+    def stats(self) -> dict:
+        total = self.cache_hits + self.store_hits + self.misses
+        return {
+            "cache_size": len(self._seen),
+            "cache_hits": self.cache_hits,
+            "store_hits": self.store_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.cache_hits + self.store_hits) / total, 4) if total else 0.0,
+        }
+
+
+# Deduplicador compartido por el webhook de SMS entrantes
+webhook_dedupe = WebhookDeduplicator(WEBHOOK_DEDUPE_CACHE_SIZE, WEBHOOK_DEDUPE_TTL_SECONDS)
+
+registry.register(CallbackGauge(
+    "webhook_dedupe_total",
+    "Webhooks de SMS entrantes por resultado de la deduplicación",
+    lambda: {
+        ("cache_hit",): webhook_dedupe.cache_hits,
+        ("store_hit",): webhook_dedupe.store_hits,
+        ("miss",): webhook_dedupe.misses,
+    },
+    ("result",),
+    kind="counter",
+))
@@ -0,0 +1,75 @@
+from services.metrics import registry, CallbackGauge
+from functools import lru_cache
+import os
+import re
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de la normalización de números
+#   - E164_DEFAULT_COUNTRY_CODE: Código de país que se agrega a los números sin "+"
+#     (ej: "56" para Chile). Vacío = los números sin código de país son inválidos
+#   - E164_CACHE_SIZE: Cantidad de números normalizados que se guardan en memoria
+E164_DEFAULT_COUNTRY_CODE = os.getenv("E164_DEFAULT_COUNTRY_CODE", "").lstrip("+")
+E164_CACHE_SIZE = int(os.getenv("E164_CACHE_SIZE", "10000"))
+
+# Separadores que la gente escribe dentro de un número: espacios, guiones, puntos y paréntesis
+_SEPARATORS = re.compile(r"[\s\-.()/]")
+
+# E.164: "+" seguido de 8 a 15 dígitos, sin empezar en 0
+_E164 = re.compile(r"\+[1-9]\d{7,14}")
+
+
+@lru_cache(maxsize=E164_CACHE_SIZE)
+def normalize_e164(number: str) -> str:
+    """
+    Convierte un número de teléfono a su forma canónica E.164
+
+    Los resultados se guardan en una caché LRU: los números que más se usan
+    (clientes frecuentes, nuestros propios números) no se vuelven a procesar.
+
+    Lanza ValueError si el número no es válido.
+
+    Ej:
+        normalize_e164("+56 9 4837 2612")   # "+56948372612"
+        normalize_e164("0056 (9) 4837-2612")  # "+56948372612"
+        normalize_e164("948372612")         # "+56948372612" con E164_DEFAULT_COUNTRY_CODE=56
+    """
+    digits = _SEPARATORS.sub("", number)
+
+    if digits.startswith("00"):
+        digits = "+" + digits[2:]
+    elif not digits.startswith("+") and E164_DEFAULT_COUNTRY_CODE:
+        digits = "+" + E164_DEFAULT_COUNTRY_CODE + digits.lstrip("0")
+
+    if not _E164.fullmatch(digits):
+        raise ValueError(f"Invalid phone number: {number}")
+
+    return digits
+
+
+def e164_key(number: str) -> str:
+    """
+    Retorna la clave con la que se guarda y se busca un número
+
+    Es el número en E.164 o, si no es un número válido (códigos cortos o
+    remitentes alfanuméricos que llegan por el webhook), el mismo texto sin
+    espacios al inicio y al final.
+    """
+    try:
+        return normalize_e164(number)
+    except ValueError:
+        return number.strip()
+
+
+registry.register(CallbackGauge(
+    "e164_cache_total",
+    "Búsquedas en la caché de números normalizados por resultado",
+    lambda: {
+        ("hit",): normalize_e164.cache_info().hits,
+        ("miss",): normalize_e164.cache_info().misses,
+    },
+    ("result",),
+    kind="counter",
+))
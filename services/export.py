@@ -0,0 +1,137 @@
+from database.mongodb import iter_sms_records, iter_incoming_sms_records
+from datetime import datetime
+from typing import Optional
+import csv
+import io
+import json
+import os
+import zlib
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de la exportación
+#   - EXPORT_BATCH_SIZE: Documentos que MongoDB entrega por viaje (getMore)
+#   - EXPORT_CHUNK_ROWS: Filas que se juntan antes de enviar un bloque al cliente
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "500"))
+
+# Columnas del CSV (los mensajes enviados y recibidos comparten el mismo formato)
+EXPORT_COLUMNS = [
+    "direction",
+    "at",
+    "from_number",
+    "to_number",
+    "message_body",
+    "message_sid",
+    "status",
+    "error",
+    "segments",
+    "encoding",
+    "auto_reply_sent",
+    "auto_reply_sid",
+]
+
+
+def _isoformat(value) -> Optional[str]:
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_rows(
+    direction: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    phone_numbers: Optional[list] = None,
+):
+    """
+    Recorre los mensajes a exportar con el formato de EXPORT_COLUMNS
+
+    Parámetros:
+        direction (str): "sent", "received" o "all" (primero los enviados y
+                         luego los recibidos, cada grupo ordenado por fecha)
+    """
+    if direction in ("sent", "all"):
+        async for sms_record in iter_sms_records(since, until, phone_numbers, EXPORT_BATCH_SIZE):
+            yield {
+                "direction": "sent",
+                "at": _isoformat(sms_record.get("sent_at")),
+                "from_number": sms_record.get("from_number"),
+                "to_number": sms_record.get("to_number"),
+                "message_body": sms_record.get("message_body"),
+                "message_sid": sms_record.get("message_sid"),
+                "status": sms_record.get("status"),
+                "error": sms_record.get("error"),
+                "segments": sms_record.get("segments"),
+                "encoding": sms_record.get("encoding"),
+                "auto_reply_sent": None,
+                "auto_reply_sid": None,
+            }
+
+    if direction in ("received", "all"):
+        async for sms_record in iter_incoming_sms_records(since, until, phone_numbers, EXPORT_BATCH_SIZE):
+            yield {
+                "direction": "received",
+                "at": sms_record.get("received_at"),
+                "from_number": sms_record.get("from_number"),
+                "to_number": sms_record.get("to_number"),
+                "message_body": sms_record.get("message_body"),
+                "message_sid": sms_record.get("message_sid"),
+                "status": None,
+                "error": None,
+                "segments": None,
+                "encoding": None,
+                "auto_reply_sent": sms_record.get("auto_reply_sent"),
+                "auto_reply_sid": sms_record.get("auto_reply_sid"),
+            }
+
+
+async def ndjson_chunks(rows):
+    """
+    Convierte las filas en bloques de texto NDJSON (un objeto JSON por línea)
+    """
+    lines = []
+    async for row in rows:
+        lines.append(json.dumps(row, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK_ROWS:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+async def csv_chunks(rows):
+    """
+    Convierte las filas en bloques de CSV con encabezado
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    count = 0
+    async for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count >= EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def gzip_chunks(chunks):
+    """
+    Comprime los bloques en formato gzip a medida que se generan
+
+    wbits=31 hace que zlib escriba el encabezado y el pie de gzip, así el
+    resultado se puede abrir con gunzip o cualquier descompresor.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
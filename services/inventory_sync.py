@@ -0,0 +1,86 @@
+from database.mongodb import sync_owned_numbers
+from services.twilio_client import twilio_call
+import asyncio
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Cada cuántos segundos se compara la copia local de números con Twilio
+PHONE_NUMBER_SYNC_INTERVAL = float(os.getenv("PHONE_NUMBER_SYNC_INTERVAL", "300"))
+
+
+def phone_number_to_dict(number) -> dict:
+    """
+    Convierte un IncomingPhoneNumberInstance de Twilio al formato de la copia local
+    """
+    return {
+        "phone_number": number.phone_number,
+        "friendly_name": number.friendly_name,
+        "sid": number.sid,
+        "capabilities": {
+            "voice": number.capabilities.get("voice", False),
+            "sms": number.capabilities.get("sms", False),
+            "mms": number.capabilities.get("mms", False),
+        },
+        "status": number.status,
+        "date_created": str(number.date_created),
+    }
+
+
+async def fetch_owned_numbers(client) -> list:
+    """
+    Lee de Twilio todos los números de la cuenta
+    """
+    phone_numbers = await twilio_call(
+        "incoming_phone_numbers.list",
+        lambda: client.incoming_phone_numbers.list_async(),
+        idempotent=True,
+    )
+    return [phone_number_to_dict(number) for number in phone_numbers]
+
+
+async def refresh_inventory(client) -> list:
+    """
+    Lee los números de Twilio y actualiza la copia local
+
+    Retorna:
+        list: Los números leídos de Twilio
+    """
+    phone_numbers = await fetch_owned_numbers(client)
+    await sync_owned_numbers(phone_numbers)
+    return phone_numbers
+
+
+class InventorySync:
+    """
+    Tarea de fondo que reconcilia la copia local con Twilio cada
+    PHONE_NUMBER_SYNC_INTERVAL segundos (la primera vez, al iniciar)
+    """
+
+    def __init__(self, interval: float = PHONE_NUMBER_SYNC_INTERVAL):
+        self.interval = interval
+        self._task = None
+
+    def start(self, client):
+        self._task = asyncio.create_task(self._run(client))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, client):
+        while True:
+            try:
+                await refresh_inventory(client)
+            except Exception:
+                # Se vuelve a intentar en la próxima vuelta
+                pass
+            await asyncio.sleep(self.interval)
+
+
+# Sincronización compartida por toda la aplicación
+inventory_sync = InventorySync()
@@ -0,0 +1,173 @@
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de los logs
+#   - LOG_LEVEL: Nivel mínimo que se registra (DEBUG, INFO, WARNING, ERROR)
+#   - LOG_SAMPLE_RATE: Fracción (0 a 1) de los eventos de alto volumen que se registran
+#   - LOG_MASK_PII: "true" para ocultar números de teléfono y contenido de los mensajes
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))
+LOG_MASK_PII = os.getenv("LOG_MASK_PII", "true").lower() == "true"
+
+# Todos los loggers de la aplicación cuelgan de este nombre (ej: "sms_api.webhook")
+LOGGER_NAME = "sms_api"
+
+# Campos que se enmascaran en los logs
+PHONE_FIELDS = {"from_number", "to_number", "phone_number"}
+TEXT_FIELDS = {"message_body", "reply_body"}
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Retorna un logger de la aplicación
+
+    Los datos del evento se pasan en extra={"fields": {...}} y, para los
+    eventos de alto volumen, extra={"sampled": True}.
+
+    Ejemplo:
+        logger = get_logger("webhook")
+        logger.info("sms_received", extra={"fields": {"from_number": "+56948372612"}, "sampled": True})
+    """
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def mask_phone(value) -> str:
+    """
+    Deja visibles solo el prefijo y los últimos 3 dígitos: +56948372612 -> +56******612
+    """
+    value = str(value)
+    if len(value) <= 6:
+        return "*" * len(value)
+    return value[:3] + "*" * (len(value) - 6) + value[-3:]
+
+
+def mask_text(value) -> str:
+    """
+    Reemplaza el contenido de un mensaje por su largo
+    """
+    return f"<{len(str(value))} chars>"
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Formatea cada registro como una línea JSON
+
+    Ejemplo:
+        {"ts": "2025-11-01T12:00:00.000000+00:00", "level": "INFO",
+         "logger": "sms_api.webhook", "event": "sms_received",
+         "from_number": "+56******612", "message_body": "<12 chars>"}
+    """
+
+    def __init__(self, mask_pii: bool = LOG_MASK_PII):
+        super().__init__()
+        self.mask_pii = mask_pii
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+
+        for key, value in getattr(record, "fields", {}).items():
+            if self.mask_pii and value is not None:
+                if key in PHONE_FIELDS:
+                    value = mask_phone(value)
+                elif key in TEXT_FIELDS:
+                    value = mask_text(value)
+            entry[key] = value
+
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Descarta al azar los eventos marcados con sampled=True según LOG_SAMPLE_RATE
+    (los WARNING y ERROR nunca se descartan)
+    """
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return random.random() < self.rate
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler que deja el formateo a la hebra del QueueListener
+
+    El QueueHandler estándar formatea el registro antes de encolarlo (y pierde
+    los campos extra). Aquí solo se resuelven el mensaje y el traceback, que
+    dependen del estado actual, y el JSON se arma en segundo plano.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_listener = None
+
+
+def start_logging():
+    """
+    Configura los loggers de la aplicación e inicia la hebra que escribe los logs
+
+    Las llamadas a logger.info() etc. solo encolan el registro; el
+    QueueListener lo formatea y lo escribe en stdout sin bloquear el event loop.
+    """
+    global _listener
+
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JSONFormatter())
+
+    queue_handler = DeferredQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(LOG_LEVEL)
+    logger.handlers = [queue_handler]
+    logger.propagate = False
+
+    _listener = QueueListener(log_queue, stream_handler)
+    _listener.start()
+
+
+def stop_logging():
+    """
+    Escribe los logs pendientes y detiene la hebra de escritura
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
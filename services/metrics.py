@@ -0,0 +1,263 @@
+from bisect import bisect_left
+from functools import wraps
+import time
+
+
+# Límites (en segundos) de los buckets de los histogramas de latencia
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 15.0,
+)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names, label_values, extra=None) -> str:
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    """
+    Contador que solo aumenta (ej: errores por código)
+
+    Ejemplo:
+        errors = Counter("twilio_errors_total", "Errores de Twilio", ("code",))
+        errors.inc(("20429",))
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.values = {}
+
+    def inc(self, labels=(), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _format_labels(self.label_names, labels), value
+
+
+class Gauge(Counter):
+    """
+    Valor que sube y baja (ej: peticiones en curso)
+    """
+
+    kind = "gauge"
+
+    def dec(self, labels=(), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+    def set(self, value: float, labels=()):
+        self.values[labels] = value
+
+
+class CallbackGauge:
+    """
+    Gauge cuyo valor se calcula al exportar las métricas (ej: profundidad de una cola)
+
+    `callback` retorna un número, o un dict {labels: número}.
+    Con kind="counter" sirve para exportar contadores que ya lleva otra clase.
+    """
+
+    def __init__(self, name: str, help: str, callback, label_names=(), kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.callback = callback
+        self.label_names = label_names
+        self.kind = kind
+
+    def samples(self):
+        value = self.callback()
+        values = value if isinstance(value, dict) else {(): value}
+        for labels, sample in values.items():
+            yield self.name, _format_labels(self.label_names, labels), sample
+
+
+class Histogram:
+    """
+    Histograma de latencias con buckets fijos
+
+    observe() solo hace una búsqueda binaria y dos sumas, así que cuesta
+    menos de un microsegundo. Los conteos se guardan por bucket y se
+    acumulan recién al exportar.
+
+    Ejemplo:
+        latency = Histogram("mongo_operation_duration_seconds", "Latencia", ("operation",))
+        latency.observe(0.003, ("insert_sms_record",))
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        self.series = {}
+
+    def observe(self, value: float, labels=()):
+        series = self.series.get(labels)
+        if series is None:
+            # [conteos por bucket (+Inf al final), suma, total]
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.label_names, labels, ("le", bound)),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", _format_labels(self.label_names, labels), total
+            yield f"{self.name}_count", _format_labels(self.label_names, labels), count
+
+
+class Registry:
+    """
+    Conjunto de métricas que se exportan en /metrics
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Exporta todas las métricas en el formato de texto de Prometheus
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# MÉTRICAS DE LA APLICACIÓN
+
+twilio_latency = registry.register(Histogram(
+    "twilio_request_duration_seconds",
+    "Latencia de las llamadas a la API de Twilio",
+    ("endpoint",),
+))
+twilio_in_flight = registry.register(Gauge(
+    "twilio_requests_in_flight",
+    "Llamadas a la API de Twilio en curso",
+    ("endpoint",),
+))
+twilio_errors = registry.register(Counter(
+    "twilio_errors_total",
+    "Errores de la API de Twilio por código de error",
+    ("endpoint", "code"),
+))
+twilio_retries = registry.register(Counter(
+    "twilio_retries_total",
+    "Reintentos de llamadas a la API de Twilio",
+    ("endpoint",),
+))
+
+mongo_latency = registry.register(Histogram(
+    "mongo_operation_duration_seconds",
+    "Latencia de las operaciones de MongoDB",
+    ("operation",),
+))
+mongo_in_flight = registry.register(Gauge(
+    "mongo_operations_in_flight",
+    "Operaciones de MongoDB en curso",
+    ("operation",),
+))
+mongo_errors = registry.register(Counter(
+    "mongo_errors_total",
+    "Operaciones de MongoDB que lanzaron una excepción",
+    ("operation",),
+))
+
+serialization_latency = registry.register(Histogram(
+    "serialization_duration_seconds",
+    "Tiempo de serialización de las respuestas",
+    ("stage",),
+))
+
+webhook_latency = registry.register(Histogram(
+    "webhook_duration_seconds",
+    "Tiempo total de procesamiento de los webhooks de Twilio",
+    ("webhook",),
+))
+webhook_in_flight = registry.register(Gauge(
+    "webhook_requests_in_flight",
+    "Webhooks de Twilio en procesamiento",
+    ("webhook",),
+))
+webhook_errors = registry.register(Counter(
+    "webhook_errors_total",
+    "Webhooks de Twilio que lanzaron una excepción",
+    ("webhook",),
+))
+
+
+def timed(histogram: Histogram, in_flight: Gauge, errors: Counter, label: str):
+    """
+    Decorador que mide la latencia, las llamadas en curso y los errores de una
+    función asíncrona
+
+    Ejemplo:
+        @timed(mongo_latency, mongo_in_flight, mongo_errors, "insert_sms_record")
+        async def insert_sms_record(sms_record): ...
+    """
+    labels = (label,)
+
+    def decorator(function):
+        @wraps(function)
+        async def wrapper(*args, **kwargs):
+            in_flight.inc(labels)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                errors.inc(labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - started, labels)
+                in_flight.dec(labels)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_mongo(operation: str):
+    """
+    Atajo de timed() para las funciones de acceso a MongoDB
+    """
+    return timed(mongo_latency, mongo_in_flight, mongo_errors, operation)
+
+
+def timed_webhook(webhook: str):
+    """
+    Atajo de timed() para las rutas que reciben webhooks de Twilio
+    """
+    return timed(webhook_latency, webhook_in_flight, webhook_errors, webhook)
@@ -0,0 +1,163 @@
+from database.mongodb import set_opt_out, find_opt_out_changes
+from services.e164 import e164_key
+from services.metrics import registry, Counter, CallbackGauge
+from services.logging_setup import get_logger
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de la lista de supresión
+#   - OPT_OUT_SYNC_SECONDS: Cada cuánto se leen los STOP/START registrados por otros procesos
+#   - OPT_OUT_SYNC_OVERLAP_SECONDS: Margen hacia atrás de cada lectura (cubre relojes
+#     desfasados entre servidores; releer un cambio no tiene efecto)
+OPT_OUT_SYNC_SECONDS = float(os.getenv("OPT_OUT_SYNC_SECONDS", "5"))
+OPT_OUT_SYNC_OVERLAP_SECONDS = float(os.getenv("OPT_OUT_SYNC_OVERLAP_SECONDS", "30"))
+
+# Palabras que Twilio reconoce para darse de baja y volver a suscribirse
+# (el mensaje completo debe ser la palabra, sin importar mayúsculas)
+OPT_OUT_KEYWORDS = frozenset({"STOP", "STOPALL", "UNSUBSCRIBE", "CANCEL", "END", "QUIT"})
+OPT_IN_KEYWORDS = frozenset({"START", "YES", "UNSTOP"})
+
+# Código de error de Twilio cuando el destinatario respondió STOP
+TWILIO_OPT_OUT_ERROR = 21610
+
+logger = get_logger("opt_out")
+
+opt_out_suppressed = registry.register(Counter(
+    "opt_out_suppressed_total",
+    "Envíos rechazados porque el destinatario está en la lista de supresión",
+))
+
+
+def opt_out_keyword(body: str) -> Optional[bool]:
+    """
+    Indica si un SMS recibido es una palabra de baja o de alta
+
+    Retorna:
+        True (STOP), False (START) o None si es un mensaje normal
+    """
+    keyword = body.strip().upper()
+    if keyword in OPT_OUT_KEYWORDS:
+        return True
+    if keyword in OPT_IN_KEYWORDS:
+        return False
+    return None
+
+
+class OptOutList:
+    """
+    Copia en memoria de los números que respondieron STOP
+
+    Twilio rechaza los envíos a esos números con el error 21610, pero recién
+    después de la llamada por la red. Con esta copia el envío se rechaza
+    antes, con una búsqueda en un set.
+
+    Al iniciar se cargan todos los números suprimidos; luego una tarea de
+    fondo lee cada OPT_OUT_SYNC_SECONDS solo los cambios posteriores a la
+    última lectura, así los STOP recibidos por otros procesos también se
+    aplican aquí.
+    """
+
+    def __init__(self, sync_seconds: float, overlap_seconds: float):
+        self.sync_seconds = sync_seconds
+        self.overlap = timedelta(seconds=overlap_seconds)
+        self._numbers = set()
+        self._since = None
+        self._task = None
+
+    def start(self):
+        """
+        Inicia la sincronización periódica (la carga inicial se hace antes con sync())
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync()
+            except Exception:
+                # Se mantiene la copia actual hasta la próxima vuelta
+                logger.exception("opt_out_sync_failed")
+
+    async def sync(self):
+        """
+        Aplica los cambios de la lista de supresión desde la última lectura
+        """
+        since = self._since - self.overlap if self._since is not None else None
+        changes = await find_opt_out_changes(since)
+
+        for change in changes:
+            self._apply(change["phone_number"], change["opted_out"])
+
+        if self._since is None:
+            logger.info("opt_outs_loaded", extra={"fields": {"numbers": len(self._numbers)}})
+            # La carga inicial solo trae los suprimidos: las lecturas
+            # siguientes parten desde ahora (menos el margen)
+            self._since = datetime.now()
+        elif changes:
+            self._since = max(self._since, changes[-1]["updated_at"])
+
+    def _apply(self, phone_number: str, opted_out: bool):
+        if opted_out:
+            self._numbers.add(phone_number)
+        else:
+            self._numbers.discard(phone_number)
+
+    async def record(self, phone_number: str, opted_out: bool, keyword: str):
+        """
+        Registra un STOP o START: se aplica de inmediato en este proceso y se
+        guarda en MongoDB para los demás
+        """
+        phone_number = e164_key(phone_number)
+        self._apply(phone_number, opted_out)
+        await set_opt_out(phone_number, opted_out, keyword)
+        logger.info(
+            "opt_out_recorded",
+            extra={"fields": {"phone_number": phone_number, "opted_out": opted_out, "keyword": keyword}},
+        )
+
+    async def record_twilio_error(self, phone_number: str):
+        """
+        Registra como suprimido un número por el que Twilio respondió el error
+        21610 (el STOP llegó a un número cuyo webhook no es esta API)
+
+        Se llama desde las rutas de envío, así que un fallo al guardar no se propaga.
+        """
+        try:
+            await self.record(phone_number, True, str(TWILIO_OPT_OUT_ERROR))
+        except Exception as e:
+            logger.warning("opt_out_record_failed", extra={"fields": {"phone_number": phone_number, "error": str(e)}})
+
+    def is_suppressed(self, phone_number: str) -> bool:
+        """
+        Indica si no se debe enviar nada a un número (sin llamadas por la red)
+        """
+        return e164_key(phone_number) in self._numbers
+
+    def stats(self) -> dict:
+        return {
+            "numbers": len(self._numbers),
+            "synced_until": self._since.isoformat() if self._since else None,
+        }
+
+
+# Lista compartida por todas las rutas de envío
+opt_out_list = OptOutList(OPT_OUT_SYNC_SECONDS, OPT_OUT_SYNC_OVERLAP_SECONDS)
+
+registry.register(CallbackGauge(
+    "opt_out_numbers",
+    "Números en la lista de supresión",
+    lambda: opt_out_list.stats()["numbers"],
+))
@@ -0,0 +1,206 @@
+from services.e164 import normalize_e164
+from services.opt_out import opt_out_list
+from typing import NamedTuple, Optional
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de la validación previa al envío
+#   - SMS_MAX_SEGMENTS: Máximo de segmentos por mensaje (Twilio acepta hasta 1600 caracteres)
+#   - SMS_TRUNCATE: "true" para recortar los mensajes largos en vez de rechazarlos
+SMS_MAX_SEGMENTS = int(os.getenv("SMS_MAX_SEGMENTS", "10"))
+SMS_TRUNCATE = os.getenv("SMS_TRUNCATE", "false").lower() == "true"
+
+# Error de los mensajes a destinatarios que respondieron STOP
+OPT_OUT_ERROR = "Recipient has opted out (STOP)"
+
+# Largo máximo del cuerpo que acepta la API de Twilio
+TWILIO_MAX_BODY_LENGTH = 1600
+
+# Alfabeto GSM-7 (GSM 03.38): cada carácter ocupa 7 bits
+GSM7_BASIC = frozenset(
+    "@£$¥èéùìòÇ\nØø\rÅåΔ_ΦΓΛΩΠΨΣΘΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    "¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§¿abcdefghijklmnopqrstuvwxyzäöñüà"
+)
+
+# Tabla de extensión: estos caracteres ocupan 2 posiciones (escape + carácter)
+GSM7_EXTENDED = frozenset("^{}\\[~]|€\f")
+GSM7_CHARSET = GSM7_BASIC | GSM7_EXTENDED
+
+# Capacidad de un SMS: (mensaje de un segmento, cada segmento de un mensaje concatenado)
+# Los mensajes largos pierden espacio en el encabezado que une los segmentos
+SEGMENT_CAPACITY = {
+    "GSM-7": (160, 153),
+    "UCS-2": (70, 67),
+}
+
+
+class SegmentInfo(NamedTuple):
+    encoding: str
+    units: int
+    segments: int
+
+
+class PreflightResult(NamedTuple):
+    ok: bool
+    body: str
+    encoding: str
+    segments: int
+    error: Optional[str] = None
+    to_number: Optional[str] = None
+
+
+def analyze_body(body: str) -> SegmentInfo:
+    """
+    Detecta la codificación de un mensaje y calcula cuántos segmentos cobra Twilio
+
+    - GSM-7 si todos los caracteres están en el alfabeto GSM (los de la tabla
+      de extensión cuentan doble)
+    - UCS-2 en otro caso (cada carácter fuera del plano básico, como los
+      emojis, cuenta doble)
+
+    Ej:
+        analyze_body("Hola")   # SegmentInfo(encoding="GSM-7", units=4, segments=1)
+        analyze_body("Hola 👋")  # SegmentInfo(encoding="UCS-2", units=7, segments=1)
+    """
+    # set(body) se calcula en C: las comparaciones siguientes recorren solo
+    # los caracteres distintos, no todo el mensaje
+    characters = set(body)
+
+    if characters <= GSM7_CHARSET:
+        encoding = "GSM-7"
+        units = len(body) + sum(body.count(character) for character in characters & GSM7_EXTENDED)
+    else:
+        encoding = "UCS-2"
+        units = len(body)
+        if not body.isascii():
+            units += sum(1 for character in body if ord(character) > 0xFFFF)
+
+    single, multi = SEGMENT_CAPACITY[encoding]
+    if units == 0:
+        segments = 0
+    elif units <= single:
+        segments = 1
+    else:
+        segments = -(-units // multi)
+
+    return SegmentInfo(encoding, units, segments)
+
+
+def _unit_size(character: str, encoding: str) -> int:
+    if encoding == "GSM-7":
+        return 2 if character in GSM7_EXTENDED else 1
+    return 2 if ord(character) > 0xFFFF else 1
+
+
+def truncate_body(body: str, encoding: str, max_segments: int) -> str:
+    """
+    Recorta un mensaje para que quepa en max_segments segmentos
+    """
+    single, multi = SEGMENT_CAPACITY[encoding]
+    capacity = single if max_segments == 1 else multi * max_segments
+
+    units = 0
+    for index, character in enumerate(body):
+        units += _unit_size(character, encoding)
+        if units > capacity:
+            return body[:index]
+    return body
+
+
+def analyze_bodies(bodies: list) -> dict:
+    """
+    Analiza de una vez los cuerpos de un lote
+
+    Cada cuerpo distinto se analiza una sola vez (en un lote masivo suele
+    repetirse el mismo texto para todos los destinatarios). Los caracteres
+    de todo el lote se reúnen en un solo set: si están todos en el alfabeto
+    GSM-7 básico, cada mensaje ocupa len(body) unidades y no hace falta
+    revisarlos uno por uno.
+
+    Retorna:
+        dict: {cuerpo: SegmentInfo}
+    """
+    unique = set(bodies)
+    if not set("".join(unique)) <= GSM7_BASIC:
+        return {body: analyze_body(body) for body in unique}
+
+    single, multi = SEGMENT_CAPACITY["GSM-7"]
+    infos = {}
+    for body in unique:
+        units = len(body)
+        if units == 0:
+            segments = 0
+        elif units <= single:
+            segments = 1
+        else:
+            segments = -(-units // multi)
+        infos[body] = SegmentInfo("GSM-7", units, segments)
+    return infos
+
+
+def _check(to_number: str, body: str, info: SegmentInfo, max_segments: int,
+           truncate: bool) -> PreflightResult:
+    """
+    Valida un mensaje con el análisis de su cuerpo ya hecho
+    """
+    try:
+        to_number = normalize_e164(to_number)
+    except ValueError as e:
+        return PreflightResult(False, body, "", 0, str(e))
+
+    if opt_out_list.is_suppressed(to_number):
+        return PreflightResult(False, body, "", 0, OPT_OUT_ERROR)
+
+    if info.segments == 0:
+        return PreflightResult(False, body, info.encoding, 0, "Message body is empty")
+
+    too_many_segments = info.segments > max_segments
+    too_long = len(body) > TWILIO_MAX_BODY_LENGTH
+    if too_many_segments or too_long:
+        if not truncate:
+            if too_many_segments:
+                error = f"Message body needs {info.segments} segments (max {max_segments})"
+            else:
+                error = f"Message body has {len(body)} characters (max {TWILIO_MAX_BODY_LENGTH})"
+            return PreflightResult(False, body, info.encoding, info.segments, error)
+        body = truncate_body(body[:TWILIO_MAX_BODY_LENGTH], info.encoding, max_segments)
+        info = analyze_body(body)
+
+    return PreflightResult(True, body, info.encoding, info.segments, to_number=to_number)
+
+
+def preflight(to_number: str, body: str, max_segments: int = SMS_MAX_SEGMENTS,
+              truncate: bool = SMS_TRUNCATE) -> PreflightResult:
+    """
+    Valida un mensaje antes de enviarlo a Twilio
+
+    Rechaza (o recorta, con truncate=True) los mensajes vacíos, los que
+    superan max_segments y los que superan el largo máximo de Twilio, sin
+    hacer ninguna llamada por la red. También rechaza los destinatarios que
+    respondieron STOP (ver services/opt_out.py) y los números inválidos; en
+    un lote, el error queda solo en el mensaje de ese destinatario.
+
+    Retorna:
+        PreflightResult: ok=False con el error si el mensaje no se puede enviar,
+                         o ok=True con to_number normalizado a E.164
+    """
+    return _check(to_number, body, analyze_body(body), max_segments, truncate)
+
+
+def preflight_batch(messages: list, max_segments: int = SMS_MAX_SEGMENTS,
+                    truncate: bool = SMS_TRUNCATE) -> list:
+    """
+    Igual que preflight() para un lote, analizando los cuerpos una sola vez
+    (ver analyze_bodies())
+
+    Parámetros:
+        messages (list): [(to_number, body)]
+
+    Retorna:
+        list: Un PreflightResult por mensaje, en el mismo orden
+    """
+    infos = analyze_bodies([body for _, body in messages])
+    return [_check(to_number, body, infos[body], max_segments, truncate) for to_number, body in messages]
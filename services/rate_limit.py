@@ -0,0 +1,54 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Limitador de tasa "token bucket"
+
+    El balde se llena con `rate` fichas por segundo hasta un máximo de `burst`.
+    Cada envío consume una ficha; si no quedan, acquire() espera lo justo
+    hasta que se genere la siguiente.
+
+    Ejemplo:
+        bucket = TokenBucket(rate=1, burst=1)  # 1 mensaje por segundo
+        await bucket.acquire()
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        # El lock hace que los workers que comparten un balde esperen en orden
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class RateLimiter:
+    """
+    Un TokenBucket por clave (por ejemplo, por número remitente)
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+
+    async def acquire(self, key: str):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        await bucket.acquire()
@@ -0,0 +1,196 @@
+from database.mongodb import find_scheduled_sms, promote_scheduled_sms
+from services.sms_queue import sms_queue
+from services.metrics import registry, CallbackGauge
+from services.logging_setup import get_logger
+from datetime import datetime, timedelta
+import asyncio
+import heapq
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de los mensajes programados
+#   - SMS_SCHEDULER: "true" para que este proceso pase a la cola los mensajes
+#     programados cuando llega su hora. Basta con activarlo en un proceso;
+#     también inicia los workers de la cola en ese proceso
+#   - SMS_SCHEDULING_ENABLED: "true" si algún proceso del despliegue tiene
+#     SMS_SCHEDULER=true. Si no, la API rechaza los mensajes con scheduled_at
+#     (nadie los enviaría). Por defecto toma el valor de SMS_SCHEDULER
+#   - SMS_SCHEDULER_WINDOW_SECONDS: Cuánto hacia adelante se cargan en memoria los vencimientos
+#   - SMS_SCHEDULER_WINDOW_LIMIT: Máximo de mensajes de la ventana que se tienen en memoria
+#   - SMS_SCHEDULER_BATCH_SIZE: Máximo de mensajes que se pasan a la cola por operación
+SMS_SCHEDULER = os.getenv("SMS_SCHEDULER", "false").lower() == "true"
+SMS_SCHEDULING_ENABLED = os.getenv("SMS_SCHEDULING_ENABLED", str(SMS_SCHEDULER)).lower() == "true"
+SMS_SCHEDULER_WINDOW_SECONDS = float(os.getenv("SMS_SCHEDULER_WINDOW_SECONDS", "60"))
+SMS_SCHEDULER_WINDOW_LIMIT = int(os.getenv("SMS_SCHEDULER_WINDOW_LIMIT", "10000"))
+SMS_SCHEDULER_BATCH_SIZE = int(os.getenv("SMS_SCHEDULER_BATCH_SIZE", "500"))
+
+logger = get_logger("scheduler")
+
+
+class Scheduler:
+    """
+    Pasa a la cola de envío los SMS programados cuando llega su hora
+
+    Los mensajes programados pueden ser millones, así que en memoria solo se
+    tiene la ventana próxima: los que vencen en los siguientes `window`
+    segundos (como máximo `limit`), en un heap ordenado por hora. La tarea
+    de fondo duerme hasta el próximo vencimiento, toma del heap todos los
+    mensajes vencidos y los pasa a "queued" en lotes de `batch_size` con un
+    solo update_many (promote_scheduled_sms()). Luego despierta a los
+    workers de la cola, que los envían con el mismo límite de tasa y
+    reintentos que los demás mensajes.
+
+    La ventana se vuelve a leer de MongoDB cuando se consume la mitad; esa
+    consulta usa el índice status_next_attempt_at y solo recorre la ventana.
+    Si varios procesos tienen el mismo mensaje en su heap, la condición
+    status="scheduled" del update_many hace que solo uno lo pase a la cola.
+    """
+
+    def __init__(self, window: float, limit: int, batch_size: int):
+        self.window = timedelta(seconds=window)
+        self.limit = limit
+        self.batch_size = batch_size
+        self._heap = []
+        self._ids = set()
+        self._loaded_until = None
+        self._truncated = False
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self.promoted = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def add(self, record_id, due_at: datetime):
+        """
+        Agrega al heap un mensaje recién programado si cae dentro de la ventana cargada
+
+        Los que caen más adelante se leen de MongoDB cuando la ventana los alcance.
+        """
+        if self._loaded_until is None or due_at >= self._loaded_until:
+            return
+        self._push(record_id, due_at)
+        self._wakeup.set()
+
+    def _push(self, record_id, due_at: datetime):
+        if record_id not in self._ids:
+            self._ids.add(record_id)
+            heapq.heappush(self._heap, (due_at, record_id))
+
+    async def _run(self):
+        while True:
+            try:
+                now = datetime.now()
+                if self._needs_load(now):
+                    await self._load(now)
+                await self._promote_due(now)
+            except Exception:
+                logger.exception("scheduler_failed")
+                # Se reintenta en la próxima vuelta sin ocupar la CPU
+                self._loaded_until = None
+                await asyncio.sleep(1)
+                continue
+            await self._sleep()
+
+    def _needs_load(self, now: datetime) -> bool:
+        if self._loaded_until is None:
+            return True
+        if self._truncated:
+            # Ventana recortada por `limit`: se lee de nuevo al consumir la mitad del heap
+            return len(self._heap) <= self.limit // 2
+        return now >= self._loaded_until - self.window / 2
+
+    async def _load(self, now: datetime):
+        """
+        Lee de MongoDB los mensajes que vencen dentro de la ventana
+        """
+        until = now + self.window
+        documents = await find_scheduled_sms(until, self.limit)
+        for document in documents:
+            self._push(document["_id"], document["next_attempt_at"])
+
+        # Si la ventana tenía más de `limit` mensajes, el heap solo está
+        # completo hasta el último que se leyó
+        self._truncated = len(documents) >= self.limit
+        if self._truncated:
+            until = documents[-1]["next_attempt_at"]
+        self._loaded_until = until
+
+    async def _promote_due(self, now: datetime):
+        """
+        Pasa a la cola todos los mensajes del heap cuya hora ya llegó
+        """
+        while self._heap and self._heap[0][0] <= now:
+            batch = []
+            while self._heap and self._heap[0][0] <= now and len(batch) < self.batch_size:
+                _, record_id = heapq.heappop(self._heap)
+                self._ids.discard(record_id)
+                batch.append(record_id)
+
+            promoted = await promote_scheduled_sms(batch)
+            if promoted:
+                self.promoted += promoted
+                sms_queue.notify()
+                logger.info("scheduled_sms_promoted", extra={"fields": {"count": promoted}})
+
+    def _next_wakeup(self) -> datetime:
+        # Lo que ocurra primero: el próximo vencimiento o la próxima lectura de la ventana
+        if self._truncated and self._heap:
+            return self._heap[0][0]
+        reload_at = self._loaded_until - self.window / 2
+        if self._heap:
+            return min(self._heap[0][0], reload_at)
+        return reload_at
+
+    async def _sleep(self):
+        timeout = max(0.0, (self._next_wakeup() - datetime.now()).total_seconds())
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_window": len(self._heap),
+            "loaded_until": self._loaded_until.isoformat() if self._loaded_until else None,
+            "next_due_at": self._heap[0][0].isoformat() if self._heap else None,
+            "promoted": self.promoted,
+        }
+
+
+# Error de los mensajes programados cuando ningún proceso los pasaría a la cola
+SCHEDULING_DISABLED_ERROR = (
+    "Scheduled sending is disabled: set SMS_SCHEDULER=true on one process "
+    "and SMS_SCHEDULING_ENABLED=true on every process"
+)
+
+# Planificador compartido (solo se inicia si SMS_SCHEDULER=true)
+scheduler = Scheduler(SMS_SCHEDULER_WINDOW_SECONDS, SMS_SCHEDULER_WINDOW_LIMIT, SMS_SCHEDULER_BATCH_SIZE)
+
+registry.register(CallbackGauge(
+    "scheduler_in_window",
+    "Mensajes programados cargados en memoria (ventana próxima)",
+    lambda: scheduler.stats()["in_window"],
+))
+
+registry.register(CallbackGauge(
+    "scheduler_promoted_total",
+    "Mensajes programados que pasaron a la cola de envío",
+    lambda: scheduler.promoted,
+    kind="counter",
+))
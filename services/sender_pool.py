@@ -0,0 +1,157 @@
+from database.mongodb import find_owned_numbers
+from services.cache import TTLCache
+from services.metrics import registry, CallbackGauge
+from collections import deque
+from typing import Optional
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración del pool de números remitentes
+#   - SMS_SENDER_POOL: "true" para repartir los envíos entre todos los números con SMS
+#     de la cuenta (si es "false", todos salen desde TWILIO_PHONE_NUMBER)
+#   - SMS_SENDER_WINDOW_SECONDS: Ventana en la que se cuenta la carga de cada número
+#   - SMS_SENDER_STICKY: "true" para que cada destinatario reciba siempre desde el mismo número
+#   - SMS_SENDER_STICKY_TTL / SMS_SENDER_STICKY_SIZE: Cuánto tiempo y cuántos destinatarios
+#     se recuerda la asignación
+#   - SMS_SENDER_POOL_REFRESH_SECONDS: Cada cuánto se vuelve a leer la lista de números
+SMS_SENDER_POOL = os.getenv("SMS_SENDER_POOL", "false").lower() == "true"
+SMS_SENDER_WINDOW_SECONDS = float(os.getenv("SMS_SENDER_WINDOW_SECONDS", "60"))
+SMS_SENDER_STICKY = os.getenv("SMS_SENDER_STICKY", "true").lower() == "true"
+SMS_SENDER_STICKY_TTL = float(os.getenv("SMS_SENDER_STICKY_TTL", str(7 * 24 * 3600)))
+SMS_SENDER_STICKY_SIZE = int(os.getenv("SMS_SENDER_STICKY_SIZE", "100000"))
+SMS_SENDER_POOL_REFRESH_SECONDS = float(os.getenv("SMS_SENDER_POOL_REFRESH_SECONDS", "30"))
+
+
+class SenderPool:
+    """
+    Elige el número remitente de cada SMS entre los números de la cuenta
+
+    Twilio limita la tasa de envío por número, así que repartir los mensajes
+    entre N números multiplica el throughput por N. Cada envío sale del número
+    con menos mensajes en los últimos `window` segundos.
+
+    Con sticky=True, un destinatario sigue recibiendo desde el número que se
+    le asignó la primera vez (o desde el número al que nos escribió), para
+    que la conversación no cambie de remitente.
+
+    Los números se leen de la copia local del inventario (phone_numbers),
+    solo los que tienen capacidad SMS.
+    """
+
+    def __init__(self, window: float, sticky: bool, sticky_ttl: float, sticky_size: int,
+                 refresh_seconds: float):
+        self.window = window
+        self.sticky = sticky
+        self.refresh_seconds = refresh_seconds
+        self.senders = []
+        self._sent = {}
+        self._assignments = TTLCache(maxsize=sticky_size, ttl=sticky_ttl)
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                # Se mantiene la lista anterior hasta la próxima vuelta
+                pass
+            await asyncio.sleep(self.refresh_seconds)
+
+    async def refresh(self):
+        """
+        Vuelve a leer los números con SMS de la copia local del inventario
+
+        Si la cuenta todavía no tiene números sincronizados, se usa TWILIO_PHONE_NUMBER.
+        """
+        numbers = [number["phone_number"] for number in await find_owned_numbers("sms")]
+        if not numbers and os.getenv("TWILIO_PHONE_NUMBER"):
+            numbers = [os.getenv("TWILIO_PHONE_NUMBER")]
+
+        # Se conserva la carga de los números que siguen en la cuenta
+        self._sent = {sender: self._sent.get(sender) or deque() for sender in numbers}
+        self.senders = numbers
+
+    def load(self, sender: str, now: Optional[float] = None) -> int:
+        """
+        Cantidad de mensajes enviados desde un número en la ventana actual
+        """
+        sent = self._sent.get(sender)
+        if not sent:
+            return 0
+
+        # Se descartan los envíos que ya salieron de la ventana
+        cutoff = (now if now is not None else time.monotonic()) - self.window
+        while sent and sent[0] < cutoff:
+            sent.popleft()
+        return len(sent)
+
+    def pick(self, to_number: str) -> Optional[str]:
+        """
+        Retorna el número desde el cual enviar un SMS y le suma el envío a su carga
+
+        Retorna None si no hay ningún número disponible.
+        """
+        senders = self.senders
+        if not senders:
+            return None
+
+        sender = self._assignments.get(to_number) if self.sticky else None
+        if sender is None or sender not in self._sent:
+            now = time.monotonic()
+            sender = min(senders, key=lambda candidate: self.load(candidate, now))
+            if self.sticky:
+                self._assignments.set(to_number, sender)
+
+        self._sent[sender].append(time.monotonic())
+        return sender
+
+    def assign(self, to_number: str, sender: str):
+        """
+        Fija el remitente de un destinatario (ej: el número al que nos escribió)
+        """
+        if self.sticky and sender in self._sent:
+            self._assignments.set(to_number, sender)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "enabled": self.enabled,
+            "senders": len(self.senders),
+            "window_seconds": self.window,
+            "load": {sender: self.load(sender, now) for sender in self.senders},
+        }
+
+
+# Pool compartido (solo se inicia si SMS_SENDER_POOL=true)
+sender_pool = SenderPool(
+    SMS_SENDER_WINDOW_SECONDS,
+    SMS_SENDER_STICKY,
+    SMS_SENDER_STICKY_TTL,
+    SMS_SENDER_STICKY_SIZE,
+    SMS_SENDER_POOL_REFRESH_SECONDS,
+)
+
+registry.register(CallbackGauge(
+    "sender_pool_load",
+    "Mensajes enviados por cada número remitente en la ventana actual",
+    lambda: {(sender,): load for sender, load in sender_pool.stats()["load"].items()},
+    ("sender",),
+))
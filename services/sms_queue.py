@@ -0,0 +1,213 @@
+from twilio.base.exceptions import TwilioRestException
+from database.mongodb import (
+    claim_queued_sms,
+    renew_queued_sms,
+    release_stale_sms,
+    complete_queued_sms,
+    retry_queued_sms,
+    fail_queued_sms,
+)
+from services.rate_limit import RateLimiter
+from services.twilio_client import (
+    twilio_call,
+    twilio_breakers,
+    TwilioUnavailable,
+    TwilioCircuitOpen,
+    TWILIO_CALL_DEADLINE,
+    _is_transient,
+)
+from services.logging_setup import get_logger
+from services.status_updates import STATUS_CALLBACK
+from services.sender_pool import sender_pool
+from services.opt_out import opt_out_list, opt_out_suppressed, TWILIO_OPT_OUT_ERROR
+from services.preflight import OPT_OUT_ERROR
+from datetime import datetime, timedelta
+import asyncio
+import os
+import random
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de la cola de envío
+#   - SMS_SEND_MODE: "direct" (envía dentro de /sms/send) o "queue" (encola y responde de inmediato)
+#   - SMS_QUEUE_WORKERS: Cantidad de workers que envían mensajes en paralelo
+#   - SMS_RATE_PER_SECOND / SMS_RATE_BURST: Mensajes por segundo permitidos por cada número remitente
+#   - SMS_MAX_ATTEMPTS: Intentos antes de marcar el mensaje como "error"
+#   - SMS_RETRY_BASE_SECONDS / SMS_RETRY_MAX_SECONDS: Espera exponencial entre reintentos
+#   - SMS_QUEUE_POLL_SECONDS: Cada cuánto revisa la cola un worker sin trabajo
+#   - SMS_QUEUE_LOCK_SECONDS: Tiempo tras el cual un envío sin terminar vuelve a la cola
+SMS_SEND_MODE = os.getenv("SMS_SEND_MODE", "direct")
+SMS_QUEUE_WORKERS = int(os.getenv("SMS_QUEUE_WORKERS", "4"))
+SMS_RATE_PER_SECOND = float(os.getenv("SMS_RATE_PER_SECOND", "1"))
+SMS_RATE_BURST = float(os.getenv("SMS_RATE_BURST", "1"))
+SMS_MAX_ATTEMPTS = int(os.getenv("SMS_MAX_ATTEMPTS", "5"))
+SMS_RETRY_BASE_SECONDS = float(os.getenv("SMS_RETRY_BASE_SECONDS", "2"))
+SMS_RETRY_MAX_SECONDS = float(os.getenv("SMS_RETRY_MAX_SECONDS", "300"))
+SMS_QUEUE_POLL_SECONDS = float(os.getenv("SMS_QUEUE_POLL_SECONDS", "1"))
+SMS_QUEUE_LOCK_SECONDS = float(os.getenv("SMS_QUEUE_LOCK_SECONDS", "60"))
+
+# Lock que se renueva justo antes de llamar a Twilio: debe cubrir la llamada
+# completa (TWILIO_CALL_DEADLINE con todos sus reintentos) con margen
+SMS_QUEUE_SEND_LOCK_SECONDS = max(SMS_QUEUE_LOCK_SECONDS, 2 * TWILIO_CALL_DEADLINE)
+
+logger = get_logger("sms_queue")
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Indica si vale la pena reintentar un envío fallido
+
+    Se reintentan los límites de tasa de Twilio (HTTP 429 / código 20429),
+    los errores 5xx, Twilio sin responder (TwilioUnavailable) y los
+    problemas de red, con la misma clasificación que twilio_call(). Los
+    demás errores de Twilio (número inválido, etc.) y los errores del
+    programa no van a cambiar al reintentar: el mensaje falla de inmediato.
+    """
+    if isinstance(error, TwilioRestException) and error.code == 20429:
+        return True
+    return isinstance(error, TwilioUnavailable) or _is_transient(error)
+
+
+def retry_delay(attempts: int) -> float:
+    """
+    Espera exponencial con jitter: base * 2^(intentos-1), con un máximo
+    """
+    delay = min(SMS_RETRY_MAX_SECONDS, SMS_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class SMSQueue:
+    """
+    Pool de workers que vacía la cola de SMS guardada en MongoDB
+
+    Cada worker toma un mensaje con claim_queued_sms(), espera su turno en el
+    token bucket de su número remitente, renueva el lock (si mientras tanto
+    el lock venció y el mensaje volvió a la cola, lo deja), lo envía y
+    actualiza su estado en el mismo documento con su claim_token.
+    """
+
+    def __init__(self, workers: int = SMS_QUEUE_WORKERS):
+        self.workers = workers
+        self.rate_limiter = RateLimiter(SMS_RATE_PER_SECOND, SMS_RATE_BURST)
+        self._tasks = []
+        self._wakeup = asyncio.Event()
+        self._client = None
+
+    def start(self, client):
+        self._client = client
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        """
+        Despierta a los workers dormidos cuando llega un mensaje nuevo
+        """
+        self._wakeup.set()
+
+    async def _worker(self):
+        while True:
+            # Con el circuito de Twilio abierto no se toman mensajes: quedan en
+            # la cola sin gastar intentos hasta que se pueda probar de nuevo
+            if not twilio_breakers.get("messages.create").available():
+                await self._idle()
+                continue
+
+            try:
+                record = await claim_queued_sms(SMS_QUEUE_LOCK_SECONDS)
+            except Exception:
+                record = None
+
+            if record is None:
+                await self._idle()
+                continue
+
+            try:
+                await self._process(record)
+            except Exception:
+                # Si falla la actualización en MongoDB, el mensaje vuelve a la
+                # cola cuando vence locked_until
+                pass
+
+    async def _idle(self):
+        try:
+            await release_stale_sms()
+        except Exception:
+            pass
+
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), SMS_QUEUE_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _process(self, record: dict):
+        record_id, claim_token = record["_id"], record["claim_token"]
+
+        # El destinatario pudo responder STOP después de encolarse el mensaje
+        if opt_out_list.is_suppressed(record["to_number"]):
+            opt_out_suppressed.inc()
+            await fail_queued_sms(record_id, claim_token, f"Error: {OPT_OUT_ERROR}")
+            return
+
+        # Con el pool de remitentes el número se elige al enviar (el menos cargado)
+        from_number = record.get("from_number")
+        if sender_pool.enabled:
+            from_number = sender_pool.pick(record["to_number"]) or from_number
+
+        if not from_number:
+            await fail_queued_sms(record_id, claim_token, "Error: Twilio phone number not configured")
+            return
+
+        await self.rate_limiter.acquire(from_number)
+
+        # La espera del límite de tasa puede pasar el lock de la toma
+        if not await renew_queued_sms(record_id, claim_token, SMS_QUEUE_SEND_LOCK_SECONDS):
+            logger.warning("queued_sms_lost_lock", extra={"fields": {"record_id": str(record_id)}})
+            return
+
+        try:
+            message = await twilio_call(
+                "messages.create",
+                lambda: self._client.messages.create_async(
+                    body=record["message_body"],
+                    from_=from_number,
+                    to=record["to_number"],
+                    status_callback=STATUS_CALLBACK,
+                ),
+            )
+        except Exception as e:
+            error = f"Twilio error: {e.msg}" if isinstance(e, TwilioRestException) else f"Error: {str(e)}"
+
+            if isinstance(e, TwilioRestException) and e.code == TWILIO_OPT_OUT_ERROR:
+                await opt_out_list.record_twilio_error(record["to_number"])
+
+            if isinstance(e, TwilioCircuitOpen):
+                # La petición no se envió: no cuenta como intento
+                next_attempt_at = datetime.now() + timedelta(seconds=e.retry_after)
+                await retry_queued_sms(record_id, claim_token, error, next_attempt_at, count_attempt=False)
+            elif is_retryable(e) and record["attempts"] < SMS_MAX_ATTEMPTS:
+                delay = retry_delay(record["attempts"])
+                if isinstance(e, TwilioUnavailable) and e.retry_after:
+                    delay = max(delay, e.retry_after)
+                next_attempt_at = datetime.now() + timedelta(seconds=delay)
+                await retry_queued_sms(record_id, claim_token, error, next_attempt_at)
+            else:
+                await fail_queued_sms(record_id, claim_token, error)
+            return
+
+        if not await complete_queued_sms(record_id, claim_token, message.sid, from_number):
+            logger.warning(
+                "queued_sms_lost_lock",
+                extra={"fields": {"record_id": str(record_id), "message_sid": message.sid}},
+            )
+
+
+# Cola compartida por toda la aplicación
+sms_queue = SMSQueue()
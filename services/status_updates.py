@@ -0,0 +1,151 @@
+from twilio.base import values
+from database.mongodb import apply_status_updates, MESSAGE_STATUS_RANK
+from services.metrics import registry, CallbackGauge
+from services.logging_setup import get_logger
+import asyncio
+import os
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración de los callbacks de estado de entrega
+#   - TWILIO_STATUS_CALLBACK_URL: URL pública de POST /sms/webhook/status que se registra
+#     en cada messages.create (si no se define, Twilio no envía callbacks)
+#   - STATUS_FLUSH_MS: Cada cuántos milisegundos se guardan los estados acumulados
+#   - STATUS_BATCH_SIZE: Se guardan antes si se acumulan esta cantidad de mensajes
+#   - STATUS_ORPHAN_TTL_SECONDS: Por cuánto tiempo se reintenta un estado cuyo
+#     mensaje todavía no está en sms_records
+STATUS_CALLBACK = os.getenv("TWILIO_STATUS_CALLBACK_URL") or values.unset
+STATUS_FLUSH_MS = float(os.getenv("STATUS_FLUSH_MS", "500"))
+STATUS_BATCH_SIZE = int(os.getenv("STATUS_BATCH_SIZE", "1000"))
+STATUS_ORPHAN_TTL_SECONDS = float(os.getenv("STATUS_ORPHAN_TTL_SECONDS", "60"))
+
+logger = get_logger("status")
+
+
+class StatusCoalescer:
+    """
+    Acumula los callbacks de estado y los guarda en lotes
+
+    Cada mensaje genera varios callbacks (queued, sent, delivered...). En vez
+    de un update_one por callback, se guarda en memoria solo el estado más
+    avanzado de cada MessageSid y se aplican todos juntos con bulk_write.
+
+    Twilio puede enviar un callback antes de que el envío se guarde en
+    sms_records (ej: la cola guarda el SID después de messages.create). Esos
+    estados se vuelven a intentar en los lotes siguientes durante
+    `orphan_ttl` segundos; pasado ese tiempo se descartan (el mensaje no
+    se envió desde esta API).
+    """
+
+    def __init__(self, flush_ms: float, batch_size: int, orphan_ttl: float = STATUS_ORPHAN_TTL_SECONDS):
+        self.flush_seconds = flush_ms / 1000
+        self.batch_size = batch_size
+        self.orphan_ttl = orphan_ttl
+        self._pending = {}
+        self._orphans = {}
+        self._task = None
+        self._full = asyncio.Event()
+        self.received = 0
+        self.applied = 0
+        self.dropped = 0
+
+    def add(self, message_sid: str, status: str, error_code=None):
+        """
+        Registra un callback; si ya había uno más avanzado para el mismo SID, se ignora
+        """
+        self.received += 1
+        self._merge(message_sid, status, error_code)
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+
+    def _merge(self, message_sid: str, status: str, error_code):
+        rank = MESSAGE_STATUS_RANK.get(status)
+        if rank is None:
+            return
+
+        current = self._pending.get(message_sid)
+        if current is None or rank > MESSAGE_STATUS_RANK[current[0]]:
+            self._pending[message_sid] = (status, error_code)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, {}
+        updates = [
+            (message_sid, status, error_code)
+            for message_sid, (status, error_code) in pending.items()
+        ]
+        try:
+            missing = await apply_status_updates(updates)
+        except Exception:
+            logger.exception("status_flush_failed", extra={"fields": {"updates": len(updates)}})
+            # Se reintentan en el próximo lote (sin pisar estados más nuevos)
+            for message_sid, (status, error_code) in pending.items():
+                self._merge(message_sid, status, error_code)
+            return
+
+        self.applied += len(updates) - len(missing)
+        self._keep_orphans(pending, missing)
+
+    def _keep_orphans(self, pending: dict, missing: list):
+        """
+        Devuelve a la cola los estados sin documento, hasta que venza su plazo
+        """
+        now = time.monotonic()
+        missing = set(missing)
+        for message_sid in list(self._orphans):
+            if message_sid not in missing:
+                # Se aplicó (o quedó pendiente de nuevo por un callback más reciente)
+                del self._orphans[message_sid]
+
+        for message_sid in missing:
+            first_seen = self._orphans.setdefault(message_sid, now)
+            if now - first_seen >= self.orphan_ttl:
+                del self._orphans[message_sid]
+                self.dropped += 1
+                logger.warning("status_update_dropped", extra={"fields": {"message_sid": message_sid}})
+                continue
+            status, error_code = pending[message_sid]
+            self._merge(message_sid, status, error_code)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "received": self.received,
+            "applied": self.applied,
+            "waiting_for_record": len(self._orphans),
+            "dropped": self.dropped,
+        }
+
+
+# Acumulador compartido por el webhook de estados
+status_coalescer = StatusCoalescer(STATUS_FLUSH_MS, STATUS_BATCH_SIZE)
+
+registry.register(CallbackGauge(
+    "status_updates_pending",
+    "Estados de entrega esperando a guardarse en MongoDB",
+    lambda: len(status_coalescer._pending),
+))
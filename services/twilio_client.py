@@ -0,0 +1,333 @@
+from fastapi import HTTPException
+from aiohttp import ClientError, ClientSession, TCPConnector
+from twilio.rest import Client
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+from services.metrics import registry, CallbackGauge, twilio_latency, twilio_in_flight, twilio_errors, twilio_retries
+from services.circuit_breaker import CircuitBreakers
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+import asyncio
+import os
+import random
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+# Configuración del pool de conexiones HTTP hacia Twilio
+#   - TWILIO_HTTP_POOL_SIZE: Máximo de conexiones simultáneas abiertas hacia api.twilio.com
+#   - TWILIO_HTTP_KEEPALIVE: Segundos que una conexión ociosa se mantiene abierta para reutilizarla
+#   - TWILIO_HTTP_TIMEOUT: Segundos máximos de espera por cada petición a Twilio
+TWILIO_HTTP_POOL_SIZE = int(os.getenv("TWILIO_HTTP_POOL_SIZE", "100"))
+TWILIO_HTTP_KEEPALIVE = float(os.getenv("TWILIO_HTTP_KEEPALIVE", "30"))
+TWILIO_HTTP_TIMEOUT = float(os.getenv("TWILIO_HTTP_TIMEOUT", "10"))
+
+# URL alternativa para la API de Twilio (ej: el servidor falso de benchmarks/fake_twilio.py).
+# Si no se define, se usa https://api.twilio.com
+TWILIO_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL")
+TWILIO_DEFAULT_BASE_URL = "https://api.twilio.com"
+
+# Resiliencia de las llamadas a Twilio (ver twilio_call())
+#   - TWILIO_CALL_DEADLINE: Segundos máximos de una llamada, sumando todos sus reintentos
+#   - TWILIO_RETRY_ATTEMPTS: Intentos como máximo por llamada
+#   - TWILIO_RETRY_BASE_SECONDS / TWILIO_RETRY_MAX_SECONDS: Espera exponencial entre intentos
+#   - TWILIO_BREAKER_FAILURES: Fallos seguidos de un endpoint que abren su circuito
+#   - TWILIO_BREAKER_RESET_SECONDS: Tiempo que el circuito queda abierto antes de probar de nuevo
+TWILIO_CALL_DEADLINE = float(os.getenv("TWILIO_CALL_DEADLINE", "15"))
+TWILIO_RETRY_ATTEMPTS = int(os.getenv("TWILIO_RETRY_ATTEMPTS", "3"))
+TWILIO_RETRY_BASE_SECONDS = float(os.getenv("TWILIO_RETRY_BASE_SECONDS", "0.5"))
+TWILIO_RETRY_MAX_SECONDS = float(os.getenv("TWILIO_RETRY_MAX_SECONDS", "5"))
+TWILIO_BREAKER_FAILURES = int(os.getenv("TWILIO_BREAKER_FAILURES", "5"))
+TWILIO_BREAKER_RESET_SECONDS = float(os.getenv("TWILIO_BREAKER_RESET_SECONDS", "30"))
+
+# Un circuito por endpoint: si falla messages.create, las búsquedas de números siguen funcionando
+twilio_breakers = CircuitBreakers(TWILIO_BREAKER_FAILURES, TWILIO_BREAKER_RESET_SECONDS)
+
+# Twilio informa en Retry-After cuánto esperar tras un 429 o 503, pero la
+# librería no lo incluye en TwilioRestException. twilio_call() deja aquí un
+# dict que PooledTwilioHttpClient completa con ese valor.
+_retry_after: ContextVar[Optional[dict]] = ContextVar("twilio_retry_after", default=None)
+
+
+class TwilioUnavailable(Exception):
+    """
+    Twilio no respondió a tiempo o su circuito está abierto (la llamada no se hizo)
+
+    retry_after: Segundos sugeridos antes de volver a intentar (None si no se sabe)
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TwilioCircuitOpen(TwilioUnavailable):
+    """
+    El circuito del endpoint está abierto: la petición no llegó a enviarse
+    """
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Convierte el header Retry-After (segundos o fecha HTTP) a segundos
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class PooledTwilioHttpClient(AsyncTwilioHttpClient):
+    """
+    Cliente HTTP asíncrono de Twilio con un pool de conexiones keep-alive
+
+    AsyncTwilioHttpClient crea su ClientSession sin límites ni timeout propios,
+    y la librería de Twilio le pasa timeout=None en cada petición (lo que en
+    aiohttp significa "sin timeout"). Esta clase usa un TCPConnector con
+    tamaño de pool configurable y aplica TWILIO_HTTP_TIMEOUT por defecto.
+    """
+
+    def __init__(self, pool_size: int, keepalive: float, timeout: float,
+                 base_url: Optional[str] = None):
+        super().__init__(pool_connections=False, timeout=timeout)
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.session = ClientSession(
+            connector=TCPConnector(limit=pool_size, keepalive_timeout=keepalive)
+        )
+
+    async def request(self, method, url, params=None, data=None, headers=None,
+                      auth=None, timeout=None, allow_redirects=False):
+        if self.base_url and url.startswith(TWILIO_DEFAULT_BASE_URL):
+            url = self.base_url + url[len(TWILIO_DEFAULT_BASE_URL):]
+
+        response = await super().request(
+            method,
+            url,
+            params=params,
+            data=data,
+            headers=headers,
+            auth=auth,
+            timeout=timeout if timeout is not None else self.timeout,
+            allow_redirects=allow_redirects,
+        )
+
+        holder = _retry_after.get()
+        if holder is not None and response.status_code in (429, 503) and response.headers:
+            holder["seconds"] = _parse_retry_after(response.headers.get("Retry-After"))
+
+        return response
+
+
+# Cliente compartido por toda la aplicación (se crea en el lifespan de FastAPI)
+_client: Optional[Client] = None
+
+
+async def init_twilio_client():
+    """
+    Crea el cliente de Twilio compartido
+
+    Se llama una sola vez al iniciar la aplicación. Si faltan las credenciales
+    no se crea el cliente y las rutas responderán 500 al usarlo.
+    """
+    global _client
+
+    account_sid = os.getenv("TWILIO_ACCOUNT_SID")
+    auth_token = os.getenv("TWILIO_AUTH_TOKEN")
+
+    if not account_sid or not auth_token:
+        return None
+
+    http_client = PooledTwilioHttpClient(
+        pool_size=TWILIO_HTTP_POOL_SIZE,
+        keepalive=TWILIO_HTTP_KEEPALIVE,
+        timeout=TWILIO_HTTP_TIMEOUT,
+        base_url=TWILIO_API_BASE_URL,
+    )
+    _client = Client(account_sid, auth_token, http_client=http_client)
+    return _client
+
+
+async def close_twilio_client():
+    """
+    Cierra las conexiones abiertas del cliente compartido al apagar la aplicación
+    """
+    global _client
+
+    if _client is not None:
+        await _client.http_client.close()
+        _client = None
+
+
+def get_twilio_client() -> Client:
+    """
+    Dependencia de FastAPI que entrega el cliente de Twilio compartido
+    """
+    if _client is None:
+        raise HTTPException(status_code=500, detail="Twilio credentials not configured")
+
+    return _client
+
+
+def get_optional_twilio_client() -> Optional[Client]:
+    """
+    Igual que get_twilio_client(), pero retorna None en vez de responder 500
+    cuando faltan las credenciales (para rutas que pueden funcionar sin Twilio)
+    """
+    return _client
+
+
+def _is_transient(error: Exception) -> bool:
+    """
+    Indica si un error es pasajero: límite de tasa (429), error del servidor
+    (5xx), timeout o problema de red. Los demás errores de Twilio (número
+    inválido, etc.) no van a cambiar al reintentar, y cualquier otra
+    excepción es un error del programa, no de Twilio.
+    """
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (ClientError, asyncio.TimeoutError, OSError))
+
+
+def _is_safe_to_retry(error: Exception, idempotent: bool) -> bool:
+    """
+    Indica si se puede repetir la petición sin riesgo de duplicar su efecto
+
+    Un 429 o 503 significa que Twilio rechazó la petición sin procesarla. Tras
+    otros 5xx, timeouts o errores de red no se sabe si se procesó, así que solo
+    se reintentan las llamadas idempotentes (lecturas y eliminaciones).
+    """
+    if isinstance(error, TwilioRestException) and error.status in (429, 503):
+        return True
+    return idempotent
+
+
+def _backoff(attempt: int, retry_after: Optional[float]) -> float:
+    """
+    Espera exponencial con jitter, nunca menor que el Retry-After de Twilio
+    """
+    delay = min(TWILIO_RETRY_MAX_SECONDS, TWILIO_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+    delay *= random.uniform(0.5, 1.0)
+    return max(delay, retry_after or 0.0)
+
+
+async def twilio_call(endpoint: str, call, idempotent: bool = False,
+                      deadline: float = TWILIO_CALL_DEADLINE):
+    """
+    Ejecuta una llamada a la API de Twilio con plazo máximo, reintentos y
+    circuit breaker, registrando sus métricas
+
+    - Toda la llamada (intentos y esperas) debe terminar dentro de `deadline`
+      segundos; si no, se lanza TwilioUnavailable.
+    - Los errores pasajeros se reintentan hasta TWILIO_RETRY_ATTEMPTS veces
+      con espera exponencial con jitter, respetando el Retry-After de Twilio
+      (ver _is_safe_to_retry() para las llamadas que crean algo).
+    - Cada endpoint tiene su circuit breaker: tras TWILIO_BREAKER_FAILURES
+      fallos seguidos (5xx, timeouts o errores de red; un 429 no cuenta porque
+      Twilio está respondiendo) las llamadas fallan al instante con
+      TwilioUnavailable durante TWILIO_BREAKER_RESET_SECONDS.
+
+    Parámetros:
+        endpoint (str): Nombre de la operación (ej: "messages.create")
+        call: Función sin parámetros que retorna la corrutina a esperar
+              (se vuelve a llamar en cada intento)
+        idempotent (bool): True si repetir la petición no tiene efectos extra
+        deadline (float): Segundos máximos para toda la llamada
+
+    Ejemplo:
+        message = await twilio_call(
+            "messages.create",
+            lambda: client.messages.create_async(body="Hola", from_=origen, to=destino),
+        )
+    """
+    labels = (endpoint,)
+    breaker = twilio_breakers.get(endpoint)
+    expires_at = time.monotonic() + deadline
+    attempt = 0
+
+    while True:
+        attempt += 1
+
+        retry_in = breaker.allow()
+        if retry_in is not None:
+            twilio_errors.inc((endpoint, "circuit_open"))
+            raise TwilioCircuitOpen(
+                f"Twilio {endpoint} unavailable (circuit open, retry in {retry_in:.0f}s)", retry_in
+            )
+
+        holder = {}
+        token = _retry_after.set(holder)
+        twilio_in_flight.inc(labels)
+        started = time.perf_counter()
+        try:
+            return_value = await asyncio.wait_for(call(), max(0.0, expires_at - time.monotonic()))
+        except TwilioRestException as e:
+            twilio_errors.inc((endpoint, str(e.code or e.status)))
+            error = e
+        except asyncio.TimeoutError as e:
+            twilio_errors.inc((endpoint, "timeout"))
+            error = e
+        except asyncio.CancelledError:
+            breaker.release()
+            raise
+        except Exception as e:
+            twilio_errors.inc((endpoint, "network" if _is_transient(e) else "error"))
+            error = e
+        else:
+            breaker.record_success()
+            return return_value
+        finally:
+            _retry_after.reset(token)
+            twilio_latency.observe(time.perf_counter() - started, labels)
+            twilio_in_flight.dec(labels)
+
+        if not _is_transient(error):
+            if isinstance(error, TwilioRestException):
+                # Twilio respondió: el endpoint funciona aunque la petición sea inválida
+                breaker.record_success()
+            else:
+                # Error local: no dice nada del estado de Twilio
+                breaker.release()
+            raise error
+
+        if isinstance(error, TwilioRestException) and error.status == 429:
+            breaker.release()
+        else:
+            breaker.record_failure()
+
+        delay = _backoff(attempt, holder.get("seconds"))
+        can_retry = (
+            attempt < TWILIO_RETRY_ATTEMPTS
+            and _is_safe_to_retry(error, idempotent)
+            and time.monotonic() + delay < expires_at
+            and breaker.available()
+        )
+        if not can_retry:
+            if isinstance(error, asyncio.TimeoutError):
+                raise TwilioUnavailable(
+                    f"Twilio {endpoint} did not answer within {deadline:g}s", holder.get("seconds")
+                ) from error
+            raise error
+
+        twilio_retries.inc(labels)
+        await asyncio.sleep(delay)
+
+
+registry.register(CallbackGauge(
+    "twilio_circuit_open",
+    "Circuitos de la API de Twilio por endpoint (1 = abierto o probando, 0 = cerrado)",
+    lambda: {
+        (endpoint,): int(state["state"] != "closed")
+        for endpoint, state in twilio_breakers.stats().items()
+    },
+    ("endpoint",),
+))
@@ -0,0 +1,94 @@
+import pytest
+
+from services.auto_reply import KeywordMatcher, CompiledRules, AutoReplyEngine, normalize_text
+
+
+def naive_search(keywords, text):
+    return sorted(
+        (start, index)
+        for index, keyword in enumerate(keywords)
+        for start in range(len(text) - len(keyword) + 1)
+        if text.startswith(keyword, start)
+    )
+
+
+def test_matcher_finds_every_occurrence():
+    matcher = KeywordMatcher(["precio", "horario"])
+
+    assert list(matcher.search("cual es el horario?")) == [(11, 1)]
+    assert list(matcher.search("sin coincidencias")) == []
+
+
+@pytest.mark.parametrize("keywords, text", [
+    # Palabras que son prefijo, sufijo o parte de otras (enlaces de falla)
+    (["he", "she", "his", "hers"], "ushers"),
+    (["a", "ab", "bab", "bc", "bca", "c", "caa"], "abccab"),
+    (["aa", "aaa"], "aaaaa"),
+    (["hora", "horario", "rario"], "el horario de la hora"),
+])
+def test_matcher_matches_naive_search(keywords, text):
+    matcher = KeywordMatcher(keywords)
+
+    assert sorted(matcher.search(text)) == naive_search(keywords, text)
+
+
+def test_normalize_text_removes_case_and_accents():
+    assert normalize_text("PRECIÓ Ñandú") == "precio nandu"
+
+
+def rule(keyword, priority=0, reply="ok"):
+    return {"keyword": keyword, "priority": priority, "reply": reply}
+
+
+def compiled(*rules):
+    return CompiledRules([dict(r, template=None) for r in rules])
+
+
+def test_rules_only_match_whole_words():
+    rules = compiled(rule("hora"))
+
+    assert rules.match("que hora es") is not None
+    assert rules.match("hora") is not None
+    assert rules.match("ahora no") is None
+    assert rules.match("horario") is None
+
+
+def test_higher_priority_wins_then_first_in_message():
+    rules = compiled(rule("precio"), rule("horario", priority=5), rule("envio"))
+
+    assert rules.match("precio y horario")["keyword"] == "horario"
+    assert rules.match("envio y precio")["keyword"] == "envio"
+
+
+def make_engine(documents):
+    engine = AutoReplyEngine(reload_seconds=10, default_reply="Recibimos: $body")
+    engine.compile(documents)
+    return engine
+
+
+def test_engine_replies_with_the_matching_template():
+    engine = make_engine([
+        {"keyword": "Horario", "reply": "Atendemos de 9 a 18, $from_number ($keyword)"},
+    ])
+
+    assert engine.reply("+56911111111", "+15550000000", "¿HORARIO?") == "Atendemos de 9 a 18, +56911111111 (horario)"
+    assert engine.reply("+56911111111", "+15550000000", "hola") == "Recibimos: hola"
+
+
+def test_engine_rules_by_receiving_number():
+    engine = make_engine([
+        {"keyword": "precio", "reply": "Global"},
+        {"keyword": "precio", "reply": "Ventas", "to_number": "+15550000001", "priority": 1},
+        {"keyword": "stock", "reply": "Apagada", "enabled": False},
+    ])
+
+    assert engine.reply("+56911111111", "+1 555 000 0001", "precio") == "Ventas"
+    assert engine.reply("+56911111111", "+15550000002", "precio") == "Global"
+    assert engine.reply("+56911111111", "+15550000002", "stock") == "Recibimos: stock"
+    assert engine.stats() == {"rules": 2, "numbers": 1}
+
+
+def test_empty_reply_means_no_answer():
+    engine = make_engine([{"keyword": "gracias", "reply": ""}])
+
+    assert engine.reply("+56911111111", "+15550000000", "Gracias!") == ""
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from services import cache as cache_module
+from services.cache import TTLCache, SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def test_ttl_cache_expires_entries(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock.monotonic)
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set("key", "value")
+
+    clock.now += 59
+    assert cache.get("key") == "value"
+    clock.now += 1
+    assert cache.get("key") is None
+    assert "key" not in cache
+
+
+def test_ttl_cache_evicts_the_least_recently_used():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+
+    cache.set("c", 3)
+
+    assert cache.keys() == ["a", "c"]
+
+
+def test_concurrent_calls_share_one_flight():
+    flight = SingleFlight()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return ["+18153965488"]
+
+    async def run():
+        return await asyncio.gather(*(flight.do("US", fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == [["+18153965488"]] * 5
+    assert calls == [1]
+    assert flight._inflight == {}
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("twilio down")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("US", fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    flight = SingleFlight()
+    release = None
+
+    async def fetch():
+        await release.wait()
+        return "result"
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        leader = asyncio.create_task(flight.do("US", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do("US", fetch))
+        await asyncio.sleep(0)
+
+        # El cliente de la primera petición se desconecta
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(run()) == "result"
+    assert flight._inflight == {}
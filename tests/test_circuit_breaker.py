@@ -0,0 +1,213 @@
+import asyncio
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from fastapi.testclient import TestClient
+from twilio.base.exceptions import TwilioRestException
+
+from main import app
+from routes import phone_numbers
+from services import circuit_breaker as breaker_module
+from services import twilio_client
+from services.circuit_breaker import CircuitBreaker, CircuitBreakers
+from services.twilio_client import _is_transient, twilio_call, get_twilio_client, TwilioCircuitOpen
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(breaker_module.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=30)
+
+    for _ in range(2):
+        assert breaker.allow() is None
+        breaker.record_failure()
+    assert breaker.state == "closed"
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.allow() == 30
+    assert not breaker.available()
+    assert breaker.stats() == {"state": "open", "failures": 3, "opens": 1, "retry_in": 30}
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=30)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == "closed"
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+
+    clock.now += 30
+
+    assert breaker.available()
+    assert breaker.allow() is None
+    assert breaker.state == "half_open"
+    # Mientras la prueba no termina, las demás llamadas se rechazan
+    assert breaker.allow() == 30
+    assert not breaker.available()
+
+
+def test_successful_probe_closes_the_circuit(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.allow()
+
+    breaker.record_success()
+
+    assert breaker.state == "closed"
+    assert breaker.allow() is None
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker(failure_threshold=5, reset_seconds=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock.now += 30
+    breaker.allow()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert breaker.opens == 2
+    assert breaker.allow() == 30
+
+
+def test_released_probe_can_be_retried(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=30)
+    breaker.record_failure()
+    clock.now += 30
+    breaker.allow()
+
+    breaker.release()
+
+    assert breaker.state == "half_open"
+    assert breaker.allow() is None
+
+
+def test_one_breaker_per_key():
+    breakers = CircuitBreakers(failure_threshold=1, reset_seconds=30)
+
+    breakers.get("messages.create").record_failure()
+
+    assert breakers.get("messages.create").state == "open"
+    assert breakers.get("incoming_phone_numbers.list").state == "closed"
+    assert set(breakers.stats()) == {"messages.create", "incoming_phone_numbers.list"}
+
+
+@pytest.mark.parametrize("error, transient", [
+    (TwilioRestException(429, "https://api.twilio.com"), True),
+    (TwilioRestException(500, "https://api.twilio.com"), True),
+    (TwilioRestException(503, "https://api.twilio.com"), True),
+    (TwilioRestException(400, "https://api.twilio.com", code=21211), False),
+    (TwilioRestException(404, "https://api.twilio.com"), False),
+    (asyncio.TimeoutError(), True),
+    (aiohttp.ClientConnectionError(), True),
+    (ConnectionResetError(), True),
+    (ValueError("bug"), False),
+    (KeyError("bug"), False),
+])
+def test_is_transient(error, transient):
+    assert _is_transient(error) is transient
+
+
+def test_local_errors_do_not_trip_the_circuit(monkeypatch):
+    breakers = CircuitBreakers(failure_threshold=1, reset_seconds=30)
+    monkeypatch.setattr(twilio_client, "twilio_breakers", breakers)
+    calls = []
+
+    async def broken():
+        calls.append(1)
+        raise ValueError("bug")
+
+    with pytest.raises(ValueError):
+        asyncio.run(twilio_call("messages.create", broken))
+
+    # Un error del programa no se reintenta ni abre el circuito
+    assert calls == [1]
+    assert breakers.get("messages.create").state == "closed"
+
+
+def test_open_circuit_fails_fast(monkeypatch):
+    breakers = CircuitBreakers(failure_threshold=1, reset_seconds=30)
+    breakers.get("messages.create").record_failure()
+    monkeypatch.setattr(twilio_client, "twilio_breakers", breakers)
+
+    async def never_called():
+        raise AssertionError("the call should not be made")
+
+    with pytest.raises(TwilioCircuitOpen) as raised:
+        asyncio.run(twilio_call("messages.create", never_called))
+
+    assert raised.value.retry_after > 0
+
+
+@pytest.fixture
+def unavailable_twilio(monkeypatch):
+    async def unavailable(endpoint, call, **kwargs):
+        raise TwilioCircuitOpen(f"Twilio {endpoint} unavailable", 7.2)
+
+    monkeypatch.setattr(phone_numbers, "twilio_call", unavailable)
+    app.dependency_overrides[get_twilio_client] = lambda: object()
+    yield TestClient(app)
+    app.dependency_overrides.pop(get_twilio_client)
+
+
+def test_purchase_returns_503_when_twilio_is_unavailable(unavailable_twilio):
+    response = unavailable_twilio.post("/phone-numbers/purchase", json={"phone_number": "+18153965488"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "8"
+
+
+def test_release_returns_503_when_twilio_is_unavailable(unavailable_twilio):
+    response = unavailable_twilio.delete("/phone-numbers/PN1234567890abcdef1234567890abcdef")
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "8"
+
+
+def test_release_is_retried_as_idempotent(monkeypatch):
+    options = {}
+
+    async def record_call(endpoint, call, **kwargs):
+        options[endpoint] = kwargs
+        return True
+
+    async def no_store(*args):
+        pass
+
+    monkeypatch.setattr(phone_numbers, "twilio_call", record_call)
+    monkeypatch.setattr(phone_numbers, "delete_owned_number", no_store)
+    app.dependency_overrides[get_twilio_client] = lambda: SimpleNamespace(
+        incoming_phone_numbers=lambda sid: SimpleNamespace(delete_async=no_store)
+    )
+    try:
+        response = TestClient(app).delete("/phone-numbers/PN1234567890abcdef1234567890abcdef")
+    finally:
+        app.dependency_overrides.pop(get_twilio_client)
+
+    assert response.json()["success"]
+    assert options["incoming_phone_numbers.delete"] == {"idempotent": True}
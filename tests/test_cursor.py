@@ -0,0 +1,40 @@
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from database.mongodb import encode_cursor, decode_cursor
+
+
+def test_round_trip_with_datetime():
+    sent_at = datetime(2025, 3, 1, 9, 30, 15, 123456)
+    document_id = ObjectId()
+
+    assert decode_cursor(encode_cursor(sent_at, document_id)) == (sent_at, document_id)
+
+
+def test_round_trip_with_string_time():
+    # received_at se guarda como texto ISO 8601
+    received_at = "2025-03-01T09:30:15.123456"
+    document_id = ObjectId()
+
+    cursor = encode_cursor(received_at, document_id)
+
+    assert decode_cursor(cursor, time_as_string=True) == (received_at, document_id)
+
+
+def test_cursor_is_url_safe():
+    cursor = encode_cursor(datetime(2025, 3, 1), ObjectId())
+
+    assert all(character.isalnum() or character in "-_=" for character in cursor)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-base64!",
+    "bm90IGpzb24=",  # "not json"
+    encode_cursor(datetime(2025, 3, 1), "not-an-object-id"),
+    encode_cursor("not a date", ObjectId()),
+])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
@@ -0,0 +1,63 @@
+import pytest
+
+from models.device import SMSBatch
+from services import e164
+from services.e164 import normalize_e164, e164_key
+from services.preflight import preflight
+
+
+@pytest.fixture
+def default_country(monkeypatch):
+    monkeypatch.setattr(e164, "E164_DEFAULT_COUNTRY_CODE", "56")
+    normalize_e164.cache_clear()
+    yield
+    normalize_e164.cache_clear()
+
+
+@pytest.mark.parametrize("number", [
+    "+56948372612",
+    "+56 9 4837 2612",
+    "+56-9-4837-2612",
+    "+56 (9) 4837.2612",
+    "0056 9 4837 2612",
+])
+def test_separators_and_00_prefix(number):
+    assert normalize_e164(number) == "+56948372612"
+
+
+@pytest.mark.parametrize("number", [
+    "",
+    "hola",
+    "948372612",  # sin código de país y sin E164_DEFAULT_COUNTRY_CODE
+    "+0948372612",
+    "+1234567",
+    "+1234567890123456",
+])
+def test_invalid_numbers(number):
+    with pytest.raises(ValueError):
+        normalize_e164(number)
+
+
+def test_default_country_code(default_country):
+    assert normalize_e164("948372612") == "+56948372612"
+    assert normalize_e164("0948372612") == "+56948372612"
+    assert normalize_e164("+1 415 555 0100") == "+14155550100"
+
+
+def test_key_falls_back_to_the_trimmed_value():
+    # Códigos cortos y remitentes alfanuméricos que llegan por el webhook
+    assert e164_key(" 22395 ") == "22395"
+    assert e164_key("ALLOXENTRIC") == "ALLOXENTRIC"
+    assert e164_key("+56 9 4837 2612") == "+56948372612"
+
+
+def test_invalid_number_does_not_reject_the_batch():
+    batch = SMSBatch(messages=[
+        {"to_number": "+56 9 4837 2612", "message_body": "Hola"},
+        {"to_number": "no es un número", "message_body": "Hola"},
+    ])
+
+    valid, invalid = (preflight(sms.to_number, sms.message_body) for sms in batch.messages)
+
+    assert valid.ok and valid.to_number == "+56948372612"
+    assert not invalid.ok and invalid.error.startswith("Invalid phone number")
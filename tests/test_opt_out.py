@@ -0,0 +1,67 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from routes import sms as sms_routes
+from services.opt_out import opt_out_list, opt_out_keyword, opt_out_suppressed
+from services.twilio_client import get_optional_twilio_client
+
+OPTED_OUT = "+56911111111"
+
+
+@pytest.mark.parametrize("body, expected", [
+    ("STOP", True),
+    (" stop ", True),
+    ("Unsubscribe", True),
+    ("START", False),
+    ("yes", False),
+    ("stop please", None),
+    ("Hola", None),
+])
+def test_opt_out_keyword(body, expected):
+    assert opt_out_keyword(body) is expected
+
+
+def test_suppression_uses_the_e164_key(monkeypatch):
+    monkeypatch.setattr(opt_out_list, "_numbers", {OPTED_OUT})
+
+    assert opt_out_list.is_suppressed("+56 9 1111 1111")
+    assert not opt_out_list.is_suppressed("+56922222222")
+
+
+@pytest.fixture
+def webhook(monkeypatch):
+    monkeypatch.setattr(opt_out_list, "_numbers", {OPTED_OUT})
+    stored = []
+
+    async def claim(record):
+        stored.append(record)
+        return True
+
+    async def no_twilio(*args, **kwargs):
+        raise AssertionError("Twilio should not be called")
+
+    monkeypatch.setattr(sms_routes, "claim_incoming_sms", claim)
+    monkeypatch.setattr(sms_routes, "twilio_call", no_twilio)
+    app.dependency_overrides[get_optional_twilio_client] = lambda: object()
+    yield TestClient(app), stored
+    app.dependency_overrides.pop(get_optional_twilio_client)
+
+
+@pytest.mark.parametrize("mode", ["rest", "twiml"])
+def test_no_auto_reply_to_opted_out_numbers(monkeypatch, webhook, mode):
+    monkeypatch.setattr(sms_routes, "AUTO_REPLY_MODE", mode)
+    client, stored = webhook
+    suppressed = opt_out_suppressed.values.get((), 0)
+
+    response = client.post("/sms/webhook/incoming", data={
+        "MessageSid": f"SM{mode}0000000000000000000000000000",
+        "From": OPTED_OUT,
+        "To": "+15550000000",
+        "Body": "Hola, una consulta",
+    })
+
+    assert response.status_code == 200
+    assert "<Message>" not in response.text
+    assert stored[0]["auto_reply_sent"] is False
+    assert opt_out_suppressed.values[()] == suppressed + 1
@@ -0,0 +1,112 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from services.preflight import (
+    analyze_body,
+    analyze_bodies,
+    truncate_body,
+    preflight,
+    preflight_batch,
+    TWILIO_MAX_BODY_LENGTH,
+)
+
+NUMBER = "+56948372612"
+
+
+@pytest.mark.parametrize("body, expected", [
+    ("", ("GSM-7", 0, 0)),
+    ("Hola", ("GSM-7", 4, 1)),
+    ("a" * 160, ("GSM-7", 160, 1)),
+    ("a" * 161, ("GSM-7", 161, 2)),
+    ("a" * 306, ("GSM-7", 306, 2)),
+    ("a" * 307, ("GSM-7", 307, 3)),
+    # La tabla de extensión ocupa dos posiciones
+    ("€" * 80, ("GSM-7", 160, 1)),
+    ("€" * 81, ("GSM-7", 162, 2)),
+    # Un carácter fuera del alfabeto GSM pasa todo el mensaje a UCS-2
+    ("á" * 70, ("UCS-2", 70, 1)),
+    ("á" * 71, ("UCS-2", 71, 2)),
+    ("a" * 159 + "ç", ("UCS-2", 160, 3)),
+    # Los emojis (fuera del plano básico) cuentan doble
+    ("Hola 👋", ("UCS-2", 7, 1)),
+])
+def test_analyze_body(body, expected):
+    assert tuple(analyze_body(body)) == expected
+
+
+def test_analyze_bodies_matches_analyze_body():
+    bodies = ["Hola", "Hola", "a" * 200, "", "€uros", "Hola 👋", "ñandú"]
+
+    infos = analyze_bodies(bodies)
+
+    assert set(infos) == set(bodies)
+    assert all(infos[body] == analyze_body(body) for body in bodies)
+
+
+def test_analyze_bodies_all_basic_gsm():
+    infos = analyze_bodies(["Hola", "a" * 161])
+
+    assert infos["Hola"] == analyze_body("Hola")
+    assert infos["a" * 161] == analyze_body("a" * 161)
+
+
+@pytest.mark.parametrize("body, encoding, segments", [
+    ("a" * 500, "GSM-7", 2),
+    ("€" * 200, "GSM-7", 2),
+    ("á" * 200, "UCS-2", 2),
+    ("👋" * 100, "UCS-2", 2),
+])
+def test_truncate_body_fits_the_segments(body, encoding, segments):
+    truncated = truncate_body(body, encoding, segments)
+
+    assert analyze_body(truncated).segments == segments
+    assert body.startswith(truncated)
+    # No se cortó de más: un carácter más ya no cabe
+    assert analyze_body(body[:len(truncated) + 1]).segments > segments
+
+
+def test_preflight_rejects_empty_and_long_messages():
+    assert preflight(NUMBER, "").error == "Message body is empty"
+    assert preflight(NUMBER, "a" * 307, max_segments=2).error == "Message body needs 3 segments (max 2)"
+
+
+def test_preflight_reports_twilio_length_by_itself():
+    # Cabe en los segmentos permitidos pero supera el largo máximo de Twilio
+    body = "a" * (TWILIO_MAX_BODY_LENGTH + 1)
+
+    check = preflight(NUMBER, body, max_segments=20)
+
+    assert not check.ok
+    assert check.error == f"Message body has {len(body)} characters (max {TWILIO_MAX_BODY_LENGTH})"
+
+
+def test_preflight_truncates():
+    check = preflight(NUMBER, "a" * 400, max_segments=2, truncate=True)
+
+    assert check.ok
+    assert check.body == "a" * 306
+    assert (check.encoding, check.segments) == ("GSM-7", 2)
+
+
+def test_preflight_batch_matches_preflight():
+    messages = [(NUMBER, "Hola"), ("invalid", "Hola"), (NUMBER, ""), (NUMBER, "a" * 2000), (NUMBER, "Hola 👋")]
+
+    assert preflight_batch(messages) == [preflight(to_number, body) for to_number, body in messages]
+
+
+def test_estimate_counts_invalid_numbers_as_rejected():
+    client = TestClient(app)
+
+    response = client.post("/sms/estimate", json={"messages": [
+        {"to_number": "+56 9 4837 2612", "message_body": "Hola"},
+        {"to_number": "not a number", "message_body": "Hola"},
+        {"to_number": NUMBER, "message_body": "Hola 👋"},
+    ]})
+
+    assert response.status_code == 200
+    estimate = response.json()
+    assert (estimate["accepted"], estimate["rejected"]) == (2, 1)
+    assert estimate["segments_by_encoding"] == {"GSM-7": 1, "UCS-2": 1}
+    assert estimate["items"][0]["to_number"] == NUMBER
+    assert estimate["items"][1]["error"].startswith("Invalid phone number")
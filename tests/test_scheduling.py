@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+from main import app
+from routes import sms as sms_routes
+from services.scheduler import SCHEDULING_DISABLED_ERROR
+from services.twilio_client import get_twilio_client
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(sms_routes, "SMS_SCHEDULING_ENABLED", False)
+    app.dependency_overrides[get_twilio_client] = lambda: object()
+    yield TestClient(app)
+    app.dependency_overrides.pop(get_twilio_client)
+
+
+def scheduled_message():
+    return {
+        "to_number": "+56948372612",
+        "message_body": "Recordatorio",
+        "scheduled_at": (datetime.now() + timedelta(hours=1)).isoformat(),
+    }
+
+
+def test_send_rejects_scheduled_messages_without_scheduler(client):
+    response = client.post("/sms/send", json=scheduled_message())
+
+    assert response.status_code == 422
+    assert response.json()["detail"] == SCHEDULING_DISABLED_ERROR
+
+
+def test_batch_rejects_scheduled_messages_without_scheduler(client):
+    response = client.post("/sms/send/batch", json={"messages": [scheduled_message(), scheduled_message()]})
+
+    assert response.status_code == 200
+    assert [item["success"] for item in response.json()] == [False, False]
+    assert response.json()[0]["error"] == f"Error: {SCHEDULING_DISABLED_ERROR}"
@@ -0,0 +1,44 @@
+import pytest
+from bson import ObjectId
+from fastapi.testclient import TestClient
+
+from main import app
+from routes import sms as sms_routes
+from services.twilio_client import get_twilio_client
+
+
+@pytest.fixture
+def queue_mode(monkeypatch):
+    queued = []
+
+    async def enqueue(sms_records):
+        queued.extend(sms_records)
+        return [ObjectId() for _ in sms_records]
+
+    async def no_twilio(*args, **kwargs):
+        raise AssertionError("queue mode must not call Twilio from the request")
+
+    monkeypatch.setattr(sms_routes, "SMS_SEND_MODE", "queue")
+    monkeypatch.setattr(sms_routes, "enqueue_sms_records", enqueue)
+    monkeypatch.setattr(sms_routes, "twilio_call", no_twilio)
+    monkeypatch.setenv("TWILIO_PHONE_NUMBER", "+15550000000")
+    app.dependency_overrides[get_twilio_client] = lambda: object()
+    yield TestClient(app), queued
+    app.dependency_overrides.pop(get_twilio_client)
+
+
+def test_batch_is_queued_in_queue_mode(queue_mode):
+    client, queued = queue_mode
+
+    response = client.post("/sms/send/batch", json={"messages": [
+        {"to_number": "+56 9 4837 2612", "message_body": "Hola"},
+        {"to_number": "not a number", "message_body": "Hola"},
+        {"to_number": "+56912345678", "message_body": "Chao"},
+    ]})
+
+    assert response.status_code == 200
+    responses = response.json()
+    assert [item["status"] for item in responses] == ["queued", None, "queued"]
+    assert not responses[1]["success"]
+    assert [record["to_number"] for record in queued] == ["+56948372612", "+56912345678"]
+    assert all(record["from_number"] == "+15550000000" for record in queued)
@@ -0,0 +1,174 @@
+import asyncio
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+from bson import ObjectId
+from twilio.base.exceptions import TwilioRestException
+
+from services import sms_queue as queue_module
+from services.sms_queue import SMSQueue, SMS_MAX_ATTEMPTS, is_retryable
+from services.twilio_client import TwilioCircuitOpen, TwilioUnavailable
+
+
+class FakeRateLimiter:
+    async def acquire(self, key):
+        pass
+
+
+class FakeStore:
+    """
+    Guarda las llamadas a las funciones de MongoDB que usa _process()
+    """
+
+    def __init__(self, renewed=True, completed=True):
+        self.renewed = renewed
+        self.completed = completed
+        self.calls = []
+
+    async def renew(self, record_id, claim_token, lock_seconds):
+        self.calls.append(("renew", record_id, claim_token))
+        return self.renewed
+
+    async def complete(self, record_id, claim_token, message_sid, from_number=None):
+        self.calls.append(("complete", record_id, claim_token, message_sid, from_number))
+        return self.completed
+
+    async def retry(self, record_id, claim_token, error, next_attempt_at, count_attempt=True):
+        self.calls.append(("retry", record_id, claim_token, count_attempt))
+        return True
+
+    async def fail(self, record_id, claim_token, error):
+        self.calls.append(("fail", record_id, claim_token, error))
+        return True
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = FakeStore()
+    monkeypatch.setattr(queue_module, "renew_queued_sms", store.renew)
+    monkeypatch.setattr(queue_module, "complete_queued_sms", store.complete)
+    monkeypatch.setattr(queue_module, "retry_queued_sms", store.retry)
+    monkeypatch.setattr(queue_module, "fail_queued_sms", store.fail)
+    return store
+
+
+def make_queue(monkeypatch, result):
+    """
+    Cola cuya llamada a Twilio retorna `result` (o lo lanza si es una excepción)
+    """
+    sent = []
+
+    async def fake_twilio_call(endpoint, call, **kwargs):
+        sent.append(endpoint)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(queue_module, "twilio_call", fake_twilio_call)
+    queue = SMSQueue(workers=1)
+    queue.rate_limiter = FakeRateLimiter()
+    return queue, sent
+
+
+def make_record(attempts=1):
+    return {
+        "_id": ObjectId(),
+        "claim_token": ObjectId(),
+        "to_number": "+56911111111",
+        "from_number": "+15550000000",
+        "message_body": "Hola",
+        "attempts": attempts,
+    }
+
+
+def test_sent_message_is_completed_with_its_claim_token(monkeypatch, store):
+    queue, sent = make_queue(monkeypatch, SimpleNamespace(sid="SM1"))
+    record = make_record()
+
+    asyncio.run(queue._process(record))
+
+    assert sent == ["messages.create"]
+    assert store.calls == [
+        ("renew", record["_id"], record["claim_token"]),
+        ("complete", record["_id"], record["claim_token"], "SM1", "+15550000000"),
+    ]
+
+
+def test_lost_lock_skips_the_send(monkeypatch, store):
+    # Otro worker tomó el mensaje mientras este esperaba el límite de tasa
+    store.renewed = False
+    queue, sent = make_queue(monkeypatch, SimpleNamespace(sid="SM1"))
+    record = make_record()
+
+    asyncio.run(queue._process(record))
+
+    assert sent == []
+    assert store.calls == [("renew", record["_id"], record["claim_token"])]
+
+
+def test_retryable_error_goes_back_to_the_queue(monkeypatch, store):
+    error = TwilioRestException(503, "https://api.twilio.com", msg="Service Unavailable")
+    queue, _ = make_queue(monkeypatch, error)
+    record = make_record()
+
+    asyncio.run(queue._process(record))
+
+    assert store.calls[-1] == ("retry", record["_id"], record["claim_token"], True)
+
+
+def test_open_circuit_does_not_count_as_an_attempt(monkeypatch, store):
+    queue, _ = make_queue(monkeypatch, TwilioCircuitOpen("messages.create", 5.0))
+    record = make_record()
+
+    asyncio.run(queue._process(record))
+
+    assert store.calls[-1] == ("retry", record["_id"], record["claim_token"], False)
+
+
+def test_last_attempt_fails_the_message(monkeypatch, store):
+    error = TwilioRestException(503, "https://api.twilio.com", msg="Service Unavailable")
+    queue, _ = make_queue(monkeypatch, error)
+    record = make_record(attempts=SMS_MAX_ATTEMPTS)
+
+    asyncio.run(queue._process(record))
+
+    action, record_id, claim_token, _ = store.calls[-1]
+    assert (action, record_id, claim_token) == ("fail", record["_id"], record["claim_token"])
+
+
+def test_permanent_error_fails_the_message(monkeypatch, store):
+    error = TwilioRestException(400, "https://api.twilio.com", msg="Invalid 'To' Phone Number", code=21211)
+    queue, _ = make_queue(monkeypatch, error)
+    record = make_record()
+
+    asyncio.run(queue._process(record))
+
+    assert store.calls[-1][0] == "fail"
+
+
+@pytest.mark.parametrize("error", [ValueError("bug"), KeyError("to_number"), AttributeError("sid")])
+def test_local_errors_fail_without_retrying(monkeypatch, store, error):
+    queue, _ = make_queue(monkeypatch, error)
+    record = make_record()
+
+    asyncio.run(queue._process(record))
+
+    assert store.calls[-1][0] == "fail"
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (TwilioRestException(429, "https://api.twilio.com"), True),
+    (TwilioRestException(400, "https://api.twilio.com", code=20429), True),
+    (TwilioRestException(502, "https://api.twilio.com"), True),
+    (TwilioRestException(400, "https://api.twilio.com", code=21211), False),
+    (TwilioUnavailable("Twilio messages.create did not answer within 15s"), True),
+    (asyncio.TimeoutError(), True),
+    (aiohttp.ClientConnectionError(), True),
+    (ConnectionResetError(), True),
+    (ValueError("bug"), False),
+    (KeyError("bug"), False),
+    (AttributeError("bug"), False),
+])
+def test_is_retryable(error, retryable):
+    assert is_retryable(error) is retryable
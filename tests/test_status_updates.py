@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+from services import status_updates as status_module
+from services.status_updates import StatusCoalescer
+
+
+@pytest.fixture
+def applied(monkeypatch):
+    """
+    Reemplaza apply_status_updates(); los SID de `missing` no tienen documento
+    """
+    calls = []
+    missing = set()
+
+    async def fake_apply(updates):
+        calls.append(sorted(updates))
+        return [message_sid for message_sid, _, _ in updates if message_sid in missing]
+
+    monkeypatch.setattr(status_module, "apply_status_updates", fake_apply)
+    return calls, missing
+
+
+def test_keeps_the_most_advanced_status():
+    coalescer = StatusCoalescer(flush_ms=500, batch_size=100)
+
+    coalescer.add("SM1", "sent")
+    coalescer.add("SM1", "delivered")
+    coalescer.add("SM1", "sent")  # llega desordenado
+
+    assert coalescer._pending == {"SM1": ("delivered", None)}
+    assert coalescer.received == 3
+
+
+def test_ignores_unknown_statuses():
+    coalescer = StatusCoalescer(flush_ms=500, batch_size=100)
+
+    coalescer.add("SM1", "not-a-status")
+
+    assert coalescer._pending == {}
+
+
+def test_full_batch_wakes_the_flush():
+    coalescer = StatusCoalescer(flush_ms=500, batch_size=2)
+
+    coalescer.add("SM1", "sent")
+    assert not coalescer._full.is_set()
+    coalescer.add("SM2", "sent")
+    assert coalescer._full.is_set()
+
+
+def test_flush_applies_one_update_per_message(applied):
+    calls, _ = applied
+    coalescer = StatusCoalescer(flush_ms=500, batch_size=100)
+    coalescer.add("SM1", "sent")
+    coalescer.add("SM1", "failed", 30003)
+    coalescer.add("SM2", "delivered")
+
+    asyncio.run(coalescer.flush())
+
+    assert calls == [[("SM1", "failed", 30003), ("SM2", "delivered", None)]]
+    assert coalescer.applied == 2
+    assert coalescer._pending == {}
+
+
+def test_status_before_the_record_is_retried(applied):
+    calls, missing = applied
+    missing.add("SM1")
+    coalescer = StatusCoalescer(flush_ms=500, batch_size=100)
+    coalescer.add("SM1", "sent")
+
+    asyncio.run(coalescer.flush())
+    assert coalescer._pending == {"SM1": ("sent", None)}
+    assert coalescer.applied == 0
+
+    # El envío ya se guardó
+    missing.clear()
+    asyncio.run(coalescer.flush())
+
+    assert calls[-1] == [("SM1", "sent", None)]
+    assert coalescer.applied == 1
+    assert coalescer.stats()["waiting_for_record"] == 0
+
+
+def test_orphan_status_is_dropped_after_its_ttl(applied):
+    _, missing = applied
+    missing.add("SM1")
+    coalescer = StatusCoalescer(flush_ms=500, batch_size=100, orphan_ttl=0)
+    coalescer.add("SM1", "sent")
+
+    asyncio.run(coalescer.flush())
+
+    assert coalescer._pending == {}
+    assert coalescer.dropped == 1
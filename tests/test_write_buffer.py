@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo import InsertOne
+from pymongo.errors import AutoReconnect
+
+from database import mongodb
+from database.mongodb import WriteBehindBuffer
+
+
+class FlakyCollection:
+    """
+    Colección cuyo bulk_write falla las primeras `failures` veces
+    """
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.calls = 0
+        self.saved = []
+
+    async def bulk_write(self, operations, ordered=False):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise AutoReconnect("connection refused")
+        self.saved.extend(operations)
+        return SimpleNamespace(inserted_count=len(operations), modified_count=0, upserted_count=0)
+
+
+@pytest.fixture
+def collection(monkeypatch):
+    def install(failures):
+        collection = FlakyCollection(failures)
+        monkeypatch.setattr(mongodb, "db", {"sms_records": collection})
+        return collection
+    return install
+
+
+def make_buffer(retries):
+    return WriteBehindBuffer(batch_size=10, flush_ms=10, max_pending=100, retries=retries, retry_seconds=0)
+
+
+def make_batch():
+    return [("sms_records", InsertOne({"n": n})) for n in range(3)]
+
+
+def test_short_outage_is_retried(collection):
+    flaky = collection(failures=2)
+    buffer = make_buffer(retries=3)
+
+    asyncio.run(buffer._flush(make_batch()))
+
+    assert len(flaky.saved) == 3
+    assert (buffer.written, buffer.errors, buffer.retried) == (3, 0, 2)
+
+
+def test_batch_is_dropped_and_logged_after_the_retries(collection, caplog):
+    flaky = collection(failures=10)
+    buffer = make_buffer(retries=2)
+
+    asyncio.run(buffer._flush(make_batch()))
+
+    assert flaky.calls == 3
+    assert (buffer.written, buffer.errors) == (0, 3)
+    assert any(record.message == "write_buffer_batch_dropped" for record in caplog.records)